@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+"""
+Compresses many images in one run, as compressor.py does one. Every variant
+of every image is planned up front and run in one pool, the results are
+reviewed in one gallery, and the uploads share one set of connections.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+from scaler import ImgScaler
+from planner import CommandPlan, PlanNode
+from selection import SelectionPolicy
+from compressor import ImgConvertor, CompressorException, Uploader, \
+    UploadOptions, IMG_SUFFIXES, TRANSPORTS, get_variants, write_gallery, \
+    get_found_encoders, get_suffixes, get_unwritable, at_effort, EFFORTS, \
+    require_scoring
+from engines import ENGINES
+import common_funcs as cmn
+
+
+class BatchImage:
+    """One image of a batch, with its own subdirectory of the batch's root."""
+    def __init__(self, img_name: str, subdir_root: str):
+        self.img_name = img_name
+        self.w, self.h = cmn.get_img_wxh(img_name)
+        scaler = ImgScaler(self.w, self.h)
+        self.widths_and_heights, _ = scaler.get_widths_and_heights()
+        self.processor = ImgConvertor(
+            img_name, self.widths_and_heights, subdir_root)
+        self.processor.named_sizes = scaler.get_named_sizes()
+        self.subdir_names = []
+        # Seconds into generation when its last command finished.
+        self.generated_in = 0.0
+        self.chosen_dir = None
+        self.error = None
+
+
+def find_images(sources: List[str]) -> List[str]:
+    """
+    :param sources: image files, directories of them, globs, or @file_list
+        naming one image per line.
+    :return: the images, each once, in the order given.
+    """
+    img_names = []
+    for source in sources:
+        if source.startswith("@"):
+            with open(source[1:]) as f_in:
+                found = [line.strip() for line in f_in if line.strip()]
+        elif os.path.isdir(source):
+            found = sorted(
+                os.path.join(source, name) for name in os.listdir(source)
+                if name.split(".")[-1] in IMG_SUFFIXES)
+        elif glob.has_magic(source):
+            found = sorted(glob.glob(source))
+        else:
+            found = [source]
+        for img_name in found:
+            if not os.path.isfile(img_name):
+                raise FileNotFoundError("\"{}\" not found.".format(img_name))
+            if img_name not in img_names:
+                img_names.append(img_name)
+    return img_names
+
+
+def get_subdir_roots(img_names: List[str], root: str = "tmp/") -> List[str]:
+    """:return: a subdirectory of root per image, named for its stem."""
+    subdir_roots = []
+    for img_name in img_names:
+        stem = Path(img_name).stem
+        subdir_root = "{}{}/".format(root, stem)
+        n = 2
+        while subdir_root in subdir_roots:
+            subdir_root = "{}{}-{}/".format(root, stem, n)
+            n += 1
+        subdir_roots.append(subdir_root)
+    return subdir_roots
+
+
+def generate_all(images: List[BatchImage], variants, jobs: int = 1,
+                 pipeline: bool = False, resume: bool = False) -> float:
+    """
+    Plans every variant of every image into one CommandPlan and runs it in
+    one pool, so that no image waits on another to finish. Each image's
+    decoded source is dropped once its last command has run, rather than
+    every image's being held until the batch is done.
+
+    :param resume: skip what the images' checkpoints have done already.
+    :return: seconds taken.
+    """
+    plan = CommandPlan()
+    image_of = {}
+    for image in images:
+        if resume and image.processor.restore_choice():
+            continue
+        _, image.subdir_names = image.processor.plan_all(
+            image.processor.restore_variants(variants), pipeline, plan)
+        for subdir_name in image.subdir_names:
+            image_of[subdir_name] = image
+            Path(subdir_name).mkdir(parents=True, exist_ok=True)
+    # Commands yet to run, by image.
+    remaining = {}
+    for node in plan.nodes:
+        image = image_of[next(iter(node.owners))]
+        remaining[id(image)] = remaining.get(id(image), 0) + 1
+    lock = threading.Lock()
+    start = time.monotonic()
+
+    def run_node(node: PlanNode) -> None:
+        # Identical commands only merge within an image, whose source they
+        # read, so any owner will do.
+        image = image_of[next(iter(node.owners))]
+        try:
+            image.processor.run_plan_node(node)
+            image.generated_in = max(image.generated_in,
+                                     time.monotonic() - start)
+        finally:
+            with lock:
+                remaining[id(image)] -= 1
+                done = remaining[id(image)] == 0
+            if done:
+                image.processor.remove_decoded_source()
+
+    errors = plan.run(run_node, jobs)
+    for tmp_img in plan.tmp_imgs:
+        Path(tmp_img).unlink(missing_ok=True)
+    for image in images:
+        image.processor.collect_plan(plan, image.subdir_names, errors)
+    return time.monotonic() - start
+
+
+def write_batch_manifest(images: List[BatchImage],
+                         manifest_file: str = "manifest.json") -> None:
+    with open(manifest_file, "w") as f_out:
+        json.dump({"images": [image.processor.get_manifest()
+                              for image in images]}, f_out, indent=2)
+
+
+def present_batch_gallery(images: List[BatchImage]) -> None:
+    """One gallery of every image's variants, headed by image."""
+    gallery_list = []
+    for image in images:
+        for heading, img_paths in image.processor.get_gallery_list(
+                image.processor.widths_and_heights, image.w, image.h):
+            gallery_list.append(["{}: {}".format(
+                Path(image.img_name).name, heading), img_paths])
+    write_gallery(gallery_list)
+
+
+def choose_and_upload(image: BatchImage, variants, conf_file: str,
+                      uploader: Uploader, policy: SelectionPolicy = None,
+                      lazy: bool = False, jobs: int = 1,
+                      final_variants=None) -> None:
+    """
+    :param final_variants: if the variants were rendered at a lower effort,
+        them at max, to encode the chosen one again with.
+    """
+    processor = image.processor
+    print("{}:".format(image.img_name))
+    if policy:
+        image.chosen_dir = processor.auto_select(policy)
+    else:
+        image.chosen_dir = processor.select_one()
+    if final_variants:
+        processor.reencode_variant(image.chosen_dir, final_variants, jobs)
+    if lazy:
+        processor.complete_variant(
+            image.chosen_dir, final_variants or variants,
+            image.widths_and_heights, jobs)
+    try:
+        processor.upload(image.chosen_dir, conf_file, uploader)
+    except Exception:
+        processor.delete_other_dirs(image.chosen_dir)
+        raise
+    shutil.rmtree(processor.subdir_root)
+
+
+def print_report(images: List[BatchImage], generation_s: float,
+                 total_s: float) -> None:
+    n_variants = 0
+    for image in images:
+        n_variants += len(image.processor.all_dirs)
+        print("{}: {} variants generated in {:.1f}s, {}".format(
+            image.img_name, len(image.processor.all_dirs), image.generated_in,
+            "failed: {}".format(image.error) if image.error else
+            "uploaded {}".format(image.chosen_dir)))
+    print("{} images, {} variants generated in {:.1f}s, {:.1f} images/min; "
+          "{:.1f}s in all.".format(
+              len(images), n_variants, generation_s,
+              60 * len(images) / max(generation_s, 1e-6), total_s))
+
+
+def compress_batch(
+        img_names: List[str],
+        conf_file: str = "config.json",
+        skip_jpg: bool = True, skip_png: bool = False, skip_webp: bool = False,
+        fullsize_only: bool = False, jobs: int = 1, pipeline: bool = False,
+        share_resizes: bool = False, resize_cache_mb: int = 512,
+        lazy: bool = False, score: bool = False, auto_select: str = None,
+        cache_dir: str = None, cache_mb: int = 1024, resume: bool = False,
+        one_trip: bool = False, transport: str = "sftp",
+        sftp_channels: int = 1, sftp_window_kb: int = None,
+        sftp_packet_kb: int = None, delta: bool = False,
+        overlap: bool = False, prescaled: bool = False,
+        engine: str = "imagemagick", encoders: bool = False,
+        skip_avif: bool = True, skip_jxl: bool = True, effort: str = None):
+    """
+    As compressor.resize, for many images. An image failing to upload is
+    reported, its chosen variant kept in its subdirectory, and the batch
+    carries on with the next.
+
+    :param img_names: see find_images.
+    :raises CompressorException: once done, if any image failed.
+    """
+    start = time.monotonic()
+    policy = None
+    if auto_select is not None:
+        try:
+            policy = SelectionPolicy.parse(auto_select)
+        except ValueError as verr:
+            raise CompressorException(str(verr))
+        score = score or policy.needs_scores()
+    if score:
+        require_scoring()
+    if engine != "imagemagick" and pipeline:
+        raise CompressorException(
+            "Pipelining is ImageMagick's, the {} engine decodes each source "
+            "once anyway.".format(engine))
+    unwritable = get_unwritable(get_suffixes(True, True, True, skip_avif,
+                                             skip_jxl))
+    skip_avif = skip_avif or "avif" in unwritable
+    skip_jxl = skip_jxl or "jxl" in unwritable
+    if not skip_jxl and not prescaled:
+        print("WordPress won't take jxl uploaded, only --prescaled, "
+              "skipping its variants.")
+        skip_jxl = True
+    variants = get_variants(skip_jpg, skip_png, skip_webp, fullsize_only,
+                            share_resizes,
+                            get_found_encoders() if encoders else [],
+                            skip_avif, skip_jxl, effort)
+    final_variants = None
+    if effort not in (None, "max"):
+        final_variants = [at_effort(v, "max") for v in variants]
+    images = [BatchImage(img_name, subdir_root) for img_name, subdir_root
+              in zip(img_names, get_subdir_roots(img_names))]
+    try:
+        for image in images:
+            if share_resizes:
+                image.processor.use_resize_cache(
+                    resize_cache_mb * 1024 * 1024)
+            if cache_dir:
+                image.processor.use_output_cache(
+                    cache_dir, cache_mb * 1024 * 1024)
+            image.processor.use_checkpoint(variants, resume)
+            image.processor.use_engine(engine)
+            if score:
+                image.processor.use_scorer()
+            image.processor.upload_options = UploadOptions(
+                one_trip, transport, sftp_channels, sftp_window_kb,
+                sftp_packet_kb, delta, overlap, prescaled)
+            if lazy:
+                image.processor.widths_and_heights = \
+                    image.widths_and_heights[:1]
+        generation_s = generate_all(images, variants, jobs, pipeline, resume)
+        # Only lazy completion needs a source again, and decodes it anew.
+        for image in images:
+            image.processor.remove_decoded_source()
+        # Only what was resumed rather than generated is left to score.
+        if score:
+            for image in images:
+                image.processor.score_all(jobs)
+        present_batch_gallery(images)
+        write_batch_manifest(images)
+        uploader = Uploader(conf_file)
+        try:
+            for image in images:
+                try:
+                    choose_and_upload(image, variants, conf_file, uploader,
+                                      policy, lazy, jobs, final_variants)
+                except Exception as err:
+                    image.error = err
+                    print("{} failed: {}".format(image.img_name, err),
+                          file=sys.stderr)
+                    # The connections may be what failed.
+                    uploader.close()
+        finally:
+            uploader.close()
+        write_batch_manifest(images)
+    finally:
+        for image in images:
+            if image.processor.resize_cache:
+                image.processor.resize_cache.clear()
+    print_report(images, generation_s, time.monotonic() - start)
+    failed = [image.img_name for image in images if image.error]
+    if failed:
+        raise CompressorException("{} of {} images failed: {}".format(
+            len(failed), len(images), ", ".join(failed)))
+
+
+def process_args(args_list: List[str]):
+    parser = argparse.ArgumentParser(
+        description="Image manipulation for WordPress, as compressor.py, "
+                    "for many images at once.")
+    parser.add_argument(
+        "sources", nargs="+",
+        help="Images, directories of them, globs, or @file naming one image "
+             "per line.")
+    parser.add_argument(
+        "-j", "--skip_jpg_generation",
+        help="Don't bother producing jpeg outputs as it has largely been superseded by webp.",
+        action="store_true")
+    parser.add_argument(
+        "-p", "--skip_png_generation",
+        help="Don't bother producing png outputs as they aren't efficient for photos.",
+        action="store_true")
+    parser.add_argument(
+        "-w", "--skip_webp_generation",
+        help="Don't bother producing webp outputs as they were only recently introduced.",
+        action="store_true")
+    parser.add_argument(
+        "--avif_generation",
+        help="Also produce avif outputs, as compressor.py.",
+        action="store_true")
+    parser.add_argument(
+        "--jxl_generation",
+        help="Also produce JPEG XL outputs, with --prescaled, as "
+             "compressor.py.",
+        action="store_true")
+    parser.add_argument(
+        "-f", "--fullsize_only",
+        help="Don't resize the originals, produce only full size copies.",
+        action="store_true")
+    parser.add_argument(
+        "-c", "--config_file",
+        help="Name of json file describing containing WordPress credentials.",
+        default="config.json")
+    parser.add_argument(
+        "--jobs",
+        help="How many ImageMagick commands to run at once, across images, "
+             "variants and sizes.",
+        type=int, default=1)
+    parser.add_argument(
+        "--pipeline",
+        help="Run one ImageMagick process per variant, writing every size "
+             "from a single decode of the source.",
+        action="store_true")
+    parser.add_argument(
+        "--share_resizes",
+        help="Resize each source to each size once, losslessly, and encode "
+             "every quality and format from that.",
+        action="store_true")
+    parser.add_argument(
+        "--resize_cache_mb",
+        help="Disk allowed each image's shared resizes.",
+        type=int, default=512)
+    parser.add_argument(
+        "--lazy",
+        help="Render only the full and smallest sizes to choose between, "
+             "then the other sizes for the chosen variants alone.",
+        action="store_true")
+    parser.add_argument(
+        "--score",
+        help="Score every image against its source, by SSIM and PSNR. "
+             "Needs numpy.",
+        action="store_true")
+    parser.add_argument(
+        "--auto_select",
+        help="Choose unattended by this policy, as compressor.py.",
+        metavar="POLICY")
+    parser.add_argument(
+        "--cache_dir",
+        help="Keep every output here and reuse them on later runs, as "
+             "compressor.py.")
+    parser.add_argument(
+        "--cache_mb",
+        help="Disk allowed --cache_dir.",
+        type=int, default=1024)
+    parser.add_argument(
+        "--resume",
+        help="Carry on from where a failed run stopped, image by image, as "
+             "compressor.py.",
+        action="store_true")
+    parser.add_argument(
+        "--one_trip",
+        help="Install each image's sizes with one remote command, as "
+             "compressor.py.",
+        action="store_true")
+    parser.add_argument(
+        "--transport",
+        help="Stage the sizes on the server by SFTP or as one tar stream, as "
+             "compressor.py.",
+        choices=TRANSPORTS, default="sftp")
+    parser.add_argument(
+        "--sftp_channels",
+        help="By SFTP, put this many sizes at once, as compressor.py.",
+        type=int, default=1)
+    parser.add_argument(
+        "--sftp_window_kb",
+        help="Each SFTP channel's window, as compressor.py.",
+        type=int)
+    parser.add_argument(
+        "--sftp_packet_kb",
+        help="Each SFTP channel's largest packet, as compressor.py.",
+        type=int)
+    parser.add_argument(
+        "--delta",
+        help="Send only the sizes which differ from the server's, as "
+             "compressor.py.",
+        action="store_true")
+    parser.add_argument(
+        "--overlap",
+        help="Stage each image's sizes while uploading it, as compressor.py.",
+        action="store_true")
+    parser.add_argument(
+        "--prescaled",
+        help="Insert each image's attachment, of the sizes made here, by "
+             "WP-CLI, as compressor.py.",
+        action="store_true")
+    parser.add_argument(
+        "--engine",
+        help="Run the variants' convert commands with ImageMagick or in "
+             "process with Pillow, as compressor.py.",
+        choices=ENGINES, default="imagemagick")
+    parser.add_argument(
+        "--encoders",
+        help="Also make each format with whichever dedicated encoders are "
+             "installed, as compressor.py.",
+        action="store_true")
+    parser.add_argument(
+        "--effort",
+        help="How hard the encoders try rendering the variants, the chosen "
+             "ones encoded again at max, as compressor.py.",
+        choices=EFFORTS)
+    args = parser.parse_args(args_list)
+    compress_batch(
+        find_images(args.sources),
+        args.config_file,
+        args.skip_jpg_generation,
+        args.skip_png_generation,
+        args.skip_webp_generation,
+        args.fullsize_only,
+        jobs=args.jobs,
+        pipeline=args.pipeline,
+        share_resizes=args.share_resizes,
+        resize_cache_mb=args.resize_cache_mb,
+        lazy=args.lazy,
+        score=args.score,
+        auto_select=args.auto_select,
+        cache_dir=args.cache_dir,
+        cache_mb=args.cache_mb,
+        resume=args.resume,
+        one_trip=args.one_trip,
+        transport=args.transport,
+        sftp_channels=args.sftp_channels,
+        sftp_window_kb=args.sftp_window_kb,
+        sftp_packet_kb=args.sftp_packet_kb,
+        delta=args.delta,
+        overlap=args.overlap,
+        prescaled=args.prescaled,
+        engine=args.engine,
+        encoders=args.encoders,
+        skip_avif=not args.avif_generation,
+        skip_jxl=not args.jxl_generation,
+        effort=args.effort
+    )
+
+
+def main(args_list: List[str]):
+    process_args(args_list)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
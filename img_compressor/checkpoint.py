@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+from typing import Optional
+
+
+class Checkpoint:
+    """
+    One image's progress through generating, choosing and uploading, saved
+    to a JSON file after each step so that a failed run can be resumed from
+    the last step completed.
+
+    A checkpoint only applies to the same source, by hash, and the same
+    plan, by a hash of the variants and sizes it was to generate.
+    """
+    def __init__(self, checkpoint_file: str, src_hash: str, plan_hash: str):
+        self.checkpoint_file = checkpoint_file
+        self.lock = threading.Lock()
+        self.state = {
+            "src_hash": src_hash,
+            "plan_hash": plan_hash,
+            # subdir_name -> bytes, of each variant generated.
+            "variants": {},
+            "chosen_dir": None,
+            # Whether a lazily generated choice has all its sizes.
+            "completed": False,
+            # The choice once encoded again at max effort, see at_effort.
+            "reencoded": None,
+            # The media's id and media_details from upload_media.
+            "media": None,
+            # Remote files replace_generated_sizes has moved into place.
+            "replaced": [],
+        }
+
+    def load(self) -> bool:
+        """:return: whether there was a checkpoint for this source and plan."""
+        try:
+            with open(self.checkpoint_file) as f_in:
+                state = json.load(f_in)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        if (state.get("src_hash"), state.get("plan_hash")) != \
+                (self.state["src_hash"], self.state["plan_hash"]):
+            return False
+        self.state.update(state)
+        return True
+
+    def save(self) -> None:
+        with self.lock:
+            part = self.checkpoint_file + ".part"
+            with open(part, "w") as f_out:
+                json.dump(self.state, f_out, indent=2)
+            os.replace(part, self.checkpoint_file)
+
+    def variant_done(self, subdir_name: str, total_b: int) -> None:
+        self.state["variants"][subdir_name] = total_b
+        self.save()
+
+    def variant_bytes(self, subdir_name: str) -> Optional[int]:
+        if not os.path.isdir(subdir_name):
+            return None
+        return self.state["variants"].get(subdir_name)
+
+    def chose(self, chosen_dir: str) -> None:
+        self.state["chosen_dir"] = chosen_dir
+        self.save()
+
+    def get_choice(self) -> Optional[str]:
+        """:return: the chosen subdir_name, if it is still there."""
+        chosen_dir = self.state["chosen_dir"]
+        if chosen_dir and self.variant_bytes(chosen_dir) is not None:
+            return chosen_dir
+        return None
+
+    def completed(self) -> None:
+        self.state["completed"] = True
+        self.save()
+
+    def reencoded(self, chosen_dir: str) -> None:
+        self.state["reencoded"] = chosen_dir
+        self.save()
+
+    def media_uploaded(self, media: dict) -> None:
+        self.state["media"] = media
+        self.save()
+
+    def replaced(self, rmt_name: str) -> None:
+        self.state["replaced"].append(rmt_name)
+        self.save()
@@ -1,21 +1,110 @@
+import hashlib
+import os
+import re
 import subprocess
-from typing import List, Dict, Any
+from contextlib import ExitStack
+from typing import List, Dict, Any, Optional, Tuple
+
+import img_header
+
+
+def split_redirects(cmd: List[str]) -> Tuple[List[str], Optional[str],
+                                             Optional[str]]:
+    """
+    Commands may end, as in a shell, with "< file" and/or "> file", for
+    programs which only read stdin or write stdout. Their output is then
+    still their last argument.
+
+    :return: cmd less those, the file to read stdin from and the file to
+        write stdout to, or None.
+    """
+    redirects = {"<": None, ">": None}
+    while len(cmd) > 2 and cmd[-2] in redirects:
+        redirects[cmd[-2]] = cmd[-1]
+        cmd = cmd[:-2]
+    return cmd, redirects["<"], redirects[">"]
+
+
+def run_redirected(cmd: List[str]) -> subprocess.CompletedProcess:
+    """subprocess.run, capturing output, save where cmd redirects it."""
+    cmd, stdin_name, stdout_name = split_redirects(cmd)
+    if stdin_name is None and stdout_name is None:
+        return subprocess.run(cmd, capture_output=True)
+    with ExitStack() as stack:
+        stdin = stdout = None
+        if stdin_name:
+            stdin = stack.enter_context(open(stdin_name, "rb"))
+        if stdout_name:
+            stdout = stack.enter_context(open(stdout_name, "wb"))
+        result = subprocess.run(
+            cmd, stdin=stdin, stdout=stdout or subprocess.PIPE,
+            stderr=subprocess.PIPE)
+    if stdout_name:
+        result.stdout = b""
+    return result
 
 
 def run_shell_cmd(cmd: List[str]):
-    result = subprocess.run(cmd, capture_output=True)
+    result = run_redirected(cmd)
     result_text = None
     if result.returncode == 0:
         result_text = result.stdout.decode()
     return result_text
 
 
+def run_shell_cmd_or_raise(cmd: List[str]) -> str:
+    """
+    Like run_shell_cmd, but a non-zero exit raises, carrying stderr, rather
+    than being reduced to None.
+    """
+    result = run_redirected(cmd)
+    if result.returncode != 0:
+        raise RuntimeError("\"{}\" exited {}: {}".format(
+            " ".join(cmd), result.returncode, result.stderr.decode().strip()))
+    return result.stdout.decode()
+
+
+def get_file_sha256(file_name: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_name, "rb") as f_in:
+        for chunk in iter(lambda: f_in.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_imagemagick_version() -> str:
+    """:return: the first line of convert -version, naming the release."""
+    return run_shell_cmd_or_raise(["convert", "-version"]).splitlines()[0]
+
+
+def get_imagemagick_formats() -> Dict[str, str]:
+    """
+    :return: each format convert -list format lists, in lower case, and its
+        mode, e.g. "rw+" for one read, written and written as many frames.
+        Those its delegate libraries weren't built with are missing.
+    """
+    formats = {}
+    for line in run_shell_cmd_or_raise(["convert", "-list", "format"]).splitlines():
+        # "     AVIF  HEIC      rw+   AV1 Image File Format", the module
+        # column only in some releases.
+        match = re.match(r"\s*([\w-]+)\*?\s+(?:\w+\s+)?([r-][w-][+-])\s", line)
+        if match:
+            formats[match.group(1).lower()] = match.group(2)
+    return formats
+
+
 def get_file_size(file_name: str):
-    result_text = run_shell_cmd(['stat', '-c' '%s %n', file_name])
-    return result_text.split()[0]
+    return str(os.path.getsize(file_name))
 
 
 def get_img_wxh(file_name: str) -> List[int]:
+    """
+    :return: width and height, from the header where img_header can read it,
+        else by identify.
+    """
+    wxh = img_header.read_wxh(file_name)
+    if wxh is not None:
+        return list(wxh)
     result_text = run_shell_cmd(['identify', '-ping', '-format', '"%wx%h"', file_name])
     return list(map(int, result_text.strip("\"").split("x")))
 
@@ -40,5 +129,58 @@ def split_fstring_not_args(f_str_vars: Dict[str, Any], in_fstr: str) -> List[str
     return rebuilt_cmd
 
 
+def get_psnr(img_a: str, img_b: str) -> float:
+    """
+    :return: peak signal to noise ratio in dB, per ImageMagick's compare,
+        inf when identical.
+    """
+    # compare exits 1 merely because the images differ, 2 on error.
+    result = subprocess.run(
+        ['compare', '-metric', 'PSNR', img_a, img_b, 'null:'],
+        capture_output=True)
+    if result.returncode > 1:
+        raise RuntimeError("compare {} {}: {}".format(
+            img_a, img_b, result.stderr.decode().strip()))
+    return float(result.stderr.decode().split()[0])
+
+
 def get_name_decor(w: int, h: int, ext: str):
-    return '-{}x{}.{}'.format(w, h, ext)
\ No newline at end of file
+    return '-{}x{}.{}'.format(w, h, ext)
+
+def pipeline_convert_cmds(split_cmds: List[List[str]]) -> List[str]:
+    """
+    Combines split convert commands, each of the form
+    "convert [ops...] input output", into a single convert which decodes the
+    first command's input once, to mpr: memory, and -write's every output
+    from clones of it.
+
+    An output which a later command reads is taken to be an intermediate and
+    is kept in mpr: rather than written to disk. Any other input, such as a
+    {resized_src}, is read from disk where it's needed. Each command's operations
+    get their own parentheses, with -respect-parentheses so that settings
+    such as -quality don't leak between them, as they couldn't between
+    processes. The last keeps its image, for convert to have something to
+    write to null: rather than fail with "no images defined".
+
+    :param split_cmds: in the order they would be run separately.
+    :return: one split command.
+    """
+    for split_cmd in split_cmds:
+        if split_cmd[0] != "convert" or len(split_cmd) < 3:
+            raise ValueError("Cannot pipeline: {}".format(" ".join(split_cmd)))
+    src_img = split_cmds[0][-2]
+    inputs = {split_cmd[-2] for split_cmd in split_cmds}
+    registers = {src_img: "mpr:src"}
+    pipeline = ["convert", "-respect-parentheses", src_img,
+                "-write", "mpr:src", "+delete"]
+    for split_cmd in split_cmds:
+        *ops, input_img, output_img = split_cmd[1:]
+        if output_img in inputs:
+            registers[output_img] = "mpr:tmp{}".format(len(registers))
+            output_img = registers[output_img]
+        pipeline += ["(", registers.get(input_img, input_img), *ops,
+                     "-write", output_img, "+delete", ")"]
+    # The last group's "+delete", keeping its image for null: to write.
+    del pipeline[-2]
+    pipeline.append("null:")
+    return pipeline
@@ -14,29 +14,99 @@ Alternative gallery libraries include include pillow (about 12MB) or
 matplotlib together with numpy (about 130MB).
 """
 import argparse
+import hashlib
 import json
 import os
+import re
+import shlex
 import shutil
 import sys
-from pathlib import Path
-from typing import List, Tuple
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, nullcontext
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Tuple, NamedTuple, Optional
 
 import requests.exceptions
 from jinja2 import Template
 
 # print(sys.path)
 
-from paramiko_client import get_client, execute_remotely, filter_dict_for_creds
+from paramiko import SSHClient
+
+from paramiko_client import get_client, execute_remotely, \
+    filter_dict_for_creds, install_files, put_tar, put_concurrently, \
+    get_remote_sha256s
 from wp_api.api_app import WP_API
 from scaler import DimsList, ImgScaler
+from resize_cache import ResizeCache
+from output_cache import OutputCache
+from checkpoint import Checkpoint
+from wp_attachment import get_attachment_metadata, insert_attachment
+from planner import CmdChain, CommandPlan, PlanNode
+from engines import ENGINES, get_engine
+from encoders import ENCODERS, ENCODER_EFFORTS, find_encoders, \
+    get_encode_cmds, get_encoded_by, get_encoder_version
+from quality_search import VariantFamily, Measurement, QualitySearch
+from scoring import Score, Scorer, require_numpy
+from selection import Candidate, SelectionPolicy
 import common_funcs as cmn
 # from common_funcs import *
 
 
+# Source formats resize accepts.
+IMG_SUFFIXES = ["png", "jpg", "jpeg", "webp"]
+
+
 class CompressorException(Exception):
     pass
 
 
+class Variant(NamedTuple):
+    """The arguments to ImgConvertor.transform_to_dir, as one candidate."""
+    q: int
+    suffix: str
+    descriptive: str
+    unscaled_cmd: str
+    scaling_cmds: List[str]
+
+
+class UploadOptions(NamedTuple):
+    """How replace_generated_sizes gets the sizes into place on the server."""
+    # Stage every size, then install them all with one remote command,
+    # rather than a round trip to install each.
+    one_trip: bool = False
+    # How the sizes are staged: "sftp", a put apiece, or "tar", one stream
+    # of them all, see put_tar.
+    transport: str = "sftp"
+    # By SFTP, put this many sizes at once, each over its own channel, see
+    # put_concurrently.
+    sftp_channels: int = 1
+    # Each SFTP channel's window and largest packet, paramiko's defaults if
+    # None.
+    sftp_window_kb: Optional[int] = None
+    sftp_packet_kb: Optional[int] = None
+    # Hash the sizes on the server first, and send only those which differ.
+    delta: bool = False
+    # Connect by SSH and stage the sizes while uploading the media, see
+    # upload_while_staging. There's nothing to compare a fresh upload's
+    # sizes with, so delta only applies to resuming.
+    overlap: bool = False
+    # Make the attachment of the sizes made here, thumbnail and all, with no
+    # REST upload for WordPress to resize again, see upload_prescaled.
+    prescaled: bool = False
+
+    def puts_concurrently(self) -> bool:
+        return self.transport == "sftp" and (
+            self.sftp_channels > 1 or self.sftp_window_kb is not None
+            or self.sftp_packet_kb is not None)
+
+
+TRANSPORTS = ("sftp", "tar")
+STAGING_DIR = "/tmp/stagingtmp"
+
+
 class ImgConvertor:
     """
     Subclasses should wrap the IMagick calls that process their respective
@@ -53,25 +123,289 @@ class ImgConvertor:
         """
         self.img_name = img_name
         self.stem_name = Path(self.img_name).stem
+        # What the commands read as {src_img}, see decode_source.
+        self.src_img = img_name
+        # Provides {resized_src} when set, see use_resize_cache.
+        self.resize_cache = None
+        # Set by use_output_cache.
+        self.output_cache = None
+        self.src_hash = None
+        # Output path -> the output_cache key of what wrote it.
+        self.output_keys = {}
+        # Set by use_checkpoint.
+        self.checkpoint = None
+        # Where the sizes are put, on the server, before being installed.
+        self.staging_dir = STAGING_DIR
+        # Runs the commands in process, see use_engine, rather than convert.
+        self.engine = None
+        self.upload_options = UploadOptions()
         self.widths_and_heights = widths_and_heights
         self.subdir_root = subdir_root
         if subdir_root and not subdir_root.endswith("/"):
             self.subdir_root  += "/"
         # Each *must* begin with the image format extension of its contents.
         self.all_dirs = []
+        # subdir_name -> the Variant which made it, see get_variant_of.
+        self.variants = {}
+        # (subdir_name, error) of variants which failed under transform_all.
+        self.failed_dirs = []
+        # subdir_name -> what encoded it, and in how many seconds of its
+        # commands, for the summary, gallery and manifest.
+        self.encoded_by = {}
+        self.encode_s = {}
+        # subdir_name -> "full" or "WxH" -> Score, see score_all.
+        self.scores = {}
+        self.scores_lock = threading.Lock()
+        # Set by use_scorer, or score_all.
+        self.scorer = None
+        # Path of each image planned, while scoring -> (subdir_name, size),
+        # so run_plan_node knows what it has written.
+        self.scored_as = {}
+        # The chosen subdir_name and why, for the manifest.
+        self.selection = None
+        # WordPress' name for each size, and the thumbnail, see
+        # ImgScaler.get_named_sizes, for upload_prescaled.
+        self.named_sizes: Dict[str, Tuple[int, int]] = {}
+
+    def decode_source(self) -> str:
+        """
+        Decodes the source, once, into ImageMagick's own .mpc/.cache pair in
+        the subdir_root. The .cache is raw pixels which later commands
+        memory-map rather than decode the png/jpg/webp again.
+
+        :return: the .mpc, which {src_img} now refers to.
+        """
+        Path(self.subdir_root or ".").mkdir(parents=True, exist_ok=True)
+        decoded_img = "{}{}.mpc".format(self.subdir_root, self.stem_name)
+        cmn.run_shell_cmd_or_raise(["convert", self.img_name, decoded_img])
+        self.src_img = decoded_img
+        return decoded_img
+
+    def remove_decoded_source(self) -> None:
+        """
+        Deletes any .mpc/.cache from decode_source and reverts to the source.
+        Any engine drops the source it decoded.
+        """
+        if self.engine:
+            self.engine.release()
+        if self.src_img != self.img_name:
+            Path(self.src_img).unlink(missing_ok=True)
+            Path(self.src_img).with_suffix(".cache").unlink(missing_ok=True)
+            self.src_img = self.img_name
+
+    def use_engine(self, name: str):
+        """
+        Runs the variants' commands with the named engine, one of ENGINES,
+        which keeps the source decoded for them all, instead of starting a
+        convert apiece. Other commands, decode_source's and the resize
+        cache's, are still ImageMagick's.
+
+        :return: the engine, None for ImageMagick.
+        :raises CompressorException: if the engine's package is missing.
+        """
+        try:
+            self.engine = get_engine(name, self.src_img)
+        except ImportError as ierr:
+            raise CompressorException(str(ierr))
+        return self.engine
+
+    def get_run_cmd(self, run_shell_cmd):
+        """:return: the engine's run, if there is one, else run_shell_cmd."""
+        return self.engine.run if self.engine else run_shell_cmd
+
+    def use_resize_cache(self, max_bytes: int, pyramid: bool = False,
+                         min_psnr: float = None) -> ResizeCache:
+        """
+        Scaling commands may then read {resized_src}: {src_img} resized to
+        {w}x{h}, made once however many variants read it.
+
+        :param pyramid: resize each of self.widths_and_heights from the next
+            larger rather than from the source.
+        :param min_psnr: check each pyramid level is within this many dB of
+            a direct resize, replacing it with that where it isn't.
+        """
+        self.resize_cache = ResizeCache(
+            "{}resize_cache".format(self.subdir_root), max_bytes,
+            self.widths_and_heights if pyramid else None, min_psnr)
+        return self.resize_cache
+
+    def use_output_cache(self, cache_dir: str,
+                         max_bytes: int = 1024 * 1024 * 1024) -> OutputCache:
+        """
+        Commands are then only run if their output isn't in cache_dir from
+        this or an earlier run, see OutputCache and run_cached.
+        """
+        self.output_cache = OutputCache(
+            cache_dir, cmn.get_imagemagick_version(), max_bytes)
+        self.src_hash = cmn.get_file_sha256(self.img_name)
+        return self.output_cache
+
+    def get_output_key(self, split_cmd: List[str]) -> str:
+        """
+        The key, for self.output_cache, of split_cmd's output: the command
+        with the source replaced by its hash, and any tmp image or shared
+        resize it reads by what made it.
+        """
+        parts = []
+        for arg in split_cmd[:-1]:
+            if arg in (self.img_name, self.src_img):
+                parts.append("src {} {}".format(
+                    self.src_hash, Path(arg).suffix))
+            elif arg in self.output_keys:
+                parts.append("made " + self.output_keys[arg])
+            elif self.resize_cache and \
+                    arg.startswith(self.resize_cache.cache_dir):
+                parts.append("resized {} {} {} {}".format(
+                    self.src_hash, Path(arg).name[len(self.stem_name):],
+                    self.resize_cache.pyramid, self.resize_cache.min_psnr))
+            else:
+                parts.append(arg)
+        if split_cmd[0] in ENCODERS:
+            parts.append("by " + get_encoder_version(split_cmd[0]))
+        elif self.engine:
+            parts.append("by " + self.engine.version)
+        parts.append("to " + Path(split_cmd[-1]).suffix)
+        return self.output_cache.key_of(parts)
+
+    def run_cached(self, split_cmd: List[str], run_cmd,
+                   resizes: DimsList = ()):
+        """
+        Runs split_cmd with run_cmd, unless self.output_cache, if any, has
+        its output. Pipelined commands, writing many outputs, always run, and
+        tmp images, read only by the next in their chain, aren't cached.
+
+        :param resizes: the sizes of any {resized_src} it might read, to pin
+            in self.resize_cache while it runs.
+        :return: what run_cmd does, or "" from the cache.
+        """
+        key = None
+        if self.output_cache and split_cmd[-1] != "null:":
+            key = self.get_output_key(split_cmd)
+            self.output_keys[split_cmd[-1]] = key
+            if is_tmp_img(split_cmd[-1]):
+                key = None
+            elif self.output_cache.fetch(key, split_cmd[-1]):
+                return ""
+        with ExitStack() as stack:
+            for w, h in resizes:
+                if self.resize_cache.path_to(self.src_img, w, h) in split_cmd:
+                    stack.enter_context(
+                        self.resize_cache.resized(self.src_img, w, h))
+            result = run_cmd(split_cmd)
+        if key and result is not None:
+            self.output_cache.store(key, split_cmd[-1])
+        return result
+
+    def use_checkpoint(self, variants: List[Variant],
+                       resume: bool = False) -> Checkpoint:
+        """
+        Records progress in {subdir_root}checkpoint.json as it is made. With
+        resume, progress already recorded there, for this source and these
+        variants, is not repeated: variants generated are listed as they
+        were, a choice made stands, and uploads carry on where they stopped.
+        """
+        plan_hash = hashlib.sha256(json.dumps(
+            [variants, self.widths_and_heights]).encode()).hexdigest()
+        self.checkpoint = Checkpoint(
+            "{}checkpoint.json".format(self.subdir_root),
+            self.src_hash or cmn.get_file_sha256(self.img_name), plan_hash)
+        if resume and self.checkpoint.load():
+            print("Resuming from {}.".format(self.checkpoint.checkpoint_file))
+        else:
+            Path(self.subdir_root).mkdir(parents=True, exist_ok=True)
+            self.checkpoint.save()
+        return self.checkpoint
 
-    def path_to_resized_img(self, w: int, h: int, ext: str):
+    def restore_variants(self, variants: List[Variant]) -> List[Variant]:
+        """
+        Lists the variants the checkpoint, if any, has generated already.
+        Every variant is recorded in self.variants, by subdir_name.
+
+        :return: those still to generate.
+        """
+        for variant in variants:
+            self.variants[self.get_subdir_name(
+                variant.q, variant.suffix, variant.descriptive)] = variant
+        if self.checkpoint is None:
+            return variants
+        remaining = []
+        for variant in variants:
+            subdir_name = self.get_subdir_name(
+                variant.q, variant.suffix, variant.descriptive)
+            total_b = self.checkpoint.variant_bytes(subdir_name)
+            if total_b is None:
+                remaining.append(variant)
+            elif (total_b, subdir_name) not in self.all_dirs:
+                self.all_dirs.append((total_b, subdir_name))
+        return remaining
+
+    def restore_choice(self) -> bool:
+        """
+        Lists only the variant the checkpoint, if any, has chosen.
+
+        :return: whether there was one, so nothing is left to generate.
+        """
+        chosen_dir = self.checkpoint and self.checkpoint.get_choice()
+        if not chosen_dir:
+            return False
+        self.all_dirs = [
+            (self.checkpoint.variant_bytes(chosen_dir), chosen_dir)]
+        return True
+
+    def list_variant(self, total_b: int, subdir_name: str) -> None:
+        self.all_dirs.append((total_b, subdir_name))
+        if self.checkpoint:
+            self.checkpoint.variant_done(subdir_name, total_b)
+
+    def get_encoder(self, unscaled_cmd: str, scaling_cmds: List[str]) -> str:
+        """
+        :return: the dedicated encoders the commands run, see encoders.py,
+            else the engine which runs them.
+        """
+        return "+".join(get_encoded_by(
+            unscaled_cmd.splitlines() + scaling_cmds)) or (
+            self.engine.name if self.engine else "imagemagick")
+
+    def describe_encoding(self, subdir_name: str) -> str:
+        if subdir_name not in self.encoded_by:
+            return ""
+        return ", by {}{}".format(
+            self.encoded_by[subdir_name],
+            " in {:.1f}s".format(self.encode_s[subdir_name])
+            if subdir_name in self.encode_s else "")
+
+    def record_choice(self, chosen_dir: str, reason: str) -> None:
+        self.selection = {"dir": chosen_dir, "reason": reason}
+        if self.checkpoint:
+            self.checkpoint.chose(chosen_dir)
+
+    def resized_src(self, w: int, h: int, scaling_cmds: List[str]):
+        """
+        :return: context manager for the {resized_src} of w x h, or
+            None if scaling_cmds don't want it.
+        """
+        if self.resize_cache is None or not any(
+                "{resized_src}" in cmd for cmd in scaling_cmds):
+            return nullcontext()
+        return self.resize_cache.resized(self.src_img, w, h)
+
+    def get_subdir_name(self, q, suffix: str, descriptive: str) -> str:
+        return os.path.join(
+            self.subdir_root, "{}_q{}_{}".format(suffix, q, descriptive))
+
+    def path_to_resized_img(self, w: int, h: int, ext: str,
+                            subdir_name: str = None):
         return '{}{}{}{}'.format(
-            self.subdir_name, os.path.sep, self.stem_name,
+            subdir_name or self.subdir_name, os.path.sep, self.stem_name,
             cmn.get_name_decor(w, h, ext))
 
-    def path_to_new_img(self, ext: str):
+    def path_to_new_img(self, ext: str, subdir_name: str = None):
         return '{}{}{}.{}'.format(
-            self.subdir_name, os.path.sep, self.stem_name, ext)
+            subdir_name or self.subdir_name, os.path.sep, self.stem_name, ext)
 
-    def count_bytes_in_subdir(self) -> int:
+    def count_bytes_in_subdir(self, subdir_name: str = None) -> int:
         total_b = 0
-        for entry in os.scandir(self.subdir_name):
+        for entry in os.scandir(subdir_name or self.subdir_name):
             if entry.is_file():
                 total_b += entry.stat().st_size
         return total_b
@@ -89,9 +423,9 @@ class ImgConvertor:
         gallery_list = []
         for total_b, fqdir in sorted(self.all_dirs):
             dir_name, suffix = self.extract_final_dir_and_suffix(fqdir)
-            gallery_item = ["{}KB {}: {}x{}".format(
-                round(total_b / 1024), dir_name,
-                src_w, src_h),
+            gallery_item = ["{}KB {}: {}x{}{}{}".format(
+                round(total_b / 1024), dir_name, src_w, src_h,
+                self.describe_encoding(fqdir), self.describe_score(fqdir)),
                 ['{}{}{}.{}'.format(
                     fqdir, os.path.sep, self.stem_name, suffix)]]
             gallery_list.append(gallery_item)
@@ -120,24 +454,94 @@ class ImgConvertor:
     def print_summary(self) -> List[Tuple[int, str]]:
         size_list = list(sorted(self.all_dirs))
         for i, item in enumerate(size_list):
-            print("{:2}: {}KB, {}".format(
-                i, round(item[0] / 1024), item[1][len(self.subdir_root):]))
+            print("{:2}: {}KB, {}{}{}".format(
+                i, round(item[0] / 1024), item[1][len(self.subdir_root):],
+                self.describe_encoding(item[1]), self.describe_score(item[1])))
         return size_list
 
+    def use_scorer(self) -> None:
+        """
+        Scores each image as soon as it's written, by the thread which wrote
+        it, see run_plan_node and transform_to_dir, rather than in a sweep
+        once every variant is. The Scorer resizes the original source, which
+        outlives any decode_source.
+        """
+        self.scorer = Scorer(self.img_name)
+
+    def get_images(self, subdir_name: str) -> Dict[str, str]:
+        """:return: "full" or "WxH" -> path, of each of its images."""
+        suffix = self.extract_final_dir_and_suffix(subdir_name)[1]
+        images = {"full": self.path_to_new_img(suffix, subdir_name)}
+        for w, h in self.widths_and_heights:
+            images["{}x{}".format(w, h)] = self.path_to_resized_img(
+                w, h, suffix, subdir_name)
+        return images
+
+    def record_score(self, subdir_name: str, size: str, score: Score) -> None:
+        with self.scores_lock:
+            self.scores.setdefault(subdir_name, {})[size] = score
+
+    def score_all(self, jobs: int = 1) -> None:
+        """
+        Scores every image, full size and resized, of each variant in
+        self.all_dirs not already scored, against the source at the same
+        size, see Scorer. Up to jobs images are scored at once. After
+        use_scorer that's only what wasn't generated here, resumed variants.
+        """
+        if self.scorer is None:
+            self.use_scorer()
+        images = {}
+        for _, a_dir in self.all_dirs:
+            for size, img in self.get_images(a_dir).items():
+                if size not in self.scores.get(a_dir, {}):
+                    images[(a_dir, size)] = img
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+            scores = pool.map(self.scorer.score, images.values())
+            for (a_dir, size), score in zip(images, scores):
+                self.record_score(a_dir, size, score)
+
+    def worst_score(self, subdir_name: str) -> Optional[Score]:
+        """:return: the lowest SSIM and PSNR of any of its sizes, if scored."""
+        scores = self.scores.get(subdir_name)
+        if not scores:
+            return None
+        psnrs = [s.psnr for s in scores.values() if s.psnr is not None]
+        return Score(min(s.ssim for s in scores.values()),
+                     min(psnrs) if psnrs else None)
+
+    def describe_score(self, subdir_name: str) -> str:
+        score = self.worst_score(subdir_name)
+        if score is None:
+            return ""
+        return ", SSIM {:.4f}, {}".format(
+            score.ssim,
+            "lossless" if score.psnr is None else "{:.1f}dB".format(score.psnr))
+
+    def write_manifest(self, manifest_file: str = "manifest.json") -> None:
+        with open(manifest_file, "w") as f_out:
+            json.dump(self.get_manifest(), f_out, indent=2)
+
+    def get_manifest(self) -> dict:
+        """
+        :return: every variant listed, smallest first as in the summary, with
+            its bytes, encoder and seconds encoding, if known, and any scores
+            by size, for other tools. Once one is chosen, also which and why.
+        """
+        return {
+            "source": self.img_name,
+            "variants": [{
+                "dir": a_dir,
+                "bytes": total_b,
+                "encoder": self.encoded_by.get(a_dir),
+                "encode_s": self.encode_s.get(a_dir),
+                "scores": {size: score._asdict() for size, score
+                           in self.scores.get(a_dir, {}).items()},
+            } for total_b, a_dir in sorted(self.all_dirs)],
+            "selection": self.selection,
+        }
+
     def present_gallery(self, w, h, widths_and_heights):
-        gallery_list = self.get_gallery_list(widths_and_heights, w, h)
-        template_file = os.path.join(
-            Path(__file__).parent.resolve(), "gallery_template.html")
-        with open(template_file) as f_in:
-            template = Template(f_in.read())
-        with open("gallery.html", "w") as f_out:
-            f_out.write(template.render(
-                {"galleryList": gallery_list}
-            ))
-        print("Please review the results at file:"
-              "//{} and select the set you prefer."
-              .format(Path("gallery.html").resolve(),
-                      Path("gallery.html").resolve()))
+        write_gallery(self.get_gallery_list(widths_and_heights, w, h))
 
     def select_one(self) -> str:
         """
@@ -146,6 +550,9 @@ class ImgConvertor:
         """
         if len(self.all_dirs) == 0:
             raise CompressorException("self.all_dirs is empty, aborting.")
+        if self.restore_choice():
+            print("Chosen before resuming: {}".format(self.all_dirs[0][1]))
+            return self.all_dirs[0][1]
         size_list = self.print_summary()
         choice = int(
             input("Choose [0-{}]: ".format(len(self.all_dirs) - 1)))
@@ -154,14 +561,42 @@ class ImgConvertor:
             choice = int(
                 input("Choose [0-{}]: ".format(len(self.all_dirs) - 1)))
         chosen_dir = size_list[choice][1]
+        self.record_choice(chosen_dir, "chosen interactively")
         return chosen_dir
 
-    def upload(self, chosen_generated_dir: str, conf_file: str):
+    def auto_select(self, policy: SelectionPolicy) -> str:
+        """
+        Chooses by policy rather than asking, as select_one would.
+
+        :return: Chosen directory path, as select_one.
+        """
+        if self.restore_choice():
+            print("Chosen before resuming: {}".format(self.all_dirs[0][1]))
+            return self.all_dirs[0][1]
+        candidates = [
+            Candidate(total_b, a_dir,
+                      self.extract_final_dir_and_suffix(a_dir)[1],
+                      self.worst_score(a_dir))
+            for total_b, a_dir in self.all_dirs]
+        chosen, reason = policy.choose(candidates)
+        print("Auto-selected {}: {}.".format(
+            chosen.subdir_name[len(self.subdir_root):] if chosen else "nothing",
+            reason))
+        if chosen is None:
+            raise CompressorException(
+                "Nothing to auto-select, {}.".format(reason))
+        self.record_choice(chosen.subdir_name, reason)
+        return chosen.subdir_name
+
+    def upload(self, chosen_generated_dir: str, conf_file: str,
+               uploader: "Uploader" = None):
         """
         
         :param chosen_generated_dir: relative or absolute, as defined by the
             subdir_root which precedes it. 
         :param conf_file: credentials for API and SSH/SCP
+        :param uploader: connections to reuse, left open, rather than
+            connecting afresh for this upload alone.
         :return:
         """
         self.subdir_name = chosen_generated_dir
@@ -169,91 +604,694 @@ class ImgConvertor:
         singular_source = os.path.join(
             chosen_generated_dir, self.stem_name + "." + suffix)
         print("Uploading {}".format(singular_source))
-        wp_api = WP_API(conf_file)
-        # All kinds of juicy details to save intrusive paramiko.
-        media_details = wp_api.upload_media(singular_source).json()["media_details"]
-        with open(conf_file) as f:
-            conf = json.load(f)["ssh"]
-        host, port = conf["host"], 22
-        if ":" in host:
-            host, port = host.split(":")
-        self.replace_generated_sizes(
-            host, port, filter_dict_for_creds(conf), suffix,
-            os.path.join(conf["wp_uploads"], media_details["file"]))
+        own_uploader = uploader is None
+        if own_uploader:
+            uploader = Uploader(conf_file)
+        try:
+            media = self.checkpoint and self.checkpoint.state["media"]
+            staged = False
+            if media:
+                print("Already uploaded as media {}".format(media["id"]))
+            elif self.upload_options.prescaled:
+                self.upload_prescaled(chosen_generated_dir, suffix, uploader)
+                return
+            elif self.upload_options.overlap:
+                media = self.upload_while_staging(
+                    singular_source, suffix, uploader)
+                staged = True
+            else:
+                media = self.upload_media(singular_source, uploader)
+            # All kinds of juicy details to save intrusive paramiko.
+            media_details = media["media_details"]
+            conf = uploader.get_ssh_conf()
+            host, port = uploader.get_host_and_port()
+            self.replace_generated_sizes(
+                host, port, filter_dict_for_creds(conf), suffix,
+                os.path.join(conf["wp_uploads"], media_details["file"]),
+                uploader.get_client(), staged)
+        finally:
+            if own_uploader:
+                uploader.close()
 
-    def replace_generated_sizes(self, host, port, credentials: dict, suffix,
-                                fq_rmt_path: str):
-        client = get_client(host, int(port), credentials)
-        sftp = None
+    def upload_prescaled(self, chosen_dir: str, suffix: str,
+                         uploader: "Uploader") -> dict:
+        """
+        Stages the full size image, every size and a thumbnail cropped here,
+        then has WP-CLI copy them into place and insert the attachment, with
+        metadata describing them, see insert_attachment. WordPress does no
+        image processing, where a REST upload would have it decode the
+        original and make every size, only for them to be replaced.
+
+        WP-CLI runs in the ssh config's "wp_path", if given, otherwise the
+        directory two above "wp_uploads".
+
+        :return: the media, as upload_media's.
+        """
+        full_name = self.path_to_new_img(suffix, chosen_dir)
+        sizes = {name: wh for name, wh in self.named_sizes.items()
+                 if wh in self.widths_and_heights}
+        if "thumbnail" in self.named_sizes:
+            sizes["thumbnail"] = self.named_sizes["thumbnail"]
+            self.make_thumbnail(chosen_dir, *sizes["thumbnail"])
+        files = [(full_name, "." + suffix)]
+        for w, h in sorted(set(sizes.values())):
+            files.append((self.path_to_resized_img(w, h, suffix, chosen_dir),
+                          cmn.get_name_decor(w, h, suffix)))
+        stagings = [(str(Path(local_name).resolve()), "{}/{}".format(
+            self.staging_dir, Path(local_name).name))
+            for local_name, _ in files]
+        client = uploader.get_client()
+        self.stage(client, stagings, eager=True)
+        metadata = get_attachment_metadata(
+            *cmn.get_img_wxh(full_name), suffix, os.path.getsize(full_name),
+            {name: (w, h, os.path.getsize(self.path_to_resized_img(
+                w, h, suffix, chosen_dir))) for name, (w, h) in sizes.items()})
+        conf = uploader.get_ssh_conf()
+        wp_path = conf.get("wp_path") or \
+            str(PurePosixPath(conf["wp_uploads"]).parent.parent)
         try:
-            stdout, _ = execute_remotely(client, "mkdir -p /tmp/stagingtmp")
-            rmt_dir = Path(fq_rmt_path).parent.resolve()
-            sftp = client.open_sftp()
+            media_id, rmt_file = insert_attachment(
+                client, wp_path, Path(full_name).name, suffix,
+                [(staged_name, decor) for (_, staged_name), (_, decor)
+                 in zip(stagings, files)], metadata)
+        finally:
+            # As the SSH user, who staged them, since WP-CLI's user can't.
+            execute_remotely(client, "rm -f " + " ".join(
+                shlex.quote(staged_name) for _, staged_name in stagings))
+        print("Inserted media {}, {}, made here.".format(media_id, rmt_file))
+        media = {"id": media_id, "media_details": {"file": rmt_file}}
+        if self.checkpoint:
+            self.checkpoint.media_uploaded(media)
+            # All in place already, were it resumed.
+            for _, _, final_name in self.get_transfers(
+                    suffix, os.path.join(conf["wp_uploads"], rmt_file)):
+                self.checkpoint.replaced(final_name)
+        return media
+
+    def get_variant_of(self, subdir_name: str) -> Variant:
+        """
+        :return: the variant which made subdir_name, as recorded in
+            self.variants, its encoder and effort included, or, if that
+            makes no sizes, its format's first which does. Where nothing was
+            recorded, a choice restored from a checkpoint, as
+            get_format_variants makes it.
+        """
+        variant = self.variants.get(subdir_name)
+        if variant is not None and variant.scaling_cmds:
+            return variant
+        dir_name = Path(subdir_name).name
+        suffix, q, descriptive = dir_name.split("_", 2)
+        variants = get_format_variants(int(q[1:]), suffix)
+        return next((v for v in variants if v.descriptive == descriptive),
+                    variants[0])
+
+    def make_thumbnail(self, subdir_name: str, w: int, h: int) -> str:
+        """
+        Crops a thumbnail, as WordPress would, but encoded as the variant in
+        subdir_name encodes its sizes, by the same encoder or engine.
+
+        :return: its path.
+        """
+        variant = self.get_variant_of(subdir_name)
+        variant = variant._replace(scaling_cmds=list(
+            map(crop_to_fill, variant.scaling_cmds)))
+        chain = self.get_cmd_chains(variant, subdir_name, [(w, h)])[1]
+        run_cmd = self.get_run_cmd(cmn.run_shell_cmd_or_raise)
+        try:
+            for cmd in chain.cmds:
+                self.run_cached(cmd, run_cmd)
+        finally:
+            for tmp_img in chain.tmp_imgs:
+                Path(tmp_img).unlink(missing_ok=True)
+        return self.path_to_resized_img(
+            w, h, self.extract_final_dir_and_suffix(subdir_name)[1],
+            subdir_name)
+
+    def upload_media(self, singular_source: str, uploader: "Uploader") \
+            -> dict:
+        """:return: the media WordPress made of singular_source."""
+        media = uploader.get_wp_api().upload_media(singular_source).json()
+        if self.checkpoint:
+            self.checkpoint.media_uploaded(
+                {"id": media["id"], "media_details": media["media_details"]})
+        return media
+
+    def upload_while_staging(self, singular_source: str, suffix: str,
+                             uploader: "Uploader") -> dict:
+        """
+        Uploads the media while connecting by SSH and staging every size,
+        rather than after, as WordPress regenerating its own sizes of the
+        upload is slow. The sizes' final names aren't known until WordPress
+        answers, so they are staged under their local names, see
+        get_transfers' staged_as_local.
+
+        :return: the media WordPress made of singular_source.
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            media_future = executor.submit(
+                self.upload_media, singular_source, uploader)
+            stagings = []
             for w, h in self.widths_and_heights:
-                # This should overwrite all the shrunk images WP made, except
-                # the 150x150 thumbnail.
-                src_name = str(Path(self.path_to_resized_img(w, h, suffix)).resolve())
-                base_rmt_name = Path(fq_rmt_path).stem + cmn.get_name_decor(w, h, suffix)
-                final_name = "{}/{}".format(rmt_dir, base_rmt_name).replace("//", "/")
-                sftp.put(src_name, "/tmp/stagingtmp/{}".format(base_rmt_name))
-                # Sequence these to avoid the race hazard of chown'ing before
-                # overwriting:
-                stdout, stderr = execute_remotely(
-                    client,
-                    "sudo mv /tmp/stagingtmp/{base_rmt_name} {final_name} && "
-                    "sudo chown www-data:www-data {final_name}".format(
-                        base_rmt_name=base_rmt_name, final_name=final_name))
-                if stderr:
-                    raise RuntimeError(stderr)
-            sftp.close()
-            client.close()
-        except Exception as e:
+                src_name = str(Path(
+                    self.path_to_resized_img(w, h, suffix)).resolve())
+                stagings.append((src_name, "{}/{}".format(
+                    self.staging_dir, Path(src_name).name)))
+            self.stage(uploader.get_client(), stagings, eager=True)
+            return media_future.result()
+
+    def replace_generated_sizes(self, host, port, credentials: dict, suffix,
+                                fq_rmt_path: str, client: SSHClient = None,
+                                staged: bool = False):
+        """
+        :param client: an open connection to use and leave open, rather than
+            connecting with host, port and credentials.
+        :param staged: whether upload_while_staging has staged the sizes
+            already, leaving only their installation.
+        """
+        own_client = client is None
+        if own_client:
+            client = get_client(host, int(port), credentials)
+        try:
+            transfers = self.get_transfers(suffix, fq_rmt_path, staged)
+            if staged:
+                self.install(client, transfers)
+            else:
+                if self.upload_options.delta:
+                    transfers = self.skip_unchanged(client, transfers)
+                if transfers:
+                    self.stage_and_install(client, transfers)
+        finally:
+            if own_client:
+                client.close()
+
+    def stage_and_install(self, client: SSHClient,
+                          transfers: List[Tuple[str, str, str]]) -> None:
+        """Stages the sizes, as upload_options say, and installs them."""
+        sftp = self.stage(client, [(src_name, staged_name)
+                                   for src_name, staged_name, _ in transfers])
+        try:
+            self.install(client, transfers, sftp)
+        finally:
             if sftp:
                 sftp.close()
-            if client:
-                client.close()
-            raise
+
+    def stage(self, client: SSHClient, stagings: List[Tuple[str, str]],
+              eager: bool = False):
+        """
+        :param stagings: (local, staged) paths.
+        :param eager: put every size now, even by plain SFTP, whose puts are
+            otherwise left to install, to go with each move.
+        :return: the open SFTP session puts were left to, if any.
+        """
+        if self.upload_options.transport == "tar":
+            # Staged before installing any, in one round trip.
+            put_tar(client, self.staging_dir, [
+                (src_name, Path(staged_name).name)
+                for src_name, staged_name in stagings])
+            return None
+        stdout, _ = execute_remotely(
+            client, "mkdir -p {}".format(self.staging_dir))
+        if self.upload_options.puts_concurrently():
+            self.put_concurrently(client, stagings)
+            return None
+        sftp = client.open_sftp()
+        if not eager:
+            return sftp
+        try:
+            for src_name, staged_name in stagings:
+                sftp.put(src_name, staged_name)
+        finally:
+            sftp.close()
+        return None
+
+    def install(self, client: SSHClient,
+                transfers: List[Tuple[str, str, str]], sftp=None) -> None:
+        """:param sftp: to put each size with, if not staged already."""
+        if not transfers:
+            return
+        if self.upload_options.one_trip:
+            self.install_in_one_trip(client, sftp, transfers)
+        else:
+            self.install_each(client, sftp, transfers)
+
+    def skip_unchanged(self, client: SSHClient,
+                       transfers: List[Tuple[str, str, str]]) \
+            -> List[Tuple[str, str, str]]:
+        """
+        Compares each size's hash with that of the file on the server, all
+        the server's hashed in one round trip, see get_remote_sha256s.
+
+        :return: the transfers of those sizes which differ.
+        """
+        rmt_sha256s = get_remote_sha256s(
+            client, [final_name for _, _, final_name in transfers])
+        changed = []
+        saved_b = 0
+        for src_name, staged_name, final_name in transfers:
+            if rmt_sha256s.get(final_name) == cmn.get_file_sha256(src_name):
+                saved_b += os.path.getsize(src_name)
+                if self.checkpoint:
+                    self.checkpoint.replaced(final_name)
+            else:
+                changed.append((src_name, staged_name, final_name))
+        print("{} of {} sizes already on the server, {:.0f}KB not sent.".format(
+            len(transfers) - len(changed), len(transfers), saved_b / 1024))
+        return changed
+
+    def put_concurrently(self, client: SSHClient,
+                         stagings: List[Tuple[str, str]]) -> None:
+        """Stages every size, several at once, reporting each one's rate."""
+        options = self.upload_options
+        for transfer in put_concurrently(
+                client, stagings, options.sftp_channels,
+                options.sftp_window_kb and options.sftp_window_kb * 1024,
+                options.sftp_packet_kb and options.sftp_packet_kb * 1024):
+            print(transfer.describe())
+
+    def install_each(self, client: SSHClient, sftp,
+                     transfers: List[Tuple[str, str, str]]) -> None:
+        """
+        Stages and installs each size in turn, a round trip apiece.
+
+        :param sftp: None if the sizes are staged already.
+        """
+        for src_name, staged_name, final_name in transfers:
+            if sftp:
+                sftp.put(src_name, staged_name)
+            # Sequence these to avoid the race hazard of chown'ing before
+            # overwriting:
+            stdout, stderr = execute_remotely(
+                client,
+                "sudo mv {staged_name} {final_name} && "
+                "sudo chown www-data:www-data {final_name}".format(
+                    staged_name=staged_name, final_name=final_name))
+            if stderr:
+                raise RuntimeError(stderr)
+            if self.checkpoint:
+                self.checkpoint.replaced(final_name)
+
+    def install_in_one_trip(self, client: SSHClient, sftp,
+                            transfers: List[Tuple[str, str, str]]) -> None:
+        """
+        Stages every size, then installs them all with one remote command,
+        see install_files, so the round trips don't grow with the sizes.
+
+        :param sftp: None if the sizes are staged already.
+        """
+        for src_name, staged_name, final_name in transfers:
+            if sftp:
+                sftp.put(src_name, staged_name)
+        installed, errors = install_files(client, [
+            (staged_name, final_name)
+            for _, staged_name, final_name in transfers])
+        if self.checkpoint:
+            for final_name in installed:
+                self.checkpoint.replaced(final_name)
+        if errors:
+            raise RuntimeError("\n".join(errors))
+
+    def get_transfers(self, suffix: str, fq_rmt_path: str,
+                      staged_as_local: bool = False) \
+            -> List[Tuple[str, str, str]]:
+        """
+        :param fq_rmt_path: of the full size image WordPress made.
+        :param staged_as_local: staged under the local name rather than the
+            final one, as by upload_while_staging.
+        :return: (local, staged, final) paths of each size to replace, less
+            any a resumed checkpoint has replaced already.
+        """
+        rmt_dir = Path(fq_rmt_path).parent.resolve()
+        transfers = []
+        for w, h in self.widths_and_heights:
+            # This should overwrite all the shrunk images WP made, except
+            # the 150x150 thumbnail.
+            src_name = str(Path(self.path_to_resized_img(w, h, suffix)).resolve())
+            base_rmt_name = Path(fq_rmt_path).stem + cmn.get_name_decor(w, h, suffix)
+            final_name = "{}/{}".format(rmt_dir, base_rmt_name).replace("//", "/")
+            if self.checkpoint and \
+                    final_name in self.checkpoint.state["replaced"]:
+                continue
+            transfers.append((src_name, "{}/{}".format(
+                self.staging_dir, Path(src_name).name if staged_as_local
+                else base_rmt_name), final_name))
+        return transfers
 
     def transform_to_dir(self, q, suffix: str, descriptive: str,
                          unscaled_cmd: str, scaling_cmds: List[str]) -> None:
         """
-        Supply a single line string for the unscaled operation and any number of
-        lines for the scaling operations. We use f-string (py 3.6) and you can
-        find the available variable substitutions in the code below.
+        Supply a single line string for the unscaled operation, or a line per
+        command if it takes more than one, and any number of lines for the
+        scaling operations. We use f-string (py 3.6) and you can find the
+        available variable substitutions in the code below.
 
         :param q: q, either quality or quantisations.
         :param suffix: for subdirectory and output images.
         :param descriptive: name for subdirectory for all outputs below.
-        :param unscaled_cmd: single line for unscaled conversion.
+        :param unscaled_cmd: line(s) for unscaled conversion.
         :param scaling_cmds: multi-line command for scaled conversion.
         :return:
         """
-        self.subdir_name = os.path.join(
-            self.subdir_root, "{}_q{}_{}".format(suffix, q, descriptive))
+        start = time.perf_counter()
+        self.subdir_name = self.get_subdir_name(q, suffix, descriptive)
         Path(self.subdir_name).mkdir(parents=True, exist_ok=True)
 
         suffix = self.extract_final_dir_and_suffix(self.subdir_name)[-1]
         f_str_vars = {
             "q": q,
-            "src_img": self.img_name,
+            "src_img": self.src_img,
             "tmp_img": os.path.join(self.subdir_name, "tmp.png"),
             "tmp_img2": os.path.join(self.subdir_name, "tmp2.png"),
             "dest_img": self.path_to_new_img(suffix)
         }
-        split_cmd = cmn.split_fstring_not_args(f_str_vars, unscaled_cmd)
-        cmn.run_shell_cmd(split_cmd)
+        run_cmd = self.get_run_cmd(cmn.run_shell_cmd)
+        for cmd in unscaled_cmd.splitlines():
+            split_cmd = cmn.split_fstring_not_args(f_str_vars, cmd)
+            self.run_cached(split_cmd, run_cmd)
         for w, h in self.widths_and_heights:
-            for scaling_cmd in scaling_cmds:
-                split_cmd = cmn.split_fstring_not_args({
-                    "w": w,
-                    "h": h,
-                    "resized_img": self.path_to_resized_img(w, h, suffix),
-                    **f_str_vars
-                }, scaling_cmd)
-                cmn.run_shell_cmd(split_cmd)
+            with self.resized_src(w, h, scaling_cmds) as resized_src:
+                for scaling_cmd in scaling_cmds:
+                    split_cmd = cmn.split_fstring_not_args({
+                        "w": w,
+                        "h": h,
+                        "resized_img": self.path_to_resized_img(w, h, suffix),
+                        "resized_src": resized_src,
+                        **f_str_vars
+                    }, scaling_cmd)
+                    self.run_cached(split_cmd, run_cmd)
         Path(f_str_vars["tmp_img"]).unlink(missing_ok=True)
         Path(f_str_vars["tmp_img2"]).unlink(missing_ok=True)
-        self.all_dirs.append((self.count_bytes_in_subdir(), self.subdir_name))
+        self.encoded_by[self.subdir_name] = self.get_encoder(
+            unscaled_cmd, scaling_cmds)
+        self.encode_s[self.subdir_name] = time.perf_counter() - start
+        if self.scorer:
+            for size, img in self.get_images(self.subdir_name).items():
+                self.record_score(self.subdir_name, size,
+                                  self.scorer.score(img))
+        self.list_variant(self.count_bytes_in_subdir(), self.subdir_name)
+
+    def transform_all(self, variants: List[Variant], jobs: int = 1,
+                      pipeline: bool = False, dedupe: bool = False) -> None:
+        """
+        Run every variant through transform_to_dir or, given more than one
+        job, pipelining or deduplicating, plan every command first and run
+        the plan in a pool of that many threads. Threads suffice since the
+        work happens in the convert subprocesses.
+
+        In the plan the unscaled command and each size's chain of
+        scaling_cmds are independent, and identical commands are run once,
+        see CommandPlan. Each size gets its own tmp images. self.all_dirs is
+        appended in the order of variants, not completion, and a failing
+        variant is reported, and recorded in self.failed_dirs, instead of
+        being listed. Variants a resumed checkpoint has are listed first,
+        without being generated again.
+
+        :param variants: in the order they should appear in self.all_dirs.
+        :param jobs: the most commands to run at once.
+        :param pipeline: combine each variant's commands into one convert,
+            see cmn.pipeline_convert_cmds, so the source is decoded once per
+            variant rather than once per size.
+        :param dedupe: plan, and so deduplicate, even with just one job.
+        """
+        variants = self.restore_variants(variants)
+        if jobs <= 1 and not pipeline and not dedupe:
+            for variant in variants:
+                self.transform_to_dir(*variant)
+            return
+        plan, subdir_names = self.plan_all(variants, pipeline)
+        for subdir_name in subdir_names:
+            Path(subdir_name).mkdir(parents=True, exist_ok=True)
+        errors = plan.run(self.run_plan_node, jobs)
+        for tmp_img in plan.tmp_imgs:
+            Path(tmp_img).unlink(missing_ok=True)
+        self.collect_plan(plan, subdir_names, errors)
+
+    def collect_plan(self, plan: CommandPlan, subdir_names: List[str],
+                     errors: dict) -> None:
+        """
+        Lists the variants a plan has run, in the order of subdir_names, or
+        reports and deletes them if they failed.
+
+        :param errors: as returned by plan.run.
+        """
+        for subdir_name in subdir_names:
+            error = plan.first_error_of(subdir_name, errors)
+            if error:
+                print("{} failed: {}".format(subdir_name, error),
+                      file=sys.stderr)
+                self.failed_dirs.append((subdir_name, error))
+                self.scores.pop(subdir_name, None)
+                shutil.rmtree(subdir_name, ignore_errors=True)
+                continue
+            self.encode_s[subdir_name] = sum(
+                node.seconds for node in plan.owned[subdir_name])
+            self.list_variant(
+                self.count_bytes_in_subdir(subdir_name), subdir_name)
+
+    def plan_all(self, variants: List[Variant], pipeline: bool = False,
+                 plan: CommandPlan = None) -> Tuple[CommandPlan, List[str]]:
+        """
+        Expands the variants into a CommandPlan without running anything.
+
+        :param plan: to add to, shared with other images for instance,
+            rather than a new one.
+        :return: the plan and the subdir_name of each variant, in order.
+        """
+        plan = plan or CommandPlan()
+        subdir_names = []
+        for variant in variants:
+            subdir_name = self.get_subdir_name(
+                variant.q, variant.suffix, variant.descriptive)
+            chains = self.get_cmd_chains(variant, subdir_name)
+            self.encoded_by[subdir_name] = self.get_encoder(
+                variant.unscaled_cmd, variant.scaling_cmds)
+            # Only convert's commands pipeline, the encoders' run apart.
+            if pipeline and all(cmd[0] == "convert" for chain in chains
+                                for cmd in chain.cmds):
+                chains = [CmdChain(
+                    [cmn.pipeline_convert_cmds(
+                        [cmd for chain in chains for cmd in chain.cmds])],
+                    [],
+                    [wh for chain in chains for wh in chain.resizes])]
+            for chain in chains:
+                plan.add_chain(subdir_name, chain)
+            if self.scorer:
+                for size, img in self.get_images(subdir_name).items():
+                    self.scored_as[img] = (subdir_name, size)
+            subdir_names.append(subdir_name)
+        return plan, subdir_names
+
+    def get_cmd_chains(self, variant: Variant, subdir_name: str,
+                       widths_and_heights: DimsList = None) -> List[CmdChain]:
+        """
+        Expands a variant into independent chains of split commands: the
+        unscaled conversion, then one chain per size. Each size's chain gets
+        its own tmp images so that chains may run concurrently.
+
+        :param widths_and_heights: sizes, if not self.widths_and_heights.
+        """
+        suffix = self.extract_final_dir_and_suffix(subdir_name)[-1]
+        f_str_vars = {
+            "q": variant.q,
+            "src_img": self.src_img,
+            "dest_img": self.path_to_new_img(suffix, subdir_name)
+        }
+        unscaled_tmp_imgs = {
+            name: os.path.join(subdir_name, name.replace("_img", "") + ".png")
+            for name in ("tmp_img", "tmp_img2")
+            if "{" + name + "}" in variant.unscaled_cmd}
+        chains = [CmdChain([
+            cmn.split_fstring_not_args({**f_str_vars, **unscaled_tmp_imgs}, cmd)
+            for cmd in variant.unscaled_cmd.splitlines()],
+            list(unscaled_tmp_imgs.values()))]
+        if widths_and_heights is None:
+            widths_and_heights = self.widths_and_heights
+        for w, h in widths_and_heights:
+            tmp_imgs = [
+                os.path.join(subdir_name,
+                             "tmp" + cmn.get_name_decor(w, h, "png")),
+                os.path.join(subdir_name,
+                             "tmp2" + cmn.get_name_decor(w, h, "png"))]
+            size_vars = {
+                "w": w,
+                "h": h,
+                "resized_img": self.path_to_resized_img(
+                    w, h, suffix, subdir_name),
+                "tmp_img": tmp_imgs[0],
+                "tmp_img2": tmp_imgs[1],
+                **f_str_vars
+            }
+            resizes = []
+            if self.resize_cache and any(
+                    "{resized_src}" in cmd for cmd in variant.scaling_cmds):
+                size_vars["resized_src"] = self.resize_cache.path_to(
+                    self.src_img, w, h)
+                resizes.append((w, h))
+            chains.append(CmdChain([
+                cmn.split_fstring_not_args(size_vars, scaling_cmd)
+                for scaling_cmd in variant.scaling_cmds], tmp_imgs, resizes))
+        return chains
+
+    def measure_variant(self, variant: Variant, jobs: int = 1,
+                        pipeline: bool = False, dedupe: bool = False,
+                        score: bool = False) -> Measurement:
+        """
+        Renders the variant, as transform_all would, for a QualitySearch.
+
+        :param score: also measure the PSNR of the full size output against
+            the source.
+        """
+        subdir_name = self.get_subdir_name(
+            variant.q, variant.suffix, variant.descriptive)
+        self.transform_all([variant], jobs, pipeline, dedupe)
+        n_bytes = dict((d, b) for b, d in self.all_dirs).get(subdir_name)
+        if n_bytes is None:
+            raise CompressorException("{} failed.".format(subdir_name))
+        psnr = None
+        if score:
+            psnr = cmn.get_psnr(self.img_name, self.path_to_new_img(
+                variant.suffix, subdir_name))
+        return Measurement(n_bytes, psnr)
+
+    def search_qualities(self, families: List[VariantFamily],
+                         max_bytes: int = None, min_psnr: float = None,
+                         jobs: int = 1, pipeline: bool = False,
+                         dedupe: bool = False) -> List[Variant]:
+        """
+        Searches q for each family, see QualitySearch, instead of rendering
+        a grid. Only the variant found for each family is kept in
+        self.all_dirs, the others tried along the way are deleted.
+
+        :param max_bytes: the most a variant's directory may total.
+        :param min_psnr: the least PSNR, in dB, of its full size image.
+        :return: the variants found, one per family at most.
+        """
+        found = []
+        for family in families:
+            searcher = QualitySearch(
+                family,
+                lambda v: self.measure_variant(
+                    v, jobs, pipeline, dedupe, min_psnr is not None),
+                max_bytes, min_psnr)
+            q = searcher.search()
+            variant = family.make_variant(q if q is not None else family.q_hi)
+            print("{}_{}: {} after trying q {}.".format(
+                variant.suffix, variant.descriptive,
+                "no q meets the target" if q is None else "q{}".format(q),
+                sorted(searcher.tried)))
+            if q is not None:
+                found.append(variant)
+        keep = {self.get_subdir_name(v.q, v.suffix, v.descriptive)
+                for v in found}
+        for total_b, a_dir in self.all_dirs:
+            if a_dir not in keep:
+                self.scores.pop(a_dir, None)
+                shutil.rmtree(a_dir)
+        self.all_dirs = [d for d in self.all_dirs if d[1] in keep]
+        return found
+
+    def complete_variant(self, chosen_dir: str, variants: List[Variant],
+                         widths_and_heights: DimsList, jobs: int = 1) -> None:
+        """
+        For lazy generation, where variants were rendered at only some of the
+        sizes, renders the rest of widths_and_heights for the chosen one and
+        makes self.widths_and_heights whole again.
+
+        :param chosen_dir: subdir_name of one of the variants.
+        :param variants: those given to transform_all.
+        :param widths_and_heights: every size wanted.
+        """
+        variant = next(v for v in variants if chosen_dir == self.get_subdir_name(
+            v.q, v.suffix, v.descriptive))
+        self.variants[chosen_dir] = variant
+        remaining = [wh for wh in widths_and_heights
+                     if wh not in self.widths_and_heights]
+        self.widths_and_heights = widths_and_heights
+        if self.checkpoint and self.checkpoint.state["completed"]:
+            return
+        plan = CommandPlan()
+        for chain in self.get_cmd_chains(variant, chosen_dir, remaining)[1:]:
+            plan.add_chain(chosen_dir, chain)
+        errors = plan.run(self.run_plan_node, jobs)
+        for tmp_img in plan.tmp_imgs:
+            Path(tmp_img).unlink(missing_ok=True)
+        error = plan.first_error_of(chosen_dir, errors)
+        if error:
+            raise CompressorException("Completing {} failed: {}".format(
+                chosen_dir, error))
+        self.all_dirs = [
+            (self.count_bytes_in_subdir(chosen_dir), a_dir)
+            if a_dir == chosen_dir else (total_b, a_dir)
+            for total_b, a_dir in self.all_dirs]
+        if self.checkpoint:
+            self.checkpoint.variant_done(
+                chosen_dir, self.count_bytes_in_subdir(chosen_dir))
+            self.checkpoint.completed()
+
+    def reencode_variant(self, chosen_dir: str, variants: List[Variant],
+                         jobs: int = 1) -> None:
+        """
+        For variants rendered at a lower effort, see at_effort, encodes the
+        chosen one again, at the sizes rendered, as variants do, in place.
+
+        :param chosen_dir: subdir_name of one of the variants.
+        :param variants: those given to transform_all, at the effort to
+            encode at.
+        """
+        variant = next(v for v in variants if chosen_dir == self.get_subdir_name(
+            v.q, v.suffix, v.descriptive))
+        self.variants[chosen_dir] = variant
+        if self.checkpoint and (
+                self.checkpoint.state["completed"] or
+                self.checkpoint.state["reencoded"] == chosen_dir):
+            return
+        before_b = self.count_bytes_in_subdir(chosen_dir)
+        start = time.perf_counter()
+        plan = CommandPlan()
+        for chain in self.get_cmd_chains(
+                variant, chosen_dir, self.widths_and_heights):
+            plan.add_chain(chosen_dir, chain)
+        errors = plan.run(self.run_plan_node, jobs)
+        for tmp_img in plan.tmp_imgs:
+            Path(tmp_img).unlink(missing_ok=True)
+        error = plan.first_error_of(chosen_dir, errors)
+        if error:
+            raise CompressorException("Encoding {} again failed: {}".format(
+                chosen_dir, error))
+        total_b = self.count_bytes_in_subdir(chosen_dir)
+        print("Encoded {} again, at max effort, {}KB to {}KB in {:.1f}s."
+              .format(chosen_dir[len(self.subdir_root):],
+                      round(before_b / 1024), round(total_b / 1024),
+                      time.perf_counter() - start))
+        self.all_dirs = [
+            (total_b, a_dir) if a_dir == chosen_dir else (b, a_dir)
+            for b, a_dir in self.all_dirs]
+        if self.checkpoint:
+            self.checkpoint.variant_done(chosen_dir, total_b)
+            self.checkpoint.reencoded(chosen_dir)
+
+    def run_plan_node(self, node: PlanNode) -> None:
+        """
+        Runs the node's command, see run_cached, timing it, then copies its
+        output to those of the commands merged into it. Given a scorer, see
+        use_scorer, it then scores what it wrote, a merged output just once.
+        """
+        start = time.perf_counter()
+        self.run_cached(node.cmd, self.get_run_cmd(cmn.run_shell_cmd_or_raise),
+                        node.resizes)
+        node.seconds = time.perf_counter() - start
+        for output in node.outputs[1:]:
+            shutil.copyfile(node.outputs[0], output)
+        if self.scorer:
+            # A pipelined command -write's all but its last output.
+            written = [[node.cmd[i + 1]] for i, arg in enumerate(node.cmd[:-1])
+                       if arg == "-write"] + [node.outputs]
+            for copies in written:
+                keys = [self.scored_as[img] for img in copies
+                        if img in self.scored_as]
+                if keys:
+                    score = self.scorer.score(copies[0])
+                    for subdir_name, size in keys:
+                        self.record_score(subdir_name, size, score)
 
     def delete_other_dirs(self, one_dir):
         for a_dir in self.all_dirs:
@@ -261,11 +1299,398 @@ class ImgConvertor:
                 shutil.rmtree(a_dir[1])
 
 
+class Uploader:
+    """
+    The WordPress API and SSH connections which uploads need, made on first
+    use and then reused by every upload until closed.
+    """
+    def __init__(self, conf_file: str):
+        self.conf_file = conf_file
+        self.wp_api = None
+        self.ssh_conf = None
+        self.client = None
+
+    def get_wp_api(self) -> WP_API:
+        if self.wp_api is None:
+            self.wp_api = WP_API(self.conf_file)
+        return self.wp_api
+
+    def get_ssh_conf(self) -> dict:
+        if self.ssh_conf is None:
+            with open(self.conf_file) as f:
+                self.ssh_conf = json.load(f)["ssh"]
+        return self.ssh_conf
+
+    def get_host_and_port(self) -> Tuple[str, int]:
+        host, port = self.get_ssh_conf()["host"], 22
+        if ":" in host:
+            host, port = host.split(":")
+        return host, int(port)
+
+    def get_client(self) -> SSHClient:
+        if self.client is None:
+            self.client = get_client(
+                *self.get_host_and_port(),
+                filter_dict_for_creds(self.get_ssh_conf()))
+        return self.client
+
+    def close(self) -> None:
+        if self.client:
+            self.client.close()
+            self.client = None
+
+
+def write_gallery(gallery_list: list, gallery_file: str = "gallery.html"):
+    """
+    :param gallery_list: as ImgConvertor.get_gallery_list returns.
+    """
+    template_file = os.path.join(
+        Path(__file__).parent.resolve(), "gallery_template.html")
+    with open(template_file) as f_in:
+        template = Template(f_in.read())
+    with open(gallery_file, "w") as f_out:
+        f_out.write(template.render(
+            {"galleryList": gallery_list}
+        ))
+    print("Please review the results at file:"
+          "//{} and select the set you prefer."
+          .format(Path(gallery_file).resolve()))
+
+
+def is_tmp_img(img_name: str) -> bool:
+    """:return: whether img_name is a {tmp_img} or {tmp_img2}, of any size."""
+    return re.fullmatch(r"tmp2?(-\d+x\d+)?\.png", Path(img_name).name) \
+        is not None
+
+
+def crop_to_fill(scaling_cmd: str) -> str:
+    """
+    Rewrites a scaling command to fill {w}x{h} and crop what overflows,
+    about the centre, as WordPress crops thumbnails. One reading the shared
+    {resized_src}, see share_resize, reads {src_img} again and crops it
+    before anything else.
+    """
+    crop = "-resize {w}x{h}^ -gravity center -extent {w}x{h} "
+    if "{resized_src}" in scaling_cmd:
+        program, args = scaling_cmd.split(" ", 1)
+        return "{} {}{}".format(
+            program, crop, args.replace("{resized_src}", "{src_img}"))
+    return scaling_cmd.replace("-resize {w}x{h} ", crop)
+
+
+def share_resize(scaling_cmd: str) -> str:
+    """
+    Rewrites a scaling command which resizes {src_img} itself to instead
+    read the shared {resized_src}, see ImgConvertor.use_resize_cache.
+    """
+    if "-resize {w}x{h} " not in scaling_cmd or "{src_img}" not in scaling_cmd:
+        return scaling_cmd
+    return scaling_cmd.replace("-resize {w}x{h} ", "").replace(
+        "{src_img}", "{resized_src}")
+
+
+PNG_QS = [255, 128, 64, 32, 16]
+LOSSY_QS = [80, 70, 60, 50]
+# AVIF and JPEG XL hold up at lower q, and trade time for size by an effort
+# of their own: the -define setting it, and the efforts to try, the first
+# the delegate's default.
+NEXT_GEN_QS = {"avif": [70, 60, 50, 40], "jxl": [90, 80, 70, 60]}
+EFFORT_DEFINES = {"avif": ("heic:speed", [6, 3]),
+                  "jxl": ("jxl:effort", [7, 9])}
+# The extent of q, for searching, by format.
+Q_RANGES = {"png": (2, 256), "jpg": (1, 100), "webp": (1, 100),
+            "avif": (1, 100), "jxl": (1, 100)}
+
+# How hard the encoders try, at the cost of time, see at_effort.
+EFFORTS = ("fast", "balanced", "max")
+# By format, the convert options of each effort, which replace one another.
+# png's is lossless, webp's method trades a little quality too. jpg has
+# none: its variants are progressive, which always optimizes the Huffman
+# coding. avif's and jxl's efforts are variants of their own, see
+# EFFORT_DEFINES.
+EFFORT_OPTIONS = {
+    "png": {"fast": "-define png:compression-level=1", "balanced": "",
+            "max": "-define png:compression-level=9"},
+    "webp": {"fast": "-define webp:method=2",
+             "balanced": "-define webp:method=4",
+             "max": "-define webp:method=6"},
+}
+
+
+def get_format_variants(q: int, suffix: str, fullsize_only: bool = False) \
+        -> List[Variant]:
+    """
+    :return: the variants, at q, for the format given by suffix.
+    """
+    if suffix == "png":
+        # PNG to PNG is lossless so even if we've already quantized before,
+        # we can recover the efficiently resized versions losslessly here.
+        if fullsize_only:
+            return [Variant(
+                q, "png", "no_resize",
+                "convert -strip -colors {q} {src_img} {dest_img}",
+                [],
+            )]
+        return [
+            Variant(
+                q, "png", "inc_resize",
+                "convert -strip -colors {q} {src_img} {dest_img}",
+                ["convert -strip -resize {w}x{h} -colors {q} {src_img} {resized_img}"],
+            ),
+            Variant(
+                q, "png", "aft_resize",
+                "convert -strip -colors {q} {src_img} {dest_img}",
+                ["convert -strip -resize {w}x{h} {src_img} {tmp_img}",
+                "convert -strip -colors {q} {tmp_img} {resized_img}"]
+            )]
+    if suffix == "jpg":
+        if fullsize_only:
+            return [Variant(
+                q, "jpg", "no_resize",
+                "convert -strip -interlace Plane -gaussian-blur 0.05 -quality {q} {src_img} {dest_img}",
+                []
+            )]
+        return [Variant(
+            q, "jpg", "inc_resize",
+            "convert -strip -interlace Plane -gaussian-blur 0.05 -quality {q} {src_img} {dest_img}",
+            ["convert -strip -resize {w}x{h} -interlace Plane -gaussian-blur 0.05 -quality {q} {src_img} {resized_img}"]
+        )]
+    if suffix == "webp":
+        if fullsize_only:
+            return [Variant(
+                q, "webp", "no_resize",
+                "convert -strip -define webp:method=6 -quality {q} {src_img} {dest_img}",
+                []
+            )]
+        return [Variant(
+            q, "webp", "inc_resize",
+            "convert -strip -define webp:method=6 -quality {q} {src_img} {dest_img}",
+            ["convert -strip -resize {w}x{h} -define webp:method=6 -quality {q} {src_img} {resized_img}"]
+        )]
+    if suffix in EFFORT_DEFINES:
+        define, efforts = EFFORT_DEFINES[suffix]
+        variants = []
+        for effort in efforts:
+            options = "-define {}={} -quality {{q}}".format(define, effort)
+            # e.g. inc_resize_speed6, by heic:speed=6.
+            descriptive = "{}_{}{}".format(
+                "no_resize" if fullsize_only else "inc_resize",
+                define.split(":")[1], effort)
+            variants.append(Variant(
+                q, suffix, descriptive,
+                "convert -strip {} {{src_img}} {{dest_img}}".format(options),
+                [] if fullsize_only else [
+                    "convert -strip -resize {{w}}x{{h}} {} {{src_img}} "
+                    "{{resized_img}}".format(options)]
+            ))
+        return variants
+    raise CompressorException("No variants for \"{}\"".format(suffix))
+
+
+def get_encoder_variants(q: int, suffix: str, encoders: List[str],
+                         fullsize_only: bool = False) -> List[Variant]:
+    """
+    :param encoders: those found, see encoders.find_encoders.
+    :return: the variants, at q, for the format given by suffix, by
+        dedicated encoders, from ImageMagick's png of the source and of each
+        size. None if the encoders have no way of making suffix.
+    """
+    variants = []
+    for descriptive, cmds in get_encode_cmds(suffix, encoders):
+        unscaled_cmd = "\n".join([
+            "convert -strip {src_img} {tmp_img}",
+            *cmds[:-1], cmds[-1].replace("{out}", "{dest_img}")])
+        scaling_cmds = [] if fullsize_only else [
+            "convert -strip -resize {w}x{h} {src_img} {tmp_img}",
+            *cmds[:-1], cmds[-1].replace("{out}", "{resized_img}")]
+        variants.append(
+            Variant(q, suffix, descriptive, unscaled_cmd, scaling_cmds))
+    return variants
+
+
+def get_found_encoders() -> List[str]:
+    """:return: encoders.find_encoders, having said which weren't found."""
+    found = find_encoders()
+    missing = [encoder for encoder in ENCODERS if encoder not in found]
+    if missing:
+        print("{} not found, or not mozjpeg's for cjpeg: skipping their "
+              "variants.".format(", ".join(missing)))
+    return found
+
+
+def require_scoring() -> None:
+    """
+    Checks, before anything is generated, that scoring can run.
+
+    :raises CompressorException: saying what to install, if not.
+    """
+    try:
+        require_numpy()
+    except ImportError as ierr:
+        raise CompressorException(str(ierr))
+
+
+def get_unwritable(suffixes: List[str]) -> List[str]:
+    """
+    :return: those of suffixes the local ImageMagick has no delegate to
+        write, having said so.
+    """
+    if not suffixes:
+        return []
+    try:
+        formats = cmn.get_imagemagick_formats()
+    except (OSError, RuntimeError) as err:
+        print("Couldn't list ImageMagick's formats: {}".format(err))
+        formats = {}
+    unwritable = [suffix for suffix in suffixes
+                  if "w" not in formats.get(suffix, "")]
+    for suffix in unwritable:
+        print("ImageMagick can't write {} here, skipping its variants."
+              .format(suffix))
+    return unwritable
+
+
+def get_suffixes(skip_jpg: bool = True, skip_png: bool = False,
+                 skip_webp: bool = False, skip_avif: bool = True,
+                 skip_jxl: bool = True) -> List[str]:
+    return [suffix for suffix, skip in (
+        ("png", skip_png), ("jpg", skip_jpg), ("webp", skip_webp),
+        ("avif", skip_avif), ("jxl", skip_jxl)) if not skip]
+
+
+def get_variants(skip_jpg: bool = True, skip_png: bool = False,
+                 skip_webp: bool = False, fullsize_only: bool = False,
+                 share_resizes: bool = False, encoders: List[str] = (),
+                 skip_avif: bool = True, skip_jxl: bool = True,
+                 effort: str = None) -> List[Variant]:
+    """
+    Every candidate to be generated, in the order to list them.
+
+    :param skip_jpg: don't explore jpg output options
+    :param skip_png: don't explore png output options
+    :param skip_webp: don't explore webp output options
+    :param fullsize_only: to extend the use beyond WordPress, don't generate
+        resized images, instead apply algo's only to the full size image.
+    :param share_resizes: read {resized_src} rather than resize per variant.
+    :param encoders: also make each format with these dedicated encoders,
+        see get_encoder_variants.
+    :param skip_avif: don't explore avif output options
+    :param skip_jxl: don't explore jxl (JPEG XL) output options
+    :param effort: encode at this of EFFORTS, see at_effort.
+    """
+    variants = []
+    if not skip_png:
+        for q in PNG_QS:
+            variants += get_format_variants(q, "png", fullsize_only)
+            variants += get_encoder_variants(q, "png", encoders, fullsize_only)
+    for q in LOSSY_QS:
+        if not skip_jpg:
+            variants += get_format_variants(q, "jpg", fullsize_only)
+            variants += get_encoder_variants(q, "jpg", encoders, fullsize_only)
+        if not skip_webp:
+            variants += get_format_variants(q, "webp", fullsize_only)
+            variants += get_encoder_variants(
+                q, "webp", encoders, fullsize_only)
+    for suffix, skip in (("avif", skip_avif), ("jxl", skip_jxl)):
+        if not skip:
+            for q in NEXT_GEN_QS[suffix]:
+                variants += get_format_variants(q, suffix, fullsize_only)
+    if share_resizes:
+        variants = [shared_resizes(variant) for variant in variants]
+    return [at_effort(variant, effort) for variant in variants]
+
+
+def shared_resizes(variant: Variant) -> Variant:
+    return variant._replace(
+        scaling_cmds=list(map(share_resize, variant.scaling_cmds)))
+
+
+def effort_cmd(cmd: str, suffix: str, effort: str) -> str:
+    """
+    :param cmd: a variant's command, or lines of them, for suffix.
+    :return: cmd with the options of effort in place of any other's, in each
+        convert writing {dest_img} or {resized_img}, and each dedicated
+        encoder.
+    """
+    lines = []
+    for line in cmd.splitlines():
+        args = line.split(" ")
+        if args[0] == "convert" and \
+                args[-1] in ("{dest_img}", "{resized_img}") and \
+                suffix in EFFORT_OPTIONS:
+            options = EFFORT_OPTIONS[suffix]
+            for other in options.values():
+                if other:
+                    line = line.replace(" " + other, "")
+            if options[effort]:
+                args = line.split(" ")
+                line = " ".join(args[:-2] + [options[effort]] + args[-2:])
+        elif args[0] in ENCODER_EFFORTS and \
+                ENCODER_EFFORTS[args[0]][0] in args[:-1]:
+            option, levels = ENCODER_EFFORTS[args[0]]
+            args[args.index(option) + 1] = levels[effort]
+            line = " ".join(args)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def at_effort(variant: Variant, effort: Optional[str]) -> Variant:
+    """
+    :param effort: one of EFFORTS, or None for the commands as written.
+    :return: variant, encoding at effort. Its name is unchanged, the same
+        candidate, only smaller or quicker to make.
+    """
+    if effort is None:
+        return variant
+    return variant._replace(
+        unscaled_cmd=effort_cmd(variant.unscaled_cmd, variant.suffix, effort),
+        scaling_cmds=[effort_cmd(cmd, variant.suffix, effort)
+                      for cmd in variant.scaling_cmds])
+
+
+def get_variant_families(suffixes: List[str], fullsize_only: bool = False,
+                         share_resizes: bool = False,
+                         encoders: List[str] = (), effort: str = None) \
+        -> List[VariantFamily]:
+    """
+    For searching q rather than trying a grid of them: one family for each
+    kind of variant get_format_variants, and get_encoder_variants given
+    encoders, makes for each suffix.
+    """
+    def get_suffix_variants(q, suffix):
+        return get_format_variants(q, suffix, fullsize_only) + \
+               get_encoder_variants(q, suffix, encoders, fullsize_only)
+
+    families = []
+    for suffix in suffixes:
+        q_lo, q_hi = Q_RANGES[suffix]
+        for i in range(len(get_suffix_variants(q_hi, suffix))):
+            def make_variant(q, suffix=suffix, i=i):
+                variant = get_suffix_variants(q, suffix)[i]
+                if share_resizes:
+                    variant = shared_resizes(variant)
+                return at_effort(variant, effort)
+            families.append(VariantFamily(make_variant, q_lo, q_hi))
+    return families
+
+
 def resize(
         img_name: str,
         conf_file: str = "config.json",
         skip_jpg: bool=True, skip_png: bool=False, skip_webp: bool=False,
-        fullsize_only: bool=False):
+        fullsize_only: bool=False, jobs: int = 1, pipeline: bool = False,
+        mpc_source: bool = False, share_resizes: bool = False,
+        resize_cache_mb: int = 512, pyramid: bool = False,
+        pyramid_min_psnr: float = None, dedupe: bool = False,
+        plan_only: bool = False, lazy: bool = False, search: bool = False,
+        target_kb: int = None, min_psnr: float = None, score: bool = False,
+        auto_select: str = None, cache_dir: str = None, cache_mb: int = 1024,
+        resume: bool = False, one_trip: bool = False,
+        transport: str = "sftp", sftp_channels: int = 1,
+        sftp_window_kb: int = None, sftp_packet_kb: int = None,
+        delta: bool = False, overlap: bool = False, prescaled: bool = False,
+        engine: str = "imagemagick", encoders: bool = False,
+        skip_avif: bool = True, skip_jxl: bool = True, effort: str = None):
     """
     300 (medium) and 1024 (large) are maximums that the largest dimension takes.
     These, and thumbnail, sizes are configurable through the WP UI.
@@ -281,12 +1706,64 @@ def resize(
     :param skip_webp: don't explore webp output options
     :param fullsize_only: to extend the use beyond WordPress, don't generate
         resized images, instead apply algo's only to the full size image.
+    :param jobs: how many ImageMagick commands may run at once.
+    :param pipeline: one ImageMagick process per variant, decoding the source
+        once, instead of one per size.
+    :param mpc_source: decode the source once to a memory-mappable .mpc pixel
+        cache for every command to read, instead of each decoding it.
+    :param share_resizes: resize to each size once, losslessly, for every
+        variant to encode from.
+    :param resize_cache_mb: disk allowed those shared resizes.
+    :param pyramid: share resizes, but make each from the next larger size
+        rather than the source.
+    :param pyramid_min_psnr: if given, check pyramid resizes are within this
+        many dB PSNR of resizing directly, falling back to direct if not.
+    :param dedupe: plan every command before running any, and run identical
+        commands once.
+    :param plan_only: print how many commands would run, with and without
+        deduplication, and stop there.
+    :param lazy: render just the full size and smallest size of each variant
+        to choose from, and the other sizes only for the one chosen.
+    :param search: instead of the fixed grid of q, search q for each kind of
+        variant, towards target_kb and/or min_psnr.
+    :param target_kb: the most KB a variant, all its sizes, may total.
+    :param min_psnr: the least PSNR, in dB, its full size image may have.
+    :param score: score every image against the source, by SSIM and PSNR,
+        for the summary, gallery and manifest.
+    :param auto_select: choose unattended by this SelectionPolicy, e.g.
+        "min_ssim=0.98", rather than asking. Scores if the policy needs it.
+    :param cache_dir: keep outputs here, and reuse those of earlier runs.
+    :param cache_mb: disk allowed cache_dir.
+    :param resume: carry on from tmp/checkpoint.json, left by a run which
+        failed, rather than starting over.
+    :param one_trip: stage every size on the server, then install them with
+        one remote command rather than one apiece.
+    :param transport: see UploadOptions.
+    :param sftp_channels: see UploadOptions.
+    :param sftp_window_kb: see UploadOptions.
+    :param sftp_packet_kb: see UploadOptions.
+    :param delta: send only the sizes whose hash differs from the server's.
+    :param overlap: stage the sizes while uploading the media, rather than
+        after.
+    :param prescaled: make the attachment of the sizes made here, by WP-CLI,
+        rather than uploading the media for WordPress to resize.
+    :param engine: what runs the variants' commands, see
+        ImgConvertor.use_engine.
+    :param encoders: also make each format with whichever of the dedicated
+        encoders, see encoders.py, are installed.
+    :param skip_avif: don't explore avif output options. Skipped anyway if
+        ImageMagick has no delegate to write it.
+    :param skip_jxl: don't explore jxl (JPEG XL) output options, likewise,
+        and unless prescaled, since WordPress won't take a jxl upload.
+    :param effort: render the variants at this of EFFORTS, see at_effort,
+        then encode the chosen one again at max before uploading it. None
+        for the commands as written.
     :return:
     """
     if not os.path.isfile(img_name):
         fqfnm = Path(img_name).resolve()
         raise FileNotFoundError("\"{}\" not found. Looking for: \"{}\".".format(img_name, fqfnm))
-    if img_name.split(".")[-1] not in ["png", "jpg", "jpeg", "webp"]:
+    if img_name.split(".")[-1] not in IMG_SUFFIXES:
         raise RuntimeError("Unknown image file type: \"{}\"".format(img_name))
 
     w, h = cmn.get_img_wxh(img_name)
@@ -294,63 +1771,116 @@ def resize(
     widths_and_heights, _ = scaler.get_widths_and_heights()
     subdir_root = "tmp/"
     img_processor = ImgConvertor(img_name, widths_and_heights, subdir_root)
-    if not skip_png:
-        # PNG to PNG is lossless so even if we've already quantized before,
-        # we can recover the efficiently resized versions losslessly here.
-        for q in [255, 128, 64, 32, 16]:
-            if fullsize_only:
-                img_processor.transform_to_dir(
-                    q, "png", "no_resize",
-                    "convert -strip -colors {q} {src_img} {dest_img}",
-                    [],
-                )
-            else:
-                img_processor.transform_to_dir(
-                    q, "png", "inc_resize",
-                    "convert -strip -colors {q} {src_img} {dest_img}",
-                    ["convert -strip -resize {w}x{h} -colors {q} {src_img} {resized_img}"],
-                )
-                img_processor.transform_to_dir(
-                    q, "png", "aft_resize",
-                    "convert -strip -colors {q} {src_img} {dest_img}",
-                    ["convert -strip -resize {w}x{h} {src_img} {tmp_img}",
-                    "convert -strip -colors {q} {tmp_img} {resized_img}"]
-                )
-    for q in [80, 70, 60, 50]:
-        if not skip_jpg:
-            if fullsize_only:
-                img_processor.transform_to_dir(
-                    q, "jpg", "no_resize",
-                    "convert -strip -interlace Plane -gaussian-blur 0.05 -quality {q} {src_img} {dest_img}",
-                    []
-                )
-            else:
-                img_processor.transform_to_dir(
-                    q, "jpg", "inc_resize",
-                    "convert -strip -interlace Plane -gaussian-blur 0.05 -quality {q} {src_img} {dest_img}",
-                    ["convert -strip -resize {w}x{h} -interlace Plane -gaussian-blur 0.05 -quality {q} {src_img} {resized_img}"]
-                )
-        if not skip_webp:
-            if fullsize_only:
-                img_processor.transform_to_dir(
-                    q, "webp", "no_resize",
-                    "convert -strip -define webp:method=6 -quality {q} {src_img} {dest_img}",
-                    []
-                )
-            else:
-                img_processor.transform_to_dir(
-                    q, "webp", "inc_resize",
-                    "convert -strip -define webp:method=6 -quality {q} {src_img} {dest_img}",
-                    ["convert -strip -resize {w}x{h} -define webp:method=6 -quality {q} {src_img} {resized_img}"]
-                )
-
-    process_outputs(w, h, img_processor, widths_and_heights, conf_file)
+    img_processor.upload_options = UploadOptions(
+        one_trip, transport, sftp_channels, sftp_window_kb, sftp_packet_kb,
+        delta, overlap, prescaled)
+    img_processor.named_sizes = scaler.get_named_sizes()
+    share_resizes = share_resizes or pyramid
+    found_encoders = get_found_encoders() if encoders else []
+    unwritable = get_unwritable(get_suffixes(True, True, True, skip_avif,
+                                             skip_jxl))
+    skip_avif = skip_avif or "avif" in unwritable
+    skip_jxl = skip_jxl or "jxl" in unwritable
+    if not skip_jxl and not prescaled and not plan_only:
+        print("WordPress won't take jxl uploaded, only --prescaled, "
+              "skipping its variants.")
+        skip_jxl = True
+    variants = get_variants(skip_jpg, skip_png, skip_webp, fullsize_only,
+                            share_resizes, found_encoders, skip_avif, skip_jxl,
+                            effort)
+    if search and target_kb is None and min_psnr is None:
+        raise CompressorException("Searching needs a target_kb or min_psnr.")
+    if search and lazy and target_kb is not None:
+        raise CompressorException(
+            "Lazy rendering measures just two sizes of each variant, so can't "
+            "search for a target_kb which every size must fit.")
+    if engine != "imagemagick" and (pipeline or mpc_source):
+        raise CompressorException(
+            "Pipelining and mpc_source are ImageMagick's, the {} engine "
+            "decodes the source once anyway.".format(engine))
+    img_processor.use_engine(engine)
+    policy = None
+    if auto_select is not None:
+        try:
+            policy = SelectionPolicy.parse(auto_select)
+        except ValueError as verr:
+            raise CompressorException(str(verr))
+        score = score or policy.needs_scores()
+    if score:
+        require_scoring()
+    if share_resizes:
+        img_processor.use_resize_cache(
+            resize_cache_mb * 1024 * 1024, pyramid, pyramid_min_psnr)
+    if plan_only:
+        print(img_processor.plan_all(variants, pipeline)[0].describe())
+        return
+    output_cache = None
+    if cache_dir:
+        output_cache = img_processor.use_output_cache(
+            cache_dir, cache_mb * 1024 * 1024)
+    img_processor.use_checkpoint(variants, resume)
+    if mpc_source:
+        img_processor.decode_source()
+    if lazy:
+        img_processor.widths_and_heights = widths_and_heights[:1]
+    # Searching tries qualities it throws away, so is scored once it's done.
+    if score and not search:
+        img_processor.use_scorer()
+    try:
+        if resume and img_processor.restore_choice():
+            print("Resuming with {}, chosen before.".format(
+                img_processor.all_dirs[0][1]))
+        elif search:
+            variants = img_processor.search_qualities(
+                get_variant_families(
+                    get_suffixes(skip_jpg, skip_png, skip_webp, skip_avif,
+                                 skip_jxl),
+                    fullsize_only, share_resizes, found_encoders, effort),
+                target_kb * 1024 if target_kb is not None else None,
+                min_psnr, jobs, pipeline, dedupe)
+        else:
+            img_processor.transform_all(variants, jobs, pipeline, dedupe)
+        if output_cache:
+            print(output_cache.describe())
+        if score:
+            img_processor.score_all(jobs)
+        final_variants = None
+        if effort not in (None, "max"):
+            final_variants = [at_effort(v, "max") for v in variants]
+        process_outputs(w, h, img_processor, widths_and_heights, conf_file,
+                        (final_variants or variants) if lazy else None, jobs,
+                        policy, final_variants)
+    finally:
+        if share_resizes:
+            img_processor.resize_cache.clear()
+        img_processor.remove_decoded_source()
 
 
 def process_outputs(
-        w, h, img_processor: ImgConvertor, widths_and_heights, conf_file: str):
+        w, h, img_processor: ImgConvertor, widths_and_heights, conf_file: str,
+        lazy_variants: List[Variant] = None, jobs: int = 1,
+        policy: SelectionPolicy = None, final_variants: List[Variant] = None):
+    """
+    :param lazy_variants: if the variants were rendered lazily, those
+        variants, so that the chosen one can be completed.
+    :param jobs: how many ImageMagick commands may run at once completing it.
+    :param policy: if given, choose by it rather than asking.
+    :param final_variants: if the variants were rendered at a lower effort,
+        them at max, to encode the chosen one again with.
+    """
     img_processor.present_gallery(w, h, widths_and_heights)
-    chosen_generated_dir = img_processor.select_one()
+    img_processor.write_manifest()
+    if policy:
+        chosen_generated_dir = img_processor.auto_select(policy)
+    else:
+        chosen_generated_dir = img_processor.select_one()
+    img_processor.write_manifest()
+    if final_variants:
+        img_processor.reencode_variant(
+            chosen_generated_dir, final_variants, jobs)
+    if lazy_variants:
+        img_processor.complete_variant(
+            chosen_generated_dir, lazy_variants, widths_and_heights, jobs)
     try:
         img_processor.upload(chosen_generated_dir, conf_file)
     except requests.exceptions.ConnectionError as rex_conn:
@@ -414,6 +1944,18 @@ image_uploader_bot. For most cases the test_bot account will be fine.
         "-w", "--skip_webp_generation",
         help="Don't bother producing webp outputs as they were only recently introduced.",
         action="store_true")
+    parser.add_argument(
+        "--avif_generation",
+        help="Also produce avif outputs, slow to encode and only uploadable "
+             "to WordPress 6.5 or later. Skipped if ImageMagick has no "
+             "delegate to write them.",
+        action="store_true")
+    parser.add_argument(
+        "--jxl_generation",
+        help="Also produce JPEG XL outputs, which few browsers show. Skipped "
+             "if ImageMagick has no delegate to write them, or without "
+             "--prescaled, since WordPress won't take them uploaded.",
+        action="store_true")
     parser.add_argument(
         "-f", "--fullsize_only",
         help="Don't resize the original, produce only full size copies.",
@@ -422,6 +1964,155 @@ image_uploader_bot. For most cases the test_bot account will be fine.
         "-c", "--config_file",
         help="Name of json file describing containing WordPress credentials.",
         default="config.json")
+    parser.add_argument(
+        "--jobs",
+        help="How many ImageMagick commands to run at once, across variants "
+             "and sizes.",
+        type=int, default=1)
+    parser.add_argument(
+        "--pipeline",
+        help="Run one ImageMagick process per variant, writing every size "
+             "from a single decode of the source.",
+        action="store_true")
+    parser.add_argument(
+        "--mpc_source",
+        help="Decode the source once to an ImageMagick .mpc pixel cache which "
+             "every command then reads.",
+        action="store_true")
+    parser.add_argument(
+        "--share_resizes",
+        help="Resize the source to each size once, losslessly, and encode "
+             "every quality and format from that.",
+        action="store_true")
+    parser.add_argument(
+        "--resize_cache_mb",
+        help="Disk allowed the shared resizes before the least recently used "
+             "are deleted.",
+        type=int, default=512)
+    parser.add_argument(
+        "--pyramid",
+        help="Share resizes, making each size from the next larger one "
+             "rather than from the source. Faster for huge sources, but not "
+             "exact.",
+        action="store_true")
+    parser.add_argument(
+        "--pyramid_min_psnr",
+        help="Check each pyramid size against a direct resize and use the "
+             "direct one if the PSNR, in dB, falls below this.",
+        type=float)
+    parser.add_argument(
+        "--dedupe",
+        help="Plan every command before running any, so that identical "
+             "commands, across variants, run once.",
+        action="store_true")
+    parser.add_argument(
+        "--plan",
+        help="Print how many commands would run, before and after "
+             "deduplication, then exit.",
+        action="store_true")
+    parser.add_argument(
+        "--lazy",
+        help="Render only the full and smallest sizes to choose between, "
+             "then the other sizes for the chosen variant alone.",
+        action="store_true")
+    parser.add_argument(
+        "--search",
+        help="Bisect q for each kind of variant, towards --target_kb and/or "
+             "--min_psnr, instead of trying a fixed grid of q.",
+        action="store_true")
+    parser.add_argument(
+        "--target_kb",
+        help="When searching, the most KB a variant, all sizes, may total.",
+        type=int)
+    parser.add_argument(
+        "--min_psnr",
+        help="When searching, the least PSNR, in dB, of a variant's full "
+             "size image against the source.",
+        type=float)
+    parser.add_argument(
+        "--score",
+        help="Score every image against the source, by SSIM and PSNR, in "
+             "the summary, gallery and manifest.json. Needs numpy.",
+        action="store_true")
+    parser.add_argument(
+        "--auto_select",
+        help="Choose unattended, the smallest variant meeting constraints "
+             "such as \"min_ssim=0.98\", \"min_psnr=40\", \"max_kb=40\" "
+             "and \"prefer=webp/png\", comma separated.",
+        metavar="POLICY")
+    parser.add_argument(
+        "--cache_dir",
+        help="Keep every output here, by a hash of the source, command and "
+             "ImageMagick version, and reuse them on later runs.")
+    parser.add_argument(
+        "--cache_mb",
+        help="Disk allowed --cache_dir before the least recently used "
+             "outputs are deleted.",
+        type=int, default=1024)
+    parser.add_argument(
+        "--resume",
+        help="Carry on from where a failed run stopped, as recorded in "
+             "tmp/checkpoint.json, without repeating generation, the choice "
+             "or uploads already done.",
+        action="store_true")
+    parser.add_argument(
+        "--one_trip",
+        help="Stage every size on the server, then install them all with one "
+             "remote command, rather than a round trip apiece.",
+        action="store_true")
+    parser.add_argument(
+        "--transport",
+        help="Stage the sizes on the server by SFTP, a put apiece, or as one "
+             "uncompressed tar stream piped into tar -x.",
+        choices=TRANSPORTS, default="sftp")
+    parser.add_argument(
+        "--sftp_channels",
+        help="By SFTP, put this many sizes at once, each over its own channel "
+             "of the one connection, and report each one's rate.",
+        type=int, default=1)
+    parser.add_argument(
+        "--sftp_window_kb",
+        help="Each SFTP channel's window, how much may be sent before it is "
+             "acknowledged. Paramiko's default is 2048.",
+        type=int)
+    parser.add_argument(
+        "--sftp_packet_kb",
+        help="Each SFTP channel's largest packet. Paramiko's default is 32.",
+        type=int)
+    parser.add_argument(
+        "--delta",
+        help="Hash the sizes already on the server, in one command, and send "
+             "only those which differ, as when retrying an upload.",
+        action="store_true")
+    parser.add_argument(
+        "--overlap",
+        help="Connect by SSH and stage the sizes while WordPress takes the "
+             "upload and makes its own sizes, leaving only their "
+             "installation to wait on it.",
+        action="store_true")
+    parser.add_argument(
+        "--prescaled",
+        help="Rather than upload the image for WordPress to resize, again, "
+             "copy it, every size and a thumbnail cropped here into place, "
+             "and insert the attachment and its metadata, by WP-CLI.",
+        action="store_true")
+    parser.add_argument(
+        "--engine",
+        help="Run the variants' convert commands with ImageMagick, a process "
+             "apiece, or in process with Pillow, decoding the source once.",
+        choices=ENGINES, default="imagemagick")
+    parser.add_argument(
+        "--encoders",
+        help="Also make each format with whichever of pngquant, oxipng, "
+             "cwebp and mozjpeg's cjpeg are installed, labelling each "
+             "variant with its encoder and encoding time.",
+        action="store_true")
+    parser.add_argument(
+        "--effort",
+        help="How hard the encoders try while rendering the variants to "
+             "choose from; the chosen one is encoded again at max before "
+             "uploading it. By default the commands are run as written.",
+        choices=EFFORTS)
     args = parser.parse_args(args_list)
     resize(
         args.src_img,
@@ -429,7 +2120,38 @@ image_uploader_bot. For most cases the test_bot account will be fine.
         args.skip_jpg_generation,
         args.skip_png_generation,
         args.skip_webp_generation,
-        args.fullsize_only
+        args.fullsize_only,
+        jobs=args.jobs,
+        pipeline=args.pipeline,
+        mpc_source=args.mpc_source,
+        share_resizes=args.share_resizes,
+        resize_cache_mb=args.resize_cache_mb,
+        pyramid=args.pyramid,
+        pyramid_min_psnr=args.pyramid_min_psnr,
+        dedupe=args.dedupe,
+        plan_only=args.plan,
+        lazy=args.lazy,
+        search=args.search,
+        target_kb=args.target_kb,
+        min_psnr=args.min_psnr,
+        score=args.score,
+        auto_select=args.auto_select,
+        cache_dir=args.cache_dir,
+        cache_mb=args.cache_mb,
+        resume=args.resume,
+        one_trip=args.one_trip,
+        transport=args.transport,
+        sftp_channels=args.sftp_channels,
+        sftp_window_kb=args.sftp_window_kb,
+        sftp_packet_kb=args.sftp_packet_kb,
+        delta=args.delta,
+        overlap=args.overlap,
+        prescaled=args.prescaled,
+        engine=args.engine,
+        encoders=args.encoders,
+        skip_avif=not args.avif_generation,
+        skip_jxl=not args.jxl_generation,
+        effort=args.effort
     )
 
 
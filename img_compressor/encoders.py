@@ -0,0 +1,93 @@
+"""
+Dedicated encoders, which usually make smaller files, faster, than
+ImageMagick's own: pngquant to quantize, oxipng to recompress, cwebp and
+mozjpeg's cjpeg. Each is optional, only those found on PATH are used.
+
+Their variants are commands like any other, ImageMagick still decoding and
+resizing, to a png {tmp_img} which the encoder reads. So that a command's
+output stays its last argument, those which only read stdin or write stdout
+are given "< file" and "> file", see cmn.run_shell_cmd.
+"""
+import shutil
+import subprocess
+from functools import lru_cache
+from typing import List, Tuple
+
+ENCODERS = ("pngquant", "oxipng", "cwebp", "cjpeg")
+
+# What each prints its version for.
+VERSION_ARGS = {"pngquant": "--version", "oxipng": "--version",
+                "cwebp": "-version", "cjpeg": "-version"}
+
+PNGQUANT_CMD = "pngquant --strip {q} - < {tmp_img} > {out}"
+OXIPNG_CMD = "oxipng --quiet --opt 4 --strip safe {in} --out {out}"
+CWEBP_CMD = "cwebp -quiet -m 6 -q {q} -metadata none {tmp_img} -o {out}"
+CJPEG_CMD = "cjpeg -quality {q} -optimize -progressive < {tmp_img} > {out}"
+
+# The option setting how hard each tries, and its argument for each effort,
+# see compressor.at_effort, in place of that in the commands above.
+ENCODER_EFFORTS = {
+    "cwebp": ("-m", {"fast": "2", "balanced": "4", "max": "6"}),
+    "oxipng": ("--opt", {"fast": "1", "balanced": "2", "max": "6"}),
+}
+
+
+@lru_cache(maxsize=None)
+def get_encoder_version(encoder: str) -> str:
+    """:return: the first line the encoder prints of its version."""
+    result = subprocess.run([encoder, VERSION_ARGS[encoder]],
+                            capture_output=True)
+    lines = (result.stdout + result.stderr).decode().strip().splitlines()
+    return "{} {}".format(encoder, lines[0] if lines else "unknown")
+
+
+def find_encoders(encoders: Tuple[str, ...] = ENCODERS) -> List[str]:
+    """
+    :return: those of encoders on PATH. A cjpeg only counts if it is
+        mozjpeg's, the others lack its trellis quantization.
+    """
+    found = []
+    for encoder in encoders:
+        if shutil.which(encoder) is None:
+            continue
+        if encoder == "cjpeg" and \
+                "mozjpeg" not in get_encoder_version(encoder).lower():
+            continue
+        found.append(encoder)
+    return found
+
+
+def get_encode_cmds(suffix: str, encoders: List[str]) \
+        -> List[Tuple[str, List[str]]]:
+    """
+    :param encoders: those found, see find_encoders.
+    :return: (descriptive, commands) for each way the encoders have of
+        making suffix, from a png {tmp_img}. The last command writes {out},
+        any before it {tmp_img2}.
+    """
+    if suffix == "png":
+        if "pngquant" in encoders and "oxipng" in encoders:
+            return [("pngquant_oxipng", [
+                PNGQUANT_CMD.replace("{out}", "{tmp_img2}"),
+                OXIPNG_CMD.replace("{in}", "{tmp_img2}")])]
+        if "pngquant" in encoders:
+            return [("pngquant", [PNGQUANT_CMD])]
+        if "oxipng" in encoders:
+            return [("oxipng", [
+                "convert -strip -colors {q} {tmp_img} {tmp_img2}",
+                OXIPNG_CMD.replace("{in}", "{tmp_img2}")])]
+    if suffix == "webp" and "cwebp" in encoders:
+        return [("cwebp", [CWEBP_CMD])]
+    if suffix == "jpg" and "cjpeg" in encoders:
+        return [("mozjpeg", [CJPEG_CMD])]
+    return []
+
+
+def get_encoded_by(cmds: List[str]) -> List[str]:
+    """:return: the encoders cmds run, in order."""
+    encoded_by = []
+    for cmd in cmds:
+        program = cmd.split(maxsplit=1)[0] if cmd.strip() else ""
+        if program in ENCODERS and program not in encoded_by:
+            encoded_by.append(program)
+    return encoded_by
@@ -0,0 +1,256 @@
+"""
+Runs the variants' convert commands in process, rather than starting a
+convert for each. The commands stay the description of every variant: an
+engine reads the few convert options they use, -strip, -resize, -gravity,
+-extent, -colors, -gaussian-blur, -interlace, -quality and the -define's of
+compressor.EFFORT_OPTIONS, and does the same with its own library. The source is decoded
+once and kept, for every variant and size to read.
+
+ImageMagick, by subprocess, remains the reference, and the only engine for
+the likes of --pipeline and --mpc_source which are about its processes.
+
+Pillow is optional, only needed for the pillow engine.
+"""
+import math
+import threading
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+import common_funcs as cmn
+
+try:
+    import PIL
+    from PIL import Image, ImageFilter
+except ImportError:
+    PIL = None
+
+ENGINES = ("imagemagick", "pillow")
+
+# The convert options an engine runs, with an argument, and without.
+ARG_OPTIONS = ("-resize", "-gravity", "-extent", "-colors", "-gaussian-blur",
+               "-interlace", "-quality", "-define")
+FLAG_OPTIONS = ("-strip",)
+
+# What the engine reads and writes, anything else, a {resized_src} .mpc
+# say, is left to convert.
+READS = (".png", ".jpg", ".jpeg", ".webp")
+WRITES = (".png", ".jpg", ".jpeg", ".webp")
+
+# ImageMagick's, when a command gives no -quality.
+DEFAULT_QUALITIES = {".jpg": 92, ".jpeg": 92, ".webp": 75}
+# zlib level of ImageMagick's default png -quality, 75.
+PNG_COMPRESS_LEVEL = 7
+
+
+class ConvertCmd(NamedTuple):
+    # (option, its argument or None), in the order given.
+    options: List[Tuple[str, Optional[str]]]
+    src_img: str
+    dest_img: str
+
+
+def parse_convert(split_cmd: List[str]) -> ConvertCmd:
+    """
+    :param split_cmd: "convert [options...] input output", split.
+    :raises ValueError: for anything but the options of ARG_OPTIONS and
+        FLAG_OPTIONS.
+    """
+    if len(split_cmd) < 3 or split_cmd[0] != "convert":
+        raise ValueError("Not a convert command: {}".format(
+            " ".join(split_cmd)))
+    args = split_cmd[1:-2]
+    options = []
+    i = 0
+    while i < len(args):
+        if args[i] in FLAG_OPTIONS:
+            options.append((args[i], None))
+            i += 1
+        elif args[i] in ARG_OPTIONS and i + 1 < len(args):
+            options.append((args[i], args[i + 1]))
+            i += 2
+        else:
+            raise ValueError("{} is not run in process: {}".format(
+                args[i], " ".join(split_cmd)))
+    return ConvertCmd(options, split_cmd[-2], split_cmd[-1])
+
+
+def parse_geometry(geometry: str) -> Tuple[int, int, bool]:
+    """:return: w, h and whether to fill, for "WxH^", rather than fit."""
+    fill = geometry.endswith("^")
+    w, h = geometry.rstrip("^").split("x")
+    return int(w), int(h), fill
+
+
+def fit(w: int, h: int, box_w: int, box_h: int, fill: bool = False) \
+        -> Tuple[int, int]:
+    """
+    :return: the size ImageMagick resizes w x h to, keeping its aspect, to
+        fit within, or fill, box_w x box_h. It rounds half up.
+    """
+    scale = (max if fill else min)(box_w / w, box_h / h)
+    return max(1, int(w * scale + 0.5)), max(1, int(h * scale + 0.5))
+
+
+def get_radius_and_sigma(radius_sigma: str) -> Tuple[float, float]:
+    """
+    :return: -gaussian-blur's "radius[xsigma]" as ImageMagick reads it, the
+        sigma 1.0 when not given.
+    """
+    radius, _, sigma = radius_sigma.partition("x")
+    return float(radius), float(sigma) if sigma else 1.0
+
+
+def get_blur(radius_sigma: str) -> "ImageFilter.Filter":
+    """
+    :return: the filter of -gaussian-blur's "radius[xsigma]". ImageMagick
+        cuts the kernel off at 2 * ceil(radius) + 1 pixels wide, a radius of
+        0.05 giving 3x3, so a width Pillow convolves is weighted as its is.
+    """
+    radius, sigma = get_radius_and_sigma(radius_sigma)
+    width = 2 * math.ceil(radius) + 1 if radius > 0 else 0
+    if width not in (3, 5):
+        return ImageFilter.GaussianBlur(sigma)
+    half = width // 2
+    weights = [math.exp(-(x * x + y * y) / (2 * sigma * sigma))
+               for y in range(-half, half + 1) for x in range(-half, half + 1)]
+    return ImageFilter.Kernel((width, width), weights, sum(weights))
+
+
+class PillowEngine:
+    """
+    Safe to run from many threads: each command reads the decoded source
+    without changing it.
+    """
+    name = "pillow"
+
+    def __init__(self, src_img: str):
+        if PIL is None:
+            raise ImportError("The pillow engine needs Pillow, "
+                              "pip install pillow.")
+        self.src_img = src_img
+        self.version = "Pillow " + PIL.__version__
+        self.decoded = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def decode(img_name: str) -> "Image.Image":
+        """:return: the image, in RGB(A) or L(A) for resizing."""
+        with Image.open(img_name) as img:
+            img.load()
+        if img.mode in ("RGB", "RGBA", "L", "LA"):
+            return img
+        if "transparency" in img.info or "A" in img.getbands():
+            return img.convert("RGBA")
+        return img.convert("RGB")
+
+    def load(self, img_name: str) -> "Image.Image":
+        """:return: the image, decoded just once if it is the source."""
+        if img_name != self.src_img:
+            return self.decode(img_name)
+        with self.lock:
+            if self.decoded is None:
+                self.decoded = self.decode(img_name)
+            return self.decoded
+
+    def release(self) -> None:
+        """Drops the decoded source, to be decoded again if run again."""
+        with self.lock:
+            self.decoded = None
+
+    def run(self, split_cmd: List[str]) -> str:
+        """
+        Does what convert would with split_cmd. Anything but a convert, a
+        dedicated encoder's command say, or a convert from or to a format
+        not read or written here, a shared resize's .mpc or avif say, is run
+        as it is.
+
+        :return: "", as run_shell_cmd_or_raise would the output of convert.
+        :raises ValueError: for options not run in process.
+        """
+        if split_cmd[0] != "convert" or len(split_cmd) < 3 or \
+                Path(split_cmd[-2]).suffix.lower() not in READS or \
+                Path(split_cmd[-1]).suffix.lower() not in WRITES:
+            return cmn.run_shell_cmd_or_raise(split_cmd)
+        cmd = parse_convert(split_cmd)
+        img = self.load(cmd.src_img)
+        strip = False
+        save_args = {}
+        for option, arg in cmd.options:
+            if option == "-strip":
+                strip = True
+            elif option == "-resize":
+                w, h, fill = parse_geometry(arg)
+                img = img.resize(fit(img.width, img.height, w, h, fill),
+                                 Image.LANCZOS)
+            elif option == "-gravity":
+                if arg.lower() != "center":
+                    raise ValueError("-gravity {} is not run in process."
+                                     .format(arg))
+            elif option == "-extent":
+                w, h, _ = parse_geometry(arg)
+                left = (img.width - w) // 2
+                top = (img.height - h) // 2
+                img = img.crop((left, top, left + w, top + h))
+            elif option == "-colors":
+                img = self.quantize(img, int(arg))
+            elif option == "-gaussian-blur":
+                img = img.filter(get_blur(arg))
+            elif option == "-interlace":
+                save_args["progressive"] = arg.lower() != "none"
+            elif option == "-quality":
+                save_args["quality"] = int(arg)
+            elif option == "-define":
+                key, _, value = arg.partition("=")
+                if key == "webp:method":
+                    save_args["method"] = int(value)
+                elif key == "png:compression-level":
+                    save_args["compress_level"] = int(value)
+                else:
+                    raise ValueError("-define {} is not run in process."
+                                     .format(arg))
+        self.save(img, cmd.dest_img, save_args, strip)
+        return ""
+
+    @staticmethod
+    def quantize(img: "Image.Image", colors: int) -> "Image.Image":
+        if img.mode in ("L", "LA"):
+            img = img.convert("RGBA" if img.mode == "LA" else "RGB")
+        # Pillow only quantizes alpha by octree.
+        method = Image.Quantize.FASTOCTREE if img.mode == "RGBA" \
+            else Image.Quantize.MEDIANCUT
+        return img.quantize(min(colors, 256), method)
+
+    @staticmethod
+    def save(img: "Image.Image", dest_img: str, save_args: dict,
+             strip: bool) -> None:
+        suffix = Path(dest_img).suffix.lower()
+        save_args["icc_profile"] = None if strip \
+            else img.info.get("icc_profile")
+        if suffix == ".png":
+            save_args.pop("progressive", None)
+            save_args.pop("quality", None)
+            save_args.setdefault("compress_level", PNG_COMPRESS_LEVEL)
+            img.save(dest_img, "PNG", **save_args)
+        elif suffix in (".jpg", ".jpeg"):
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            save_args.setdefault("quality", DEFAULT_QUALITIES[suffix])
+            img.save(dest_img, "JPEG", optimize=True, **save_args)
+        elif suffix == ".webp":
+            save_args.setdefault("quality", DEFAULT_QUALITIES[suffix])
+            img.save(dest_img, "WEBP", **save_args)
+        else:
+            raise ValueError("{} is not written in process.".format(dest_img))
+
+
+def get_engine(name: str, src_img: str) -> Optional[PillowEngine]:
+    """
+    :param name: one of ENGINES.
+    :return: the engine, or None for ImageMagick's convert.
+    """
+    if name == "imagemagick":
+        return None
+    if name == "pillow":
+        return PillowEngine(src_img)
+    raise ValueError("Unknown engine \"{}\", not one of {}.".format(
+        name, ", ".join(ENGINES)))
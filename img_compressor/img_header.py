@@ -0,0 +1,96 @@
+"""
+Reads the width and height of a png, jpg or webp from its header, in
+process, rather than starting identify for them. Only the bytes before the
+dimensions are read: a png or webp has them within its first 30 bytes, a jpg
+after its APPn segments, which are seeked over rather than read.
+
+Anything not understood here gives None, for the caller to ask identify.
+"""
+import struct
+from typing import BinaryIO, Optional, Tuple
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Baseline, extended sequential and progressive Huffman coded frames, all
+# libjpeg, and so convert, writes.
+JPEG_SOF_MARKERS = (0xc0, 0xc1, 0xc2)
+
+# Markers standing alone, without a length or segment following.
+JPEG_STANDALONE_MARKERS = (0x01, *range(0xd0, 0xd8))
+
+VP8_START_CODE = b"\x9d\x01\x2a"
+VP8L_SIGNATURE = 0x2f
+
+
+def read_png_wxh(f_in: BinaryIO) -> Optional[Tuple[int, int]]:
+    header = f_in.read(24)
+    if len(header) < 24 or header[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", header[16:24])
+
+
+def read_jpeg_wxh(f_in: BinaryIO) -> Optional[Tuple[int, int]]:
+    f_in.seek(2)
+    while True:
+        marker = f_in.read(2)
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+        # Any number of 0xff may pad before a marker.
+        while marker[1] == 0xff:
+            marker = marker[1:] + f_in.read(1)
+            if len(marker) < 2:
+                return None
+        if marker[1] in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker[1] in (0xd9, 0xda):
+            # The image ended, or its data started, with no frame header.
+            return None
+        length = f_in.read(2)
+        if len(length) < 2:
+            return None
+        if marker[1] in JPEG_SOF_MARKERS:
+            frame = f_in.read(5)
+            if len(frame) < 5:
+                return None
+            h, w = struct.unpack(">HH", frame[1:5])
+            # A height of 0 is left to a DNL marker, after the scan.
+            return (w, h) if h else None
+        if 0xc3 <= marker[1] <= 0xcf and marker[1] not in (0xc4, 0xc8, 0xcc):
+            # Lossless, hierarchical or arithmetic coded, left to identify.
+            return None
+        f_in.seek(struct.unpack(">H", length)[0] - 2, 1)
+
+
+def read_webp_wxh(f_in: BinaryIO) -> Optional[Tuple[int, int]]:
+    header = f_in.read(30)
+    if len(header) < 30 or header[8:12] != b"WEBP":
+        return None
+    chunk = header[12:16]
+    if chunk == b"VP8 " and header[23:26] == VP8_START_CODE:
+        w, h = struct.unpack("<HH", header[26:30])
+        # The top 2 bits of each are the upscaling asked of the decoder.
+        return w & 0x3fff, h & 0x3fff
+    if chunk == b"VP8L" and header[20] == VP8L_SIGNATURE:
+        bits = struct.unpack("<I", header[21:25])[0]
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    if chunk == b"VP8X":
+        return (int.from_bytes(header[24:27], "little") + 1,
+                int.from_bytes(header[27:30], "little") + 1)
+    return None
+
+
+def read_wxh(file_name: str) -> Optional[Tuple[int, int]]:
+    """
+    :return: the image's width and height, or None if its format, or
+        something in its header, is not one read here.
+    """
+    with open(file_name, "rb") as f_in:
+        magic = f_in.read(12)
+        f_in.seek(0)
+        if magic.startswith(PNG_SIGNATURE):
+            return read_png_wxh(f_in)
+        if magic.startswith(b"\xff\xd8"):
+            return read_jpeg_wxh(f_in)
+        if magic.startswith(b"RIFF") and magic[8:12] == b"WEBP":
+            return read_webp_wxh(f_in)
+    return None
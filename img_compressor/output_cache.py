@@ -0,0 +1,101 @@
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List
+
+
+class OutputCache:
+    """
+    Outputs of commands, kept on disk across runs, by a key of everything
+    which determines them: the ImageMagick version, the bytes of the source
+    and the command, with each file it reads replaced by what determines
+    that in turn. A command whose key is found is not run, its output is
+    copied from the cache instead.
+
+    When max_bytes is exceeded the least recently used outputs are deleted.
+    File modification times record use, so that it survives between runs;
+    they are read once, when the cache is opened, and kept track of in
+    memory from then on.
+    """
+    def __init__(self, cache_dir: str, im_version: str,
+                 max_bytes: int = 1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.im_version = im_version
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # Cached path -> bytes, least recently used first.
+        self.entries = OrderedDict()
+        self.total_b = 0
+        self.load_entries()
+
+    def load_entries(self) -> None:
+        try:
+            dir_entries = list(os.scandir(self.cache_dir))
+        except FileNotFoundError:
+            return
+        stats = []
+        for entry in dir_entries:
+            if entry.is_file() and not entry.name.endswith(".part"):
+                stat = entry.stat()
+                stats.append((stat.st_mtime, stat.st_size, entry.path))
+        for _, size, path in sorted(stats):
+            self.entries[path] = size
+            self.total_b += size
+
+    def key_of(self, parts: List[str]) -> str:
+        return hashlib.sha256(
+            "\0".join([self.im_version, *parts]).encode()).hexdigest()
+
+    def path_to(self, key: str, output: str) -> str:
+        return os.path.join(self.cache_dir, key + Path(output).suffix)
+
+    def fetch(self, key: str, output: str) -> bool:
+        """:return: whether output was copied from the cache."""
+        cached = self.path_to(key, output)
+        try:
+            shutil.copyfile(cached, output)
+            os.utime(cached)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return False
+        with self.lock:
+            self.hits += 1
+            if cached in self.entries:
+                self.entries.move_to_end(cached)
+            else:
+                # Stored by another run sharing the cache since it opened.
+                self.add_entry(cached, os.path.getsize(output))
+        return True
+
+    def store(self, key: str, output: str) -> None:
+        Path(self.cache_dir).mkdir(parents=True, exist_ok=True)
+        cached = self.path_to(key, output)
+        # Written aside and moved, so that nothing fetches it half written.
+        part = "{}.{}.part".format(cached, threading.get_ident())
+        shutil.copyfile(output, part)
+        os.replace(part, cached)
+        with self.lock:
+            self.add_entry(cached, os.path.getsize(output))
+            self.evict()
+
+    def add_entry(self, cached: str, n_bytes: int) -> None:
+        """Call holding self.lock."""
+        self.total_b += n_bytes - self.entries.pop(cached, 0)
+        self.entries[cached] = n_bytes
+
+    def evict(self) -> None:
+        """Call holding self.lock."""
+        while self.total_b > self.max_bytes and self.entries:
+            path, size = self.entries.popitem(last=False)
+            Path(path).unlink(missing_ok=True)
+            self.total_b -= size
+
+    def describe(self) -> str:
+        return "{} of {} commands reused from {}.".format(
+            self.hits, self.hits + self.misses, self.cache_dir)
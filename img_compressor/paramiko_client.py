@@ -1,5 +1,12 @@
+import queue
+import shlex
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Tuple
+
 import paramiko
-from paramiko import SSHClient
+from paramiko import SFTPClient, SSHClient
 
 
 def filter_dict_for_creds(conf: dict):
@@ -31,3 +38,141 @@ def get_client(
         raise
     return client
 
+
+def get_remote_sha256s(client: SSHClient, rmt_names: List[str]) -> dict:
+    """
+    Hashes remote files with one sha256sum, however many there are.
+
+    :return: remote name -> hex SHA-256, of those which exist and are
+        readable.
+    """
+    if not rmt_names:
+        return {}
+    stdout, _ = execute_remotely(client, "sha256sum -- {} 2>/dev/null".format(
+        " ".join(shlex.quote(rmt_name) for rmt_name in rmt_names)))
+    sha256s = {}
+    for line in stdout:
+        # A leading backslash marks a name sha256sum had to escape, which
+        # won't be any of ours as given, so it's left to be re-sent.
+        sha256, _, rmt_name = line.rstrip("\n").partition("  ")
+        if rmt_name and not sha256.startswith("\\"):
+            sha256s[rmt_name] = sha256
+    return sha256s
+
+
+def install_files(client: SSHClient, moves: List[Tuple[str, str]],
+                  owner: str = "www-data:www-data") \
+        -> Tuple[List[str], List[str]]:
+    """
+    Moves staged files into place, owned by owner, all in one remote command
+    and so one round trip however many there are.
+
+    Each file is moved alongside its destination, chown'd there, then renamed
+    over it, so the destination is replaced atomically and never seen with
+    the wrong owner. A file failing doesn't stop the rest.
+
+    :param moves: (staged path, destination path) pairs.
+    :return: the destinations installed, and the error output about any
+        which weren't.
+    """
+    script = []
+    for staged, final in moves:
+        part = shlex.quote(final + ".part")
+        final = shlex.quote(final)
+        script.append(
+            "if mv -f {staged} {part} && chown {owner} {part} && "
+            "mv -f {part} {final}; then echo {final}; "
+            "else echo failed to install {final} >&2; fi".format(
+                staged=shlex.quote(staged), part=part, final=final,
+                owner=shlex.quote(owner)))
+    stdout, stderr = execute_remotely(
+        client, "sudo sh -c {}".format(shlex.quote("\n".join(script))))
+    return [line.rstrip("\n") for line in stdout], \
+           [line.rstrip("\n") for line in stderr]
+
+
+def put_tar(client: SSHClient, rmt_dir: str, files: List[Tuple[str, str]]) \
+        -> None:
+    """
+    Puts files into rmt_dir as one tar stream, piped into tar -x over a
+    single exec channel, rather than an SFTP open, write and close apiece.
+    The images are compressed already, so the tar is not.
+
+    rmt_dir is made if need be, in the same command.
+
+    :param files: (local path, name in rmt_dir) pairs.
+    :raises RuntimeError: if the remote tar fails.
+    """
+    rmt_dir = shlex.quote(rmt_dir)
+    stdin, stdout, stderr = client.exec_command(
+        "mkdir -p {rmt_dir} && tar -x -C {rmt_dir} -f -".format(
+            rmt_dir=rmt_dir))
+    with tarfile.open(fileobj=stdin, mode="w|", format=tarfile.GNU_FORMAT) \
+            as tar:
+        for local_name, name in files:
+            info = tar.gettarinfo(local_name, arcname=name)
+            # As SFTP would leave them: owned by whoever extracts them.
+            info.mode = 0o644
+            info.uid = info.gid = 0
+            info.uname = info.gname = ""
+            with open(local_name, "rb") as f_in:
+                tar.addfile(info, f_in)
+    stdin.flush()
+    stdin.channel.shutdown_write()
+    errors = stderr.readlines()
+    exit_status = stdout.channel.recv_exit_status()
+    if exit_status != 0:
+        raise RuntimeError("tar -x exited {}: {}".format(
+            exit_status, "".join(errors).strip()))
+
+
+class Transfer(NamedTuple):
+    rmt_name: str
+    n_bytes: int
+    seconds: float
+
+    def describe(self) -> str:
+        return "{}: {:.0f}KB in {:.2f}s, {:.0f}KB/s".format(
+            self.rmt_name, self.n_bytes / 1024, self.seconds,
+            self.n_bytes / 1024 / max(self.seconds, 1e-6))
+
+
+def put_concurrently(client: SSHClient, files: List[Tuple[str, str]],
+                     channels: int = 4, window_size: int = None,
+                     max_packet_size: int = None) -> List[Transfer]:
+    """
+    Puts files over several SFTP channels of client's one transport, so a
+    file's writes aren't held up waiting on another's acknowledgements. At
+    most one file is in flight per channel.
+
+    :param files: (local path, remote path) pairs.
+    :param window_size: of each channel, paramiko's default if None.
+    :param max_packet_size: of each channel, paramiko's default if None.
+    :return: each file's transfer, in the order given.
+    """
+    transport = client.get_transport()
+    sftps = queue.Queue()
+    opened = []
+    try:
+        for _ in range(min(channels, len(files))):
+            sftp = SFTPClient.from_transport(
+                transport, window_size=window_size,
+                max_packet_size=max_packet_size)
+            opened.append(sftp)
+            sftps.put(sftp)
+
+        def put(local_name: str, rmt_name: str) -> Transfer:
+            sftp = sftps.get()
+            try:
+                start = time.monotonic()
+                attrs = sftp.put(local_name, rmt_name)
+                return Transfer(rmt_name, attrs.st_size,
+                                time.monotonic() - start)
+            finally:
+                sftps.put(sftp)
+
+        with ThreadPoolExecutor(max_workers=max(1, len(opened))) as executor:
+            return list(executor.map(lambda f: put(*f), files))
+    finally:
+        for sftp in opened:
+            sftp.close()
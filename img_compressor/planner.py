@@ -0,0 +1,133 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import List, NamedTuple, Dict, Callable, Hashable
+
+from scaler import DimsList
+
+
+class CmdChain(NamedTuple):
+    """Split commands to run in order, and the tmp images they leave."""
+    cmds: List[List[str]]
+    tmp_imgs: List[str]
+    # Sizes whose {resized_src} the commands read, see ResizeCache.
+    resizes: DimsList = []
+
+
+class PlanNode:
+    """
+    One command to run, writing its first output. Any further outputs are
+    those of identical commands merged into this one, to be copied from the
+    first once it is written.
+    """
+    def __init__(self, node_id: int, cmd: List[str], output: str,
+                 resizes: DimsList):
+        self.node_id = node_id
+        self.cmd = cmd
+        self.outputs = [output]
+        self.resizes = resizes
+        # node_ids which must run first.
+        self.deps = set()
+        self.owners = set()
+        # How long its command took, once run.
+        self.seconds = 0.0
+
+
+class CommandPlan:
+    """
+    Every command of every variant, expanded before any is run, as a DAG.
+
+    A command depends on whichever earlier command writes a file it reads,
+    which is how a chain's commands are ordered. Commands which would do the
+    same work merge into one node. They are identified by their arguments
+    less the output, but for the format the output's suffix chooses, with
+    any file read replaced by the node writing it, so that commands reading
+    different tmp images with the same contents also merge.
+    """
+    def __init__(self):
+        self.nodes = []
+        self.naive_count = 0
+        self.tmp_imgs = []
+        self.by_key = {}
+        self.producer_of = {}
+        self.owned = defaultdict(list)
+
+    def add_chain(self, owner: Hashable, chain: CmdChain) -> None:
+        """
+        :param owner: whatever the chain's failure should be reported
+            against, a variant's subdir_name for instance.
+        """
+        for split_cmd in chain.cmds:
+            self.naive_count += 1
+            *args, output = split_cmd
+            # The output's format is what the command encodes to, so it's
+            # part of the work done.
+            key = (Path(output).suffix.lower(), *(
+                ("node", self.producer_of[arg].node_id)
+                if arg in self.producer_of else arg for arg in args))
+            node = self.by_key.get(key)
+            if node is None:
+                node = PlanNode(len(self.nodes), split_cmd, output,
+                                chain.resizes)
+                node.deps = {self.producer_of[arg].node_id
+                             for arg in args if arg in self.producer_of}
+                self.nodes.append(node)
+                self.by_key[key] = node
+            elif output not in node.outputs:
+                node.outputs.append(output)
+            self.producer_of[output] = node
+            node.owners.add(owner)
+            self.owned[owner].append(node)
+        self.tmp_imgs += chain.tmp_imgs
+
+    def describe(self) -> str:
+        return "{} commands planned, {} after deduplication.".format(
+            self.naive_count, len(self.nodes))
+
+    def run(self, run_node: Callable[[PlanNode], None], jobs: int = 1) \
+            -> Dict[int, BaseException]:
+        """
+        Runs each node once all those it depends on have succeeded, up to
+        jobs at a time. A node whose dependency failed is not run, and is
+        given the same error.
+
+        :return: node_id to error, for nodes which failed or weren't run.
+        """
+        dependents = defaultdict(list)
+        waiting_on = {}
+        for node in self.nodes:
+            waiting_on[node.node_id] = len(node.deps)
+            for dep in node.deps:
+                dependents[dep].append(node)
+        errors = {}
+
+        def fail(node_id: int, error: BaseException):
+            errors[node_id] = error
+            for dependent in dependents[node_id]:
+                if dependent.node_id not in errors:
+                    fail(dependent.node_id, error)
+
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+            futures = {pool.submit(run_node, node): node
+                       for node in self.nodes if not node.deps}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = futures.pop(future)
+                    if future.exception():
+                        fail(node.node_id, future.exception())
+                        continue
+                    for dependent in dependents[node.node_id]:
+                        waiting_on[dependent.node_id] -= 1
+                        if waiting_on[dependent.node_id] == 0 and \
+                                dependent.node_id not in errors:
+                            futures[pool.submit(run_node, dependent)] = \
+                                dependent
+        return errors
+
+    def first_error_of(self, owner: Hashable,
+                       errors: Dict[int, BaseException]):
+        for node in self.owned[owner]:
+            if node.node_id in errors:
+                return errors[node.node_id]
+        return None
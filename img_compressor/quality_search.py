@@ -0,0 +1,97 @@
+from typing import Callable, NamedTuple, Any, Dict, Optional
+
+
+class VariantFamily(NamedTuple):
+    """Variants differing only in q, which may range from q_lo to q_hi."""
+    make_variant: Callable[[int], Any]
+    q_lo: int
+    q_hi: int
+
+
+class Measurement(NamedTuple):
+    n_bytes: int
+    # None when no min_score was asked for.
+    score: Optional[float]
+
+
+class QualitySearch:
+    """
+    Bisects q, for one family of variants, towards a target rather than
+    rendering a whole grid of them. Size and score are assumed to grow with
+    q, as they do for -quality and -colors.
+
+    With max_bytes the target is the highest q which fits; with min_score it
+    is the lowest q which scores at least that, and if both are given that
+    lowest q must fit too. The search gives up early once lowering q stops
+    shrinking the output, or when even q_hi scores too low. Each q is
+    measured once, so outputs already rendered are reused.
+    """
+    def __init__(self, family: VariantFamily,
+                 measure: Callable[[Any], Measurement],
+                 max_bytes: int = None, min_score: float = None):
+        """
+        :param measure: renders a variant, returning its measurement.
+        """
+        if max_bytes is None and min_score is None:
+            raise ValueError("A search needs max_bytes or min_score.")
+        self.family = family
+        self.measure = measure
+        self.max_bytes = max_bytes
+        self.min_score = min_score
+        self.tried: Dict[int, Measurement] = {}
+
+    def measure_q(self, q: int) -> Measurement:
+        if q not in self.tried:
+            self.tried[q] = self.measure(self.family.make_variant(q))
+        return self.tried[q]
+
+    def fits(self, q: int) -> bool:
+        return self.max_bytes is None or \
+               self.measure_q(q).n_bytes <= self.max_bytes
+
+    def scores(self, q: int) -> bool:
+        return self.min_score is None or \
+               self.measure_q(q).score >= self.min_score
+
+    def stopped_shrinking(self, q: int, higher_q: int) -> bool:
+        return self.measure_q(q).n_bytes >= self.measure_q(higher_q).n_bytes
+
+    def search(self) -> Optional[int]:
+        """:return: the q found, or None if the target can't be met."""
+        if self.min_score is not None:
+            q = self.search_lowest_scoring()
+            return q if q is not None and self.fits(q) else None
+        return self.search_highest_fitting()
+
+    def search_highest_fitting(self) -> Optional[int]:
+        lo, hi = self.family.q_lo, self.family.q_hi
+        if self.fits(hi):
+            return hi
+        best = None
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self.fits(mid):
+                best = lo = mid
+            elif self.stopped_shrinking(mid, hi):
+                # Lower q won't get under budget either.
+                return best
+            else:
+                hi = mid
+        if best is None and self.fits(lo):
+            best = lo
+        return best
+
+    def search_lowest_scoring(self) -> Optional[int]:
+        lo, hi = self.family.q_lo, self.family.q_hi
+        if not self.scores(hi):
+            return None
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if not self.scores(mid):
+                lo = mid
+            elif self.stopped_shrinking(mid, hi):
+                # Good enough, but no smaller, so no point going lower.
+                return hi
+            else:
+                hi = mid
+        return hi
@@ -0,0 +1,141 @@
+import os
+import shutil
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Tuple
+
+import common_funcs as cmn
+from scaler import DimsList
+
+
+class ResizeCache:
+    """
+    Lossless resizes of a source, made once per geometry and shared by every
+    quality and format which starts from that geometry.
+
+    Entries are ImageMagick .mpc/.cache pairs, so they hold the resampled
+    pixels at full depth, exactly as a "convert -resize" would have had them
+    in memory before encoding. They are large, hence the bound on disk. When
+    it is exceeded the least recently used entries not in use are deleted,
+    to be remade if wanted again.
+
+    Given a pyramid of sizes, each is instead resized from the next larger
+    size in it, 1536 from 2048 for example, rather than from the source.
+    That is far cheaper for huge sources but not exact. With min_psnr each
+    level is checked against a direct resize and replaced by it when it
+    falls short.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024,
+                 pyramid: DimsList = None, min_psnr: float = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.pyramid = sorted(pyramid or [])
+        self.min_psnr = min_psnr
+        # (w, h) -> PSNR of the pyramid level against the direct resize.
+        self.psnrs = {}
+        # (src_img, w, h) -> bytes on disk, least recently used first.
+        self.entries = OrderedDict()
+        self.pins = Counter()
+        self.lock = threading.Lock()
+        self.key_locks = defaultdict(threading.Lock)
+
+    def path_to(self, src_img: str, w: int, h: int) -> str:
+        return os.path.join(self.cache_dir, "{}{}".format(
+            Path(src_img).stem, cmn.get_name_decor(w, h, "mpc")))
+
+    @contextmanager
+    def resized(self, src_img: str, w: int, h: int):
+        """
+        Makes the resize, unless it is cached, and keeps it from eviction
+        until the with block exits.
+
+        :return: path to the resized .mpc.
+        """
+        key = (src_img, w, h)
+        with self.lock:
+            self.pins[key] += 1
+            key_lock = self.key_locks[key]
+        try:
+            with key_lock:
+                with self.lock:
+                    cached = key in self.entries
+                    if cached:
+                        self.entries.move_to_end(key)
+                if not cached:
+                    n_bytes = self.make(src_img, w, h)
+                    with self.lock:
+                        self.entries[key] = n_bytes
+                        self.evict()
+            yield self.path_to(src_img, w, h)
+        finally:
+            with self.lock:
+                self.pins[key] -= 1
+
+    def parent_of(self, w: int, h: int) -> Optional[Tuple[int, int]]:
+        """:return: the smallest pyramid size larger than w x h, if any."""
+        for parent in self.pyramid:
+            if parent != (w, h) and parent[0] >= w and parent[1] >= h:
+                return parent
+        return None
+
+    def make(self, src_img: str, w: int, h: int) -> int:
+        """:return: bytes written to disk."""
+        Path(self.cache_dir).mkdir(parents=True, exist_ok=True)
+        resized_src = self.path_to(src_img, w, h)
+        parent = self.parent_of(w, h)
+        if parent is None:
+            cmn.run_shell_cmd_or_raise([
+                "convert", src_img, "-resize", "{}x{}".format(w, h),
+                resized_src])
+        else:
+            with self.resized(src_img, *parent) as parent_img:
+                # ! since parent's rounded dimensions may not fit w x h
+                # exactly, as the source's would.
+                cmn.run_shell_cmd_or_raise([
+                    "convert", parent_img, "-resize", "{}x{}!".format(w, h),
+                    resized_src])
+            if self.min_psnr is not None:
+                self.check_fidelity(src_img, w, h)
+        return sum(os.path.getsize(p) for p in self.files_of(resized_src))
+
+    def check_fidelity(self, src_img: str, w: int, h: int) -> None:
+        """
+        Compares the pyramid's w x h with a direct resize of the source,
+        keeping the direct resize instead if the PSNR is below min_psnr.
+        """
+        resized_src = self.path_to(src_img, w, h)
+        direct_img = str(Path(resized_src).with_name(
+            Path(resized_src).stem + "-direct.mpc"))
+        cmn.run_shell_cmd_or_raise([
+            "convert", src_img, "-resize", "{}x{}".format(w, h), direct_img])
+        self.psnrs[(w, h)] = cmn.get_psnr(direct_img, resized_src)
+        if self.psnrs[(w, h)] < self.min_psnr:
+            print("Pyramid {}x{} is only {:.1f}dB PSNR from direct, using "
+                  "direct.".format(w, h, self.psnrs[(w, h)]))
+            for direct_file, pyramid_file in zip(
+                    self.files_of(direct_img), self.files_of(resized_src)):
+                os.replace(direct_file, pyramid_file)
+        else:
+            for direct_file in self.files_of(direct_img):
+                Path(direct_file).unlink(missing_ok=True)
+
+    @staticmethod
+    def files_of(resized_src: str):
+        return resized_src, str(Path(resized_src).with_suffix(".cache"))
+
+    def evict(self) -> None:
+        """Call holding self.lock."""
+        for key in list(self.entries):
+            if sum(self.entries.values()) <= self.max_bytes:
+                break
+            if self.pins[key] == 0:
+                del self.entries[key]
+                for file_name in self.files_of(self.path_to(*key)):
+                    Path(file_name).unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
@@ -3,6 +3,8 @@ from typing import List, Tuple, Any, Dict
 
 DimsList = List[Tuple[int, int]]
 
+MED_LARGE_W = 768
+
 
 class ResolutionsList(list):
     @staticmethod
@@ -55,7 +57,6 @@ class ImgScaler:
         :return: 2-tuple of generated sizes and a separate thumbnail size, if
             applicable, because that is zoom cropped unlike the rest.
         """
-        MED_LARGE_W = 768
         w_hs = ResolutionsList()
         # 768 isn't optional!
         if self.src_w > MED_LARGE_W:
@@ -73,6 +74,27 @@ class ImgScaler:
         # add_scaled_size_bounded_by(w_hs, src_w, src_h, 2560, 2560)
         return sorted(w_hs), thmb
 
+    def get_named_sizes(self) -> Dict[str, Tuple[int, int]]:
+        """
+        :return: the sizes of get_widths_and_heights, and the thumbnail, by
+            the names WordPress gives them in _wp_attachment_metadata.
+        """
+        named = {}
+        if self.src_w > MED_LARGE_W:
+            named["medium_large"] = self.fix_width(MED_LARGE_W)
+        for name, max_w, max_h in [
+                ("medium", self.med_w, self.med_h),
+                ("large", self.large_w, self.large_h),
+                ("1536x1536", 1536, 1536), ("2048x2048", 2048, 2048)]:
+            w_hs = ResolutionsList()
+            self.add_scaled_size_bounded_by(w_hs, max_w, max_h)
+            if w_hs:
+                named[name] = w_hs[0]
+        thmb = self.get_thumbnail(self.thumb_w, self.thumb_h)
+        if thmb:
+            named["thumbnail"] = thmb
+        return named
+
     def get_thumbnail(self, thumb_w: int, thumb_h: int):
         if self.src_w >= thumb_w or self.src_h >= thumb_h:
             # This, thumbnail, is the only cropping transform (by default).
@@ -0,0 +1,167 @@
+"""
+Scores candidates against the source in-process, with NumPy, rather than
+starting an ImageMagick compare per pair. Each image is decoded once, to 8
+bit RGB, by Pillow where it can and otherwise by convert, and the source
+once per size it's compared at.
+
+NumPy is optional, only needed for scoring, and Pillow is optional too.
+"""
+import subprocess
+import threading
+from collections import defaultdict
+from typing import NamedTuple, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Modes Pillow converts to 8 bit RGB as ImageMagick would. Deeper ones, and
+# CMYK, whose conversion differs, are left to convert.
+PILLOW_MODES = ("1", "L", "LA", "P", "PA", "RGB", "RGBA")
+
+# SSIM's constants for 8 bit images and its 8x8 window.
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+SSIM_WIN = 8
+
+
+class Score(NamedTuple):
+    ssim: float
+    # None when identical, where PSNR is infinite.
+    psnr: Optional[float]
+
+
+def require_numpy() -> None:
+    """:raises ImportError: saying what to install, if numpy is missing."""
+    if np is None:
+        raise ImportError("Scoring needs numpy, pip install numpy.")
+
+
+def decode(img_name: str, size: Tuple[int, int] = None) -> "np.ndarray":
+    """
+    Decodes in-process with Pillow, or with convert if Pillow is missing or
+    can't, for a .mpc or jxl for instance.
+
+    :param size: (w, h) to resize to first, exactly.
+    :return: height x width x 3 array of uint8, any alpha flattened onto
+        white as the gallery would show it.
+    """
+    rgb = decode_by_pillow(img_name, size) if Image is not None else None
+    if rgb is None:
+        rgb = decode_by_convert(img_name, size)
+    return rgb
+
+
+def decode_by_pillow(img_name: str,
+                     size: Tuple[int, int] = None) -> Optional["np.ndarray"]:
+    """:return: as decode, or None if Pillow can't read it as 8 bit."""
+    try:
+        with Image.open(img_name) as img:
+            if img.mode not in PILLOW_MODES:
+                return None
+            rgba = img.convert("RGBA")
+    except OSError:
+        return None
+    # Like ImageMagick's, a resize to the same size is a no-op.
+    if size:
+        rgba = rgba.resize(size, Image.LANCZOS)
+    white = Image.new("RGBA", rgba.size, "white")
+    return np.asarray(Image.alpha_composite(white, rgba).convert("RGB"))
+
+
+def decode_by_convert(img_name: str,
+                      size: Tuple[int, int] = None) -> "np.ndarray":
+    cmd = ["convert", img_name]
+    if size:
+        cmd += ["-resize", "{}x{}!".format(*size)]
+    cmd += ["-background", "white", "-alpha", "remove", "-depth", "8",
+            "ppm:-"]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError("\"{}\" exited {}: {}".format(
+            " ".join(cmd), result.returncode, result.stderr.decode().strip()))
+    # P6 header, "P6 w h 255", then the pixels, which may begin with bytes
+    # that look like whitespace, so they are taken from the end.
+    _, w, h = result.stdout[:64].split()[:3]
+    w, h = int(w), int(h)
+    pixels = np.frombuffer(result.stdout[-w * h * 3:], dtype=np.uint8)
+    return pixels.reshape(h, w, 3)
+
+
+def psnr(a: "np.ndarray", b: "np.ndarray") -> Optional[float]:
+    mse = np.mean(np.square(a.astype(np.float64) - b))
+    if mse == 0:
+        return None
+    return float(10 * np.log10(255 ** 2 / mse))
+
+
+def luma(rgb: "np.ndarray") -> "np.ndarray":
+    return rgb.astype(np.float64) @ np.array([0.299, 0.587, 0.114])
+
+
+def box_means(x: "np.ndarray", win: int) -> "np.ndarray":
+    """:return: the mean of every win x win window wholly inside x."""
+    sums = np.pad(x.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    return (sums[win:, win:] - sums[:-win, win:] - sums[win:, :-win]
+            + sums[:-win, :-win]) / (win * win)
+
+
+def downsample(x: "np.ndarray", factor: int) -> "np.ndarray":
+    h, w = x.shape[0] // factor * factor, x.shape[1] // factor * factor
+    return x[:h, :w].reshape(
+        h // factor, factor, w // factor, factor).mean(axis=(1, 3))
+
+
+def ssim(a: "np.ndarray", b: "np.ndarray") -> float:
+    """
+    Mean SSIM of the luma over 8x8 windows. Like the reference
+    implementation, large images are first averaged down so that the
+    smaller side is about 256, the scale SSIM was tuned at.
+    """
+    x, y = luma(a), luma(b)
+    factor = max(1, round(min(x.shape) / 256))
+    if factor > 1:
+        x, y = downsample(x, factor), downsample(y, factor)
+    win = min(SSIM_WIN, *x.shape)
+    mu_x, mu_y = box_means(x, win), box_means(y, win)
+    var_x = box_means(x * x, win) - mu_x * mu_x
+    var_y = box_means(y * y, win) - mu_y * mu_y
+    cov = box_means(x * y, win) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + SSIM_C1) * (2 * cov + SSIM_C2)) / \
+               ((mu_x * mu_x + mu_y * mu_y + SSIM_C1) * (var_x + var_y + SSIM_C2))
+    return float(ssim_map.mean())
+
+
+class Scorer:
+    """
+    Scores images against one source, at whatever size each image is. The
+    source is decoded, resized to exactly that size, once per size and kept,
+    so it is safe, and cheap, to score many images from many threads.
+    """
+    def __init__(self, src_img: str):
+        require_numpy()
+        self.src_img = src_img
+        self.references = {}
+        self.lock = threading.Lock()
+        self.key_locks = defaultdict(threading.Lock)
+
+    def reference(self, w: int, h: int) -> "np.ndarray":
+        with self.lock:
+            key_lock = self.key_locks[(w, h)]
+        with key_lock:
+            if (w, h) not in self.references:
+                self.references[(w, h)] = decode(
+                    self.src_img, (w, h))
+            return self.references[(w, h)]
+
+    def score(self, img_name: str) -> Score:
+        candidate = decode(img_name)
+        h, w = candidate.shape[:2]
+        reference = self.reference(w, h)
+        return Score(ssim(reference, candidate), psnr(reference, candidate))
@@ -0,0 +1,91 @@
+from typing import List, NamedTuple, Optional, Tuple
+
+from scoring import Score
+
+
+class Candidate(NamedTuple):
+    n_bytes: int
+    subdir_name: str
+    suffix: str
+    # The worst of its sizes, see ImgConvertor.worst_score, if scored.
+    score: Optional[Score]
+
+
+class SelectionPolicy:
+    """
+    Chooses a variant unattended, in place of ImgConvertor.select_one.
+
+    The smallest candidate meeting every constraint given is chosen. With
+    prefer, the smallest of the preferred format meeting them, if any,
+    otherwise the next preferred and so on, before any other format.
+
+    Described by comma separated constraints, e.g. "min_ssim=0.98" or
+    "max_kb=40,prefer=webp/png".
+    """
+    KEYS = {"min_ssim": float, "min_psnr": float, "max_kb": int,
+            "prefer": lambda v: v.split("/")}
+
+    def __init__(self, min_ssim: float = None, min_psnr: float = None,
+                 max_kb: int = None, prefer: List[str] = None):
+        self.min_ssim = min_ssim
+        self.min_psnr = min_psnr
+        self.max_kb = max_kb
+        self.prefer = prefer or []
+
+    @classmethod
+    def parse(cls, spec: str) -> "SelectionPolicy":
+        kwargs = {}
+        for constraint in filter(None, spec.split(",")):
+            key, _, value = constraint.partition("=")
+            key = key.strip()
+            if key not in cls.KEYS or not value:
+                raise ValueError("Unknown auto-select constraint \"{}\", "
+                                 "expected one of {}.".format(
+                                     constraint, ", ".join(cls.KEYS)))
+            kwargs[key] = cls.KEYS[key](value.strip())
+        return cls(**kwargs)
+
+    def needs_scores(self) -> bool:
+        return self.min_ssim is not None or self.min_psnr is not None
+
+    def describe(self) -> str:
+        constraints = []
+        if self.min_ssim is not None:
+            constraints.append("SSIM >= {}".format(self.min_ssim))
+        if self.min_psnr is not None:
+            constraints.append("PSNR >= {}dB".format(self.min_psnr))
+        if self.max_kb is not None:
+            constraints.append("<= {}KB".format(self.max_kb))
+        return " and ".join(constraints) or "no constraints"
+
+    def accepts(self, candidate: Candidate) -> bool:
+        if self.max_kb is not None and \
+                candidate.n_bytes > self.max_kb * 1024:
+            return False
+        if self.needs_scores() and candidate.score is None:
+            return False
+        if self.min_ssim is not None and \
+                candidate.score.ssim < self.min_ssim:
+            return False
+        # A PSNR of None is lossless, which beats any minimum.
+        if self.min_psnr is not None and candidate.score.psnr is not None \
+                and candidate.score.psnr < self.min_psnr:
+            return False
+        return True
+
+    def choose(self, candidates: List[Candidate]) \
+            -> Tuple[Optional[Candidate], str]:
+        """
+        :return: the candidate chosen, None if none qualify, and why.
+        """
+        accepted = sorted(c for c in candidates if self.accepts(c))
+        reason = "{} of {} candidates met {}".format(
+            len(accepted), len(candidates), self.describe())
+        if not accepted:
+            return None, reason
+        for suffix in self.prefer:
+            preferred = [c for c in accepted if c.suffix == suffix]
+            if preferred:
+                return preferred[0], "{}; smallest {} chosen".format(
+                    reason, suffix)
+        return accepted[0], "{}; smallest chosen".format(reason)
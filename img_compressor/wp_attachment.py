@@ -0,0 +1,124 @@
+"""
+Makes a WordPress attachment of images sized here, rather than uploading the
+original through the REST API for WordPress to decode and resize again. The
+staged files are copied into the uploads dir, and the attachment and its
+_wp_attachment_metadata inserted, by one WP-CLI eval, as the web server's
+user, so that the server does no image processing at all.
+"""
+import json
+import shlex
+from typing import Dict, List, Tuple
+
+from paramiko import SSHClient
+
+from paramiko_client import execute_remotely
+
+MIME_TYPES = {"png": "image/png", "jpg": "image/jpeg", "webp": "image/webp",
+              "avif": "image/avif", "jxl": "image/jxl"}
+
+# As WordPress records of an image it found no metadata in, which it won't
+# in ours, -strip'd as they are.
+IMAGE_META = {
+    "aperture": "0", "credit": "", "camera": "", "caption": "",
+    "created_timestamp": "0", "copyright": "", "focal_length": "0",
+    "iso": "0", "shutter_speed": "0", "title": "", "orientation": "0",
+    "keywords": [],
+}
+
+# Reads $args, see insert_attachment. The file names are only settled here,
+# by wp_unique_filename, so each is given as what follows the stem, e.g.
+# "-300x200.png". Each staged file is copied rather than renamed, so that
+# it's owned by the web server's user, who can't remove it from the SSH
+# user's staging dir; the caller does.
+INSERT_PHP = r"""
+$up = wp_upload_dir();
+if ($up['error']) {
+    fwrite(STDERR, $up['error'] . "\n");
+    exit(1);
+}
+$name = wp_unique_filename($up['path'], $args['name']);
+$stem = pathinfo($name, PATHINFO_FILENAME);
+foreach ($args['files'] as [$staged, $decor]) {
+    if (!copy($staged, $up['path'] . '/' . $stem . $decor)) {
+        fwrite(STDERR, "failed to install " . $stem . $decor . "\n");
+        exit(1);
+    }
+}
+$meta = $args['metadata'];
+$meta['file'] = ltrim($up['subdir'] . '/' . $name, '/');
+foreach ($meta['sizes'] as $size => $info) {
+    $meta['sizes'][$size]['file'] = $stem . $info['file'];
+}
+$id = wp_insert_attachment(array(
+    'guid' => $up['url'] . '/' . $name,
+    'post_mime_type' => $args['mime_type'],
+    'post_title' => $stem,
+    'post_content' => '',
+    'post_status' => 'inherit',
+), $up['path'] . '/' . $name, 0, true);
+if (is_wp_error($id)) {
+    fwrite(STDERR, $id->get_error_message() . "\n");
+    exit(1);
+}
+wp_update_attachment_metadata($id, $meta);
+echo json_encode(array('id' => $id, 'file' => $meta['file'])) . "\n";
+"""
+
+
+def get_attachment_metadata(w: int, h: int, suffix: str, n_bytes: int,
+                            sizes: Dict[str, Tuple[int, int, int]]) -> dict:
+    """
+    :param w: of the full size image.
+    :param h: of the full size image.
+    :param n_bytes: of the full size image.
+    :param sizes: WordPress' name of each size -> its width, height and
+        bytes, see ImgScaler.get_named_sizes.
+    :return: _wp_attachment_metadata, but for the file names, which
+        insert_attachment completes.
+    """
+    return {
+        "width": w,
+        "height": h,
+        "filesize": n_bytes,
+        "sizes": {
+            name: {"file": "-{}x{}.{}".format(size_w, size_h, suffix),
+                   "width": size_w, "height": size_h,
+                   "mime-type": MIME_TYPES[suffix], "filesize": size_b}
+            for name, (size_w, size_h, size_b) in sizes.items()},
+        "image_meta": IMAGE_META,
+    }
+
+
+def php_string(value: str) -> str:
+    """:return: value as a single quoted PHP string literal."""
+    return "'{}'".format(value.replace("\\", "\\\\").replace("'", "\\'"))
+
+
+def insert_attachment(client: SSHClient, wp_path: str, name: str,
+                      suffix: str, files: List[Tuple[str, str]],
+                      metadata: dict, owner: str = "www-data") \
+        -> Tuple[int, str]:
+    """
+    :param wp_path: WordPress' root on the server, for WP-CLI's --path.
+    :param name: the full size image's, which WordPress may make unique.
+    :param files: (staged path, what follows the stem in its final name)
+        of the full size image, e.g. ".png", and every size, "-300x200.png".
+    :param metadata: as get_attachment_metadata makes.
+    :param owner: the web server's user, to run WP-CLI as.
+    :return: the attachment's id, and its file relative to the uploads dir,
+        as media_details["file"].
+    :raises RuntimeError: if WP-CLI fails, carrying its error output.
+    """
+    args = json.dumps({"name": name, "mime_type": MIME_TYPES[suffix],
+                       "files": files, "metadata": metadata})
+    php = "$args = json_decode({}, true);\n{}".format(
+        php_string(args), INSERT_PHP)
+    stdout, stderr = execute_remotely(
+        client, "sudo -u {} wp --path={} eval {}".format(
+            shlex.quote(owner), shlex.quote(wp_path), shlex.quote(php)))
+    try:
+        attachment = json.loads(stdout[-1])
+        return attachment["id"], attachment["file"]
+    except (IndexError, ValueError, KeyError):
+        raise RuntimeError("Inserting the attachment failed: {}".format(
+            "".join(stderr + stdout).strip()))
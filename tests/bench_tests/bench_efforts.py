@@ -0,0 +1,40 @@
+"""
+Every variant of the 24MP source at each effort: for each format, the KB of
+its variants, all sizes, and the seconds their commands took, so that what
+each effort saves in bytes shows beside what it costs in time.
+"""
+from pathlib import Path
+
+from compressor import EFFORTS, ImgConvertor, get_variants
+from scaler import ImgScaler
+
+
+def time_effort(img_name: str, subdir_root: str, effort: str, jobs: int):
+    """:return: by format, (bytes, seconds) of its variants in all."""
+    widths_and_heights, _ = ImgScaler(6000, 4000).get_widths_and_heights()
+    img_processor = ImgConvertor(img_name, widths_and_heights, subdir_root)
+    img_processor.transform_all(
+        get_variants(False, False, False, effort=effort), jobs)
+    totals = {}
+    for total_b, a_dir in img_processor.all_dirs:
+        suffix = Path(a_dir).name.split("_")[0]
+        b, s = totals.get(suffix, (0, 0.0))
+        totals[suffix] = (b + total_b, s + img_processor.encode_s[a_dir])
+    return totals
+
+
+def test_efforts(source_24mp, tmp_path):
+    jobs = 4
+    totals = {effort: time_effort(source_24mp, str(tmp_path / effort),
+                                  effort, jobs)
+              for effort in EFFORTS}
+    print("\n{} job(s)".format(jobs))
+    print("{:>10}".format("") + "".join(
+        "{:>10}{:>8}".format(effort + " KB", "s") for effort in EFFORTS))
+    for suffix in totals["max"]:
+        print("{:>10}".format(suffix) + "".join(
+            "{:>10.0f}{:>8.1f}".format(totals[effort][suffix][0] / 1024,
+                                       totals[effort][suffix][1])
+            for effort in EFFORTS))
+    # png's efforts are lossless, so max never makes more.
+    assert totals["max"]["png"][0] <= totals["fast"]["png"][0]
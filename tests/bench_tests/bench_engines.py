@@ -0,0 +1,41 @@
+"""
+Every variant of the 24MP source by each engine: seconds for them all, and
+the KB of each variant, so that any difference in what an engine makes of
+the same command shows beside its speed.
+"""
+import time
+from pathlib import Path
+
+from compressor import ImgConvertor, get_variants
+from engines import ENGINES
+from scaler import ImgScaler
+
+
+def time_engine(img_name: str, subdir_root: str, engine: str, jobs: int):
+    widths_and_heights, _ = ImgScaler(6000, 4000).get_widths_and_heights()
+    img_processor = ImgConvertor(img_name, widths_and_heights, subdir_root)
+    img_processor.use_engine(engine)
+    start = time.perf_counter()
+    img_processor.transform_all(get_variants(False, False, False, False), jobs)
+    img_processor.remove_decoded_source()
+    return time.perf_counter() - start, {
+        Path(a_dir).name: total_b for total_b, a_dir in img_processor.all_dirs}
+
+
+def test_engines(source_24mp, tmp_path):
+    for jobs in (1, 4):
+        seconds, kbs = {}, {}
+        for engine in ENGINES:
+            seconds[engine], kbs[engine] = time_engine(
+                source_24mp, str(tmp_path / engine / str(jobs)), engine, jobs)
+        print("\n{} job(s)".format(jobs))
+        print("{:>18}".format("") + "".join(
+            "{:>13}".format(engine) for engine in ENGINES))
+        print("{:>18}".format("seconds") + "".join(
+            "{:>13.1f}".format(seconds[engine]) for engine in ENGINES))
+        for variant in kbs["imagemagick"]:
+            print("{:>18}".format(variant) + "".join(
+                "{:>13.0f}".format(kbs[engine][variant] / 1024)
+                for engine in ENGINES))
+        assert all(kbs[engine].keys() == kbs["imagemagick"].keys()
+                   for engine in ENGINES)
@@ -0,0 +1,37 @@
+"""
+get_img_wxh by reading the header in process, against identify -ping, over
+the formats the compressor writes.
+"""
+import subprocess
+import time
+
+import common_funcs as cmn
+import img_header
+
+CALLS = 200
+
+
+def time_calls(get_wxh, img_name: str) -> float:
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        get_wxh(img_name)
+    return (time.perf_counter() - start) / CALLS
+
+
+def identify_wxh(img_name: str):
+    result_text = cmn.run_shell_cmd(
+        ['identify', '-ping', '-format', '"%wx%h"', img_name])
+    return list(map(int, result_text.strip("\"").split("x")))
+
+
+def test_img_header_against_identify(source_24mp, tmp_path):
+    print("\n{:>6} {:>10} {:>12}".format("format", "header us", "identify us"))
+    for suffix in ("png", "jpg", "webp"):
+        img_name = str(tmp_path / "src.{}".format(suffix))
+        subprocess.run(["convert", source_24mp, "-resize", "2048x2048",
+                        img_name], check=True)
+        assert list(img_header.read_wxh(img_name)) == identify_wxh(img_name)
+        header_s = time_calls(img_header.read_wxh, img_name)
+        identify_s = time_calls(identify_wxh, img_name)
+        print("{:>6} {:>10.0f} {:>12.0f}".format(
+            suffix, header_s * 1e6, identify_s * 1e6))
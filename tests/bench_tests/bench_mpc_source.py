@@ -0,0 +1,30 @@
+import time
+from pathlib import Path
+
+from compressor import ImgConvertor, get_variants
+from scaler import ImgScaler
+
+
+def time_transform_all(img_name: str, subdir_root: str, mpc_source: bool):
+    widths_and_heights, _ = ImgScaler(6000, 4000).get_widths_and_heights()
+    img_processor = ImgConvertor(img_name, widths_and_heights, subdir_root)
+    start = time.perf_counter()
+    if mpc_source:
+        img_processor.decode_source()
+    img_processor.transform_all(get_variants(False, False, False, False))
+    img_processor.remove_decoded_source()
+    return time.perf_counter() - start, img_processor
+
+
+def test_mpc_source_saving(source_24mp, tmp_path):
+    decoding_s, decoding = time_transform_all(
+        source_24mp, str(tmp_path / "decoding"), False)
+    mpc_s, mpc = time_transform_all(source_24mp, str(tmp_path / "mpc"), True)
+    print("\n{:>12} {:>8}".format("source", "seconds"))
+    print("{:>12} {:>8.1f}".format("png", decoding_s))
+    print("{:>12} {:>8.1f}".format("mpc", mpc_s))
+    print("{:>12} {:>7.0f}%".format("saving", 100 * (1 - mpc_s / decoding_s)))
+    assert not list(tmp_path.glob("mpc/*.mpc"))
+    assert not list(tmp_path.glob("mpc/*.cache"))
+    assert [Path(d).name for _, d in sorted(decoding.all_dirs)] == \
+           [Path(d).name for _, d in sorted(mpc.all_dirs)]
@@ -0,0 +1,55 @@
+"""
+replace_generated_sizes, by each transport and install, to the stand-in
+WordPress host over a link like a home uplink to a VPS.
+"""
+import os
+import random
+import time
+
+from compressor import ImgConvertor, Uploader, UploadOptions
+from stand_in import Link
+from paramiko_client import filter_dict_for_creds
+from scaler import ImgScaler
+
+LINK = Link(latency_ms=40, bandwidth_kbps=20000)
+
+OPTIONS = {
+    "sftp": UploadOptions(),
+    "sftp one trip": UploadOptions(one_trip=True),
+    "sftp x4": UploadOptions(one_trip=True, sftp_channels=4),
+    "tar": UploadOptions(transport="tar"),
+    "tar one trip": UploadOptions(transport="tar", one_trip=True),
+}
+
+
+def test_upload_path(stand_in_wordpress, tmp_path):
+    wordpress = stand_in_wordpress(LINK)
+    widths_and_heights, _ = ImgScaler(4000, 3000).get_widths_and_heights()
+    rng = random.Random(42)
+    print("\n{} sizes over {}ms, {}kbps".format(
+        len(widths_and_heights), LINK.latency_ms, LINK.bandwidth_kbps))
+    print("{:>14} {:>8}".format("options", "seconds"))
+    for i, (description, upload_options) in enumerate(OPTIONS.items()):
+        img_processor = ImgConvertor("photo.webp", widths_and_heights,
+                                     str(tmp_path / "tmp"))
+        img_processor.subdir_name = str(tmp_path / "tmp" / str(i))
+        os.makedirs(img_processor.subdir_name)
+        for w, h in widths_and_heights:
+            with open(img_processor.path_to_resized_img(w, h, "webp"), "wb") as f_out:
+                # About what webp makes of a photo at that size.
+                f_out.write(rng.randbytes(w * h // 20))
+        img_processor.upload_options = upload_options
+        rmt_file = wordpress.rest.add_media("photo.webp", b"full size")[
+            "media_details"]["file"]
+        uploader = Uploader(wordpress.conf_file)
+        try:
+            conf = uploader.get_ssh_conf()
+            client = uploader.get_client()
+            start = time.perf_counter()
+            img_processor.replace_generated_sizes(
+                *uploader.get_host_and_port(), filter_dict_for_creds(conf),
+                "webp", os.path.join(conf["wp_uploads"], rmt_file), client)
+            print("{:>14} {:>8.2f}".format(
+                description, time.perf_counter() - start))
+        finally:
+            uploader.close()
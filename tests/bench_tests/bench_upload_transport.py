@@ -0,0 +1,93 @@
+import os
+import random
+import time
+
+from paramiko_client import get_client, execute_remotely, put_tar, \
+    put_concurrently
+
+# Byte counts like one variant's sizes, smallest to full size.
+SIZES_B = [3000, 5000, 8000, 12000, 18000, 26000, 38000, 55000, 80000,
+           115000, 165000, 240000]
+
+
+def make_sizes(local_dir, n_variants: int, sizes_b=SIZES_B,
+               suffix: str = "webp"):
+    rng = random.Random(42)
+    files = []
+    for v in range(n_variants):
+        for n_bytes in sizes_b:
+            name = "img-v{}-{}.{}".format(v, n_bytes, suffix)
+            with open(os.path.join(local_dir, name), "wb") as f_out:
+                f_out.write(rng.randbytes(n_bytes))
+            files.append((os.path.join(local_dir, name), name))
+    return files
+
+
+def time_sftp(client, rmt_dir: str, files) -> float:
+    start = time.perf_counter()
+    execute_remotely(client, "mkdir -p {}".format(rmt_dir))
+    sftp = client.open_sftp()
+    for local_name, name in files:
+        sftp.put(local_name, "{}/{}".format(rmt_dir, name))
+    sftp.close()
+    return time.perf_counter() - start
+
+
+def time_tar(client, rmt_dir: str, files) -> float:
+    start = time.perf_counter()
+    put_tar(client, rmt_dir, files)
+    return time.perf_counter() - start
+
+
+def test_tar_vs_sftp(local_sshd, tmp_path):
+    local_dir = tmp_path / "local"
+    local_dir.mkdir()
+    files = make_sizes(str(local_dir), 4)
+    client = get_client(*local_sshd)
+    try:
+        sftp_s = time_sftp(client, str(tmp_path / "sftp"), files)
+        tar_s = time_tar(client, str(tmp_path / "tar"), files)
+    finally:
+        client.close()
+    total_kb = sum(os.path.getsize(local_name) for local_name, _ in files) / 1024
+    print("\n{} files, {:.0f}KB".format(len(files), total_kb))
+    print("{:>10} {:>8}".format("transport", "seconds"))
+    print("{:>10} {:>8.3f}".format("sftp", sftp_s))
+    print("{:>10} {:>8.3f}".format("tar", tar_s))
+    print("{:>10} {:>7.0f}%".format("saving", 100 * (1 - tar_s / sftp_s)))
+    for local_name, name in files:
+        with open(local_name, "rb") as f_in:
+            expected = f_in.read()
+        for transport in ("sftp", "tar"):
+            assert (tmp_path / transport / name).read_bytes() == expected
+
+
+def test_concurrent_sftp(local_sshd, tmp_path):
+    """Large PNGs, as of 2048px, put one at a time then several at once."""
+    local_dir = tmp_path / "local"
+    local_dir.mkdir()
+    files = make_sizes(str(local_dir), 8, [3 * 1024 * 1024], "png")
+    client = get_client(*local_sshd)
+    try:
+        sequential_s = time_sftp(client, str(tmp_path / "sequential"), files)
+        execute_remotely(client, "mkdir -p {}".format(tmp_path / "concurrent"))
+        start = time.perf_counter()
+        transfers = put_concurrently(client, [
+            (local_name, str(tmp_path / "concurrent" / name))
+            for local_name, name in files],
+            channels=4, window_size=8 * 1024 * 1024,
+            max_packet_size=32 * 1024)
+        concurrent_s = time.perf_counter() - start
+    finally:
+        client.close()
+    print()
+    for transfer in transfers:
+        print(transfer.describe())
+    print("{:>10} {:>8}".format("puts", "seconds"))
+    print("{:>10} {:>8.3f}".format("one", sequential_s))
+    print("{:>10} {:>8.3f}".format("four", concurrent_s))
+    print("{:>10} {:>7.0f}%".format("saving",
+                                    100 * (1 - concurrent_s / sequential_s)))
+    for local_name, name in files:
+        assert (tmp_path / "concurrent" / name).read_bytes() == \
+               (tmp_path / "sequential" / name).read_bytes()
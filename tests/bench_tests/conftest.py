@@ -0,0 +1,19 @@
+"""
+Benchmarks are named bench_*.py so that a plain pytest run skips them. Run
+one explicitly, from tests/, with its output showing:
+
+PYTHONPATH=../img_compressor pytest -s bench_tests/bench_mpc_source.py
+"""
+import subprocess
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def source_24mp(tmp_path_factory) -> str:
+    """A 6000x4000 photo-like png, made by ImageMagick's plasma generator."""
+    img_name = str(tmp_path_factory.mktemp("bench") / "plasma_6000x4000.png")
+    subprocess.run(["convert", "-seed", "42", "-size", "6000x4000",
+                    "plasma:", img_name], check=True)
+    return img_name
+
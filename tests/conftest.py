@@ -0,0 +1,61 @@
+"""
+Fixtures starting the stand-in WordPress host of stand_in.py.
+"""
+import json
+import stat
+
+import paramiko
+import pytest
+
+from stand_in import SHIMS, FakeWordPress, Link, StandInSSHD, \
+    StandInWordPress
+
+
+@pytest.fixture(scope="session")
+def stand_in_host_key() -> paramiko.PKey:
+    return paramiko.RSAKey.generate(2048)
+
+
+@pytest.fixture
+def stand_in_wordpress(tmp_path, stand_in_host_key):
+    """
+    :return: a function starting a StandInWordPress, given a Link and how
+        long the REST upload is to take regenerating. Each is stopped after
+        the test.
+    """
+    shim_dir = tmp_path / "shims"
+    shim_dir.mkdir()
+    for name, script in SHIMS.items():
+        (shim_dir / name).write_text(script)
+        (shim_dir / name).chmod(stat.S_IRWXU)
+    started = []
+
+    def start(link: Link = Link(), regenerate_ms: float = 0) \
+            -> StandInWordPress:
+        root = tmp_path / "wp{}".format(len(started))
+        uploads_dir = root / "wp-content" / "uploads"
+        uploads_dir.mkdir(parents=True)
+        sshd = StandInSSHD(stand_in_host_key, str(shim_dir), link)
+        rest = FakeWordPress(str(uploads_dir), link, regenerate_ms)
+        started.append((sshd, rest))
+        host, port, credentials = sshd.get_host_port_and_credentials()
+        conf_file = str(root / "config.json")
+        with open(conf_file, "w") as f_out:
+            json.dump({
+                "api": {"host_url": rest.get_url(), "user": "stand-in",
+                        "password": "stand-in"},
+                "ssh": {"host": "{}:{}".format(host, port),
+                        "wp_uploads": str(uploads_dir) + "/",
+                        **credentials}}, f_out, indent=2)
+        return StandInWordPress(sshd, rest, conf_file, str(uploads_dir))
+
+    yield start
+    for sshd, rest in started:
+        sshd.close()
+        rest.close()
+
+
+@pytest.fixture
+def local_sshd(stand_in_wordpress):
+    """:return: host, port and credentials of a StandInSSHD."""
+    return stand_in_wordpress().sshd.get_host_port_and_credentials()
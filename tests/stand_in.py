@@ -0,0 +1,337 @@
+"""
+Stand-ins for the WordPress host, so that the upload path can be tested and
+benchmarked offline, rather than against the VM of test_details.md: a fake
+of the /wp/v2/media endpoint WP_API posts to, and an SSH server running
+commands and SFTP locally. Both sit behind a Link of given latency and
+bandwidth.
+"""
+import email.parser
+import email.policy
+import json
+import os
+import queue
+import socket
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple, Optional
+
+import paramiko
+
+# On the stand-in's PATH, ahead of the real commands: sudo runs its command
+# as is, -u and all, as the current user, and chown does nothing, ownership
+# being the one thing it can't stand in for.
+SHIMS = {
+    "sudo": '#!/bin/sh\nwhile [ "${1#-}" != "$1" ]; do\n'
+            '    [ "$1" = "-u" ] && shift\n    shift\ndone\nexec "$@"\n',
+    "chown": "#!/bin/sh\nexit 0\n",
+    # There being no PHP, WP-CLI's eval of wp_attachment.INSERT_PHP: each
+    # staged file is installed, as it does, and the attachment printed.
+    # Names aren't made unique.
+    "wp": r"""#!/usr/bin/env python3
+import json, os, re, shutil, sys, time
+path = next(arg[len("--path="):] for arg in sys.argv if arg.startswith("--path="))
+php = sys.argv[sys.argv.index("eval") + 1]
+literal = php.split("\n")[0][len("$args = json_decode('"):-len("', true);")]
+args = json.loads(re.sub(r"\\(.)", r"\1", literal))
+subdir = time.strftime("%Y/%m")
+up = os.path.join(path, "wp-content", "uploads", subdir)
+os.makedirs(up, exist_ok=True)
+stem = args["name"].rpartition(".")[0]
+for staged, decor in args["files"]:
+    shutil.copyfile(staged, os.path.join(up, stem + decor))
+print(json.dumps({"id": 1, "file": subdir + "/" + args["name"]}))
+""",
+}
+
+
+class Link(NamedTuple):
+    """The network between us and the stand-in host."""
+    # Added to each response, so to each round trip.
+    latency_ms: float = 0
+    # Of what's sent to the host, None for as fast as loopback goes.
+    bandwidth_kbps: Optional[float] = None
+
+    def delay(self) -> None:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    def carry(self, n_bytes: int) -> None:
+        if self.bandwidth_kbps:
+            time.sleep(n_bytes * 8 / 1000 / self.bandwidth_kbps)
+
+
+class LinkedSocket:
+    """
+    The host's end of a connection, as slow as its link. What it sends is
+    held back for the latency, but in flight, so many packets at once, as
+    on a real link.
+    """
+    def __init__(self, conn: socket.socket, link: Link):
+        self.conn = conn
+        self.link = link
+        self.in_flight = queue.Queue()
+        if link.latency_ms:
+            threading.Thread(target=self.deliver, daemon=True).start()
+
+    def deliver(self) -> None:
+        while True:
+            due, data = self.in_flight.get()
+            if data is None:
+                return
+            time.sleep(max(0.0, due - time.monotonic()))
+            try:
+                self.conn.sendall(data)
+            except OSError:
+                return
+
+    def recv(self, n: int) -> bytes:
+        data = self.conn.recv(n)
+        self.link.carry(len(data))
+        return data
+
+    def send(self, data: bytes) -> int:
+        if not self.link.latency_ms:
+            return self.conn.send(data)
+        self.in_flight.put(
+            (time.monotonic() + self.link.latency_ms / 1000, bytes(data)))
+        return len(data)
+
+    def close(self) -> None:
+        self.in_flight.put((0, None))
+        self.conn.close()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+class StandInSFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(
+            self.readfile.fileno()))
+
+
+class StandInSFTP(paramiko.SFTPServerInterface):
+    """Just enough of an SFTP server, on the local filesystem, to put."""
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(path, flags, 0o644)
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+        mode = "r+b" if flags & os.O_RDWR else "wb" if flags & os.O_WRONLY \
+            else "rb"
+        handle = StandInSFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(path))
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+
+    lstat = stat
+
+
+def run_command(channel: paramiko.Channel, command: bytes,
+                shim_dir: str) -> None:
+    """Runs an exec request locally, piping stdin, stdout and stderr."""
+    env = dict(os.environ, PATH="{}:{}".format(shim_dir, os.environ["PATH"]))
+    proc = subprocess.Popen(command.decode(), shell=True, env=env,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+
+    def pump_stdin():
+        try:
+            while data := channel.recv(32768):
+                proc.stdin.write(data)
+            proc.stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass
+
+    def pump_stderr():
+        while data := proc.stderr.read1(32768):
+            channel.sendall_stderr(data)
+
+    # As sshd, a command needn't read its stdin to finish, so that isn't
+    # waited for.
+    threading.Thread(target=pump_stdin, daemon=True).start()
+    stderr_pump = threading.Thread(target=pump_stderr)
+    stderr_pump.start()
+    while data := proc.stdout.read1(32768):
+        channel.sendall(data)
+    stderr_pump.join()
+    try:
+        channel.send_exit_status(proc.wait())
+        channel.close()
+    except EOFError:
+        # The client didn't wait for the exit status.
+        pass
+
+
+class StandInServer(paramiko.ServerInterface):
+    def __init__(self, shim_dir: str):
+        self.shim_dir = shim_dir
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=run_command,
+                         args=(channel, command, self.shim_dir),
+                         daemon=True).start()
+        return True
+
+
+class StandInSSHD:
+    """
+    An SSH server on localhost, running commands and SFTP as the current
+    user, see SHIMS. Any password will do.
+    """
+    def __init__(self, host_key: paramiko.PKey, shim_dir: str,
+                 link: Link = Link()):
+        self.host_key = host_key
+        self.shim_dir = shim_dir
+        self.link = link
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen()
+        self.transports = []
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self) -> None:
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(LinkedSocket(conn, self.link))
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler(
+                "sftp", paramiko.SFTPServer, StandInSFTP)
+            transport.start_server(server=StandInServer(self.shim_dir))
+            self.transports.append(transport)
+
+    def get_host_port_and_credentials(self):
+        """:return: as get_client takes them."""
+        return "127.0.0.1", self.listener.getsockname()[1], {
+            "username": "stand-in", "password": "stand-in"}
+
+    def close(self) -> None:
+        self.listener.close()
+        for transport in self.transports:
+            transport.close()
+
+
+class FakeMediaHandler(BaseHTTPRequestHandler):
+    """
+    Takes POSTs to .../wp/v2/media, raw with a Content-Disposition or as
+    multipart/form-data, into uploads/YYYY/MM as WordPress would, and answers
+    as WordPress does, as far as the id and media_details.
+    """
+    server: "FakeWordPress"
+
+    def do_POST(self):
+        if not self.path.split("?")[0].rstrip("/").endswith("/wp/v2/media") \
+                and "rest_route=/wp/v2/media" not in self.path:
+            self.send_error(404)
+            return
+        length = int(self.headers["Content-Length"])
+        body = b""
+        while len(body) < length:
+            chunk = self.rfile.read(min(65536, length - len(body)))
+            if not chunk:
+                break
+            self.server.link.carry(len(chunk))
+            body += chunk
+        name, content = self.parse_upload(body)
+        time.sleep(self.server.regenerate_ms / 1000)
+        self.send_json(201, self.server.add_media(name, content))
+
+    def parse_upload(self, body: bytes):
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/"):
+            message = email.parser.BytesParser(
+                policy=email.policy.HTTP).parsebytes(
+                "Content-Type: {}\r\n\r\n".format(content_type).encode() +
+                body)
+            part = next(part for part in message.iter_parts()
+                        if part.get_filename())
+            return part.get_filename(), part.get_payload(decode=True)
+        message = email.parser.Parser().parsestr(
+            "Content-Disposition: {}\n\n".format(
+                self.headers.get("Content-Disposition", "")))
+        return message.get_filename() or "upload", body
+
+    def send_json(self, status: int, content) -> None:
+        encoded = json.dumps(content).encode()
+        self.server.link.delay()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeWordPress(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, uploads_dir: str, link: Link = Link(),
+                 regenerate_ms: float = 0):
+        """
+        :param regenerate_ms: how long to take, once an upload is received,
+            standing in for WordPress making its sizes.
+        """
+        super().__init__(("127.0.0.1", 0), FakeMediaHandler)
+        self.uploads_dir = uploads_dir
+        self.link = link
+        self.regenerate_ms = regenerate_ms
+        self.media = []
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def add_media(self, name: str, content: bytes) -> dict:
+        subdir = time.strftime("%Y/%m")
+        os.makedirs(os.path.join(self.uploads_dir, subdir), exist_ok=True)
+        with self.lock:
+            stem, dot, suffix = name.rpartition(".")
+            unique, n = name, 1
+            while os.path.exists(os.path.join(self.uploads_dir, subdir, unique)):
+                unique = "{}-{}{}{}".format(stem, n, dot, suffix)
+                n += 1
+            with open(os.path.join(self.uploads_dir, subdir, unique), "wb") \
+                    as f_out:
+                f_out.write(content)
+            media = {"id": len(self.media) + 1,
+                     "media_details": {"file": "{}/{}".format(subdir, unique),
+                                       "filesize": len(content), "sizes": {}}}
+            self.media.append(media)
+        return media
+
+    def get_url(self) -> str:
+        return "http://127.0.0.1:{}".format(self.server_address[1])
+
+    def close(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class StandInWordPress(NamedTuple):
+    sshd: StandInSSHD
+    rest: FakeWordPress
+    # Naming both, as Uploader and WP_API read it.
+    conf_file: str
+    uploads_dir: str
@@ -0,0 +1,193 @@
+from pathlib import Path
+from unittest.mock import patch, sentinel, Mock, MagicMock, call
+
+import pytest
+
+from batch import BatchImage, find_images, get_subdir_roots, generate_all, \
+    choose_and_upload, compress_batch, process_args
+from compressor import CompressorException, Variant
+
+
+@pytest.fixture(autouse=True)
+def no_next_gen_delegates():
+    """As if ImageMagick could write neither avif nor jxl, unless patched."""
+    with patch("common_funcs.get_imagemagick_formats", return_value={}):
+        yield
+
+
+def touch_images(root: Path, names):
+    for name in names:
+        (root / name).write_bytes(b"x")
+
+
+def test_find_images(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Path("post").mkdir()
+    touch_images(tmp_path / "post", ["b.jpg", "a.png", "notes.txt"])
+    touch_images(tmp_path, ["c.webp", "d.webp"])
+    Path("list.txt").write_text("d.webp\n\npost/b.jpg\n")
+    assert find_images(["post", "*.webp", "@list.txt", "post/a.png"]) == [
+        "post/a.png", "post/b.jpg", "c.webp", "d.webp"]
+    with pytest.raises(FileNotFoundError):
+        find_images(["e.webp"])
+
+
+def test_get_subdir_roots():
+    assert get_subdir_roots(["a/x.jpg", "b/x.png", "y.png", "c/x.webp"]) == [
+        "tmp/x/", "tmp/x-2/", "tmp/y/", "tmp/x-3/"]
+
+
+def write_output(split_cmd):
+    Path(split_cmd[-1]).write_bytes(b"x" * 10)
+
+
+@patch("batch.cmn.get_img_wxh", autospec=True, return_value=[640, 480])
+@patch("batch.ImgScaler", autospec=True)
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True,
+       side_effect=write_output)
+def test_generate_all(mock_run_shell, mock_scaler, mock_get_wxh, tmp_path,
+                      monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    mock_scaler.return_value.get_widths_and_heights.return_value = (
+        [(64, 48)], sentinel.thumbnail)
+    images = [BatchImage("a.png", "tmp/a/"), BatchImage("b.png", "tmp/b/")]
+    variants = [Variant(5, "webp", "x", "do {q} {src_img} {dest_img}",
+                        ["do {q} {w} {src_img} {resized_img}"])]
+    generate_all(images, variants, jobs=2)
+    assert mock_run_shell.call_count == 4
+    assert images[0].processor.all_dirs == [(20, "tmp/a/webp_q5_x")]
+    assert images[1].processor.all_dirs == [(20, "tmp/b/webp_q5_x")]
+    assert Path("tmp/b/webp_q5_x/b-64x48.webp").exists()
+    assert images[0].generated_in > 0
+
+
+@patch("batch.cmn.get_img_wxh", autospec=True, return_value=[640, 480])
+@patch("batch.ImgScaler", autospec=True)
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True,
+       side_effect=write_output)
+def test_generate_all_releases_each_source(mock_run_shell, mock_scaler,
+                                           mock_get_wxh, tmp_path,
+                                           monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    mock_scaler.return_value.get_widths_and_heights.return_value = (
+        [(64, 48)], sentinel.thumbnail)
+    images = [BatchImage("a.png", "tmp/a/"), BatchImage("b.png", "tmp/b/")]
+    events = []
+    mock_run_shell.side_effect = lambda split_cmd: events.append(
+        Path(split_cmd[-1]).parts[1])
+    for image in images:
+        image.processor.remove_decoded_source = Mock(
+            side_effect=lambda name=image.img_name: events.append(
+                "release " + name))
+    variants = [Variant(5, "webp", "x", "do {q} {src_img} {dest_img}",
+                        ["do {q} {w} {src_img} {resized_img}"])]
+    generate_all(images, variants)
+    # a's source is dropped as soon as a's commands are done, before b's.
+    assert events == ["a", "a", "release a.png", "b", "b", "release b.png"]
+
+
+@patch("batch.shutil.rmtree", autospec=True)
+def test_choose_and_upload(mock_rmtree):
+    image = Mock()
+    choose_and_upload(image, sentinel.variants, sentinel.conf_file,
+                      sentinel.uploader, sentinel.policy)
+    assert image.chosen_dir == image.processor.auto_select.return_value
+    image.processor.select_one.assert_not_called()
+    image.processor.upload.assert_called_once_with(
+        image.chosen_dir, sentinel.conf_file, sentinel.uploader)
+    mock_rmtree.assert_called_once_with(image.processor.subdir_root)
+    image.processor.upload.side_effect = RuntimeError
+    with pytest.raises(RuntimeError):
+        choose_and_upload(image, sentinel.variants, sentinel.conf_file,
+                          sentinel.uploader, lazy=True)
+    image.processor.complete_variant.assert_called_once_with(
+        image.processor.select_one.return_value, sentinel.variants,
+        image.widths_and_heights, 1)
+    image.processor.delete_other_dirs.assert_called_once_with(
+        image.processor.select_one.return_value)
+    image.processor.reencode_variant.assert_not_called()
+
+
+@patch("batch.shutil.rmtree", autospec=True)
+def test_choose_and_upload_effort(mock_rmtree):
+    image = Mock()
+    choose_and_upload(image, sentinel.variants, sentinel.conf_file,
+                      sentinel.uploader, lazy=True, jobs=2,
+                      final_variants=sentinel.final_variants)
+    chosen = image.processor.select_one.return_value
+    image.processor.reencode_variant.assert_called_once_with(
+        chosen, sentinel.final_variants, 2)
+    image.processor.complete_variant.assert_called_once_with(
+        chosen, sentinel.final_variants, image.widths_and_heights, 2)
+
+
+@patch("batch.Uploader", autospec=True)
+@patch("batch.choose_and_upload", autospec=True)
+@patch("batch.write_batch_manifest", autospec=True)
+@patch("batch.present_batch_gallery", autospec=True)
+@patch("batch.generate_all", autospec=True, return_value=1.5)
+@patch("batch.BatchImage", autospec=True)
+def test_compress_batch(mock_image, mock_generate_all, mock_gallery,
+                        mock_manifest, mock_choose, mock_uploader):
+    images = [MagicMock(img_name=name, error=None, generated_in=1.0)
+              for name in ["a", "b"]]
+    mock_image.side_effect = images
+    mock_choose.side_effect = [RuntimeError("no route"), None]
+    with pytest.raises(CompressorException) as cerr:
+        compress_batch(["a.png", "b.png"], jobs=4, auto_select="min_ssim=0.9")
+    assert "1 of 2 images failed: a" in str(cerr)
+    mock_image.assert_has_calls([call("a.png", "tmp/a/"), call("b.png", "tmp/b/")])
+    assert mock_generate_all.call_args.args[2:] == (4, False, False)
+    for image in images:
+        image.processor.use_scorer.assert_called_once_with()
+        image.processor.score_all.assert_called_once_with(4)
+    assert mock_choose.call_count == 2
+    assert mock_choose.call_args.args[3] == mock_uploader.return_value
+    assert str(images[0].error) == "no route"
+    assert images[1].error is None
+
+
+@patch("batch.Uploader", autospec=True)
+@patch("batch.choose_and_upload", autospec=True)
+@patch("batch.write_batch_manifest", autospec=True)
+@patch("batch.present_batch_gallery", autospec=True)
+@patch("batch.generate_all", autospec=True, return_value=1.5)
+@patch("batch.BatchImage", autospec=True)
+@patch("batch.get_variants", autospec=True, return_value=[])
+def test_compress_batch_jxl_only_prescaled(mock_get_variants, mock_image,
+                                           mock_generate_all, mock_gallery,
+                                           mock_manifest, mock_choose,
+                                           mock_uploader):
+    mock_image.return_value = MagicMock(error=None, generated_in=1.0)
+    with patch("common_funcs.get_imagemagick_formats",
+               return_value={"jxl": "rw-"}):
+        compress_batch(["a.png"], skip_jxl=False)
+        assert mock_get_variants.call_args.args[7] is True
+        compress_batch(["a.png"], skip_jxl=False, prescaled=True)
+        assert mock_get_variants.call_args.args[7] is False
+
+
+@patch("scoring.np", None)
+@patch("batch.generate_all", autospec=True)
+@patch("batch.BatchImage", autospec=True)
+def test_compress_batch_score_needs_numpy(mock_image, mock_generate_all):
+    with pytest.raises(CompressorException) as cerr:
+        compress_batch(["a.png"], score=True)
+    assert "pip install numpy" in str(cerr)
+    mock_image.assert_not_called()
+
+
+@patch("batch.compress_batch", autospec=True)
+@patch("batch.find_images", autospec=True)
+def test_process_args(mock_find_images, mock_compress_batch):
+    process_args(["dir", "*.png", "-p", "--jobs", "8", "--score"])
+    mock_find_images.assert_called_once_with(["dir", "*.png"])
+    mock_compress_batch.assert_called_once_with(
+        mock_find_images.return_value, "config.json", False, True, False,
+        False, jobs=8, pipeline=False, share_resizes=False,
+        resize_cache_mb=512, lazy=False, score=True, auto_select=None,
+        cache_dir=None, cache_mb=1024, resume=False, one_trip=False,
+        transport="sftp", sftp_channels=1, sftp_window_kb=None,
+        sftp_packet_kb=None, delta=False, overlap=False, prescaled=False,
+        engine="imagemagick", encoders=False, skip_avif=True,
+        skip_jxl=True, effort=None)
@@ -0,0 +1,42 @@
+import json
+
+from checkpoint import Checkpoint
+
+
+def test_save_and_load(tmp_path):
+    checkpoint_file = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(checkpoint_file, "src", "plan")
+    assert not checkpoint.load()
+    (tmp_path / "png_q5_a").mkdir()
+    checkpoint.variant_done(str(tmp_path / "png_q5_a"), 123)
+    checkpoint.variant_done(str(tmp_path / "gone"), 456)
+    checkpoint.chose(str(tmp_path / "png_q5_a"))
+    checkpoint.reencoded(str(tmp_path / "png_q5_a"))
+    checkpoint.media_uploaded({"id": 42, "media_details": {"file": "2022/07/a.png"}})
+    checkpoint.replaced("/up/2022/07/a-300x200.png")
+    resumed = Checkpoint(checkpoint_file, "src", "plan")
+    assert resumed.load()
+    assert resumed.state == json.loads(json.dumps(checkpoint.state))
+    assert resumed.variant_bytes(str(tmp_path / "png_q5_a")) == 123
+    assert resumed.variant_bytes(str(tmp_path / "gone")) is None
+    assert resumed.get_choice() == str(tmp_path / "png_q5_a")
+    assert resumed.state["media"]["id"] == 42
+    assert resumed.state["reencoded"] == str(tmp_path / "png_q5_a")
+
+
+def test_load_other_source_or_plan(tmp_path):
+    checkpoint_file = str(tmp_path / "checkpoint.json")
+    Checkpoint(checkpoint_file, "src", "plan").chose("somewhere")
+    assert not Checkpoint(checkpoint_file, "other src", "plan").load()
+    other_plan = Checkpoint(checkpoint_file, "src", "other plan")
+    assert not other_plan.load()
+    assert other_plan.state["chosen_dir"] is None
+    (tmp_path / "checkpoint.json").write_text("{trunc")
+    assert not Checkpoint(checkpoint_file, "src", "plan").load()
+
+
+def test_get_choice_gone(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"), "src", "plan")
+    checkpoint.variant_done(str(tmp_path / "gone"), 456)
+    checkpoint.chose(str(tmp_path / "gone"))
+    assert checkpoint.get_choice() is None
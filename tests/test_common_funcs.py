@@ -3,7 +3,9 @@ from unittest.mock import patch, sentinel, Mock, mock_open, call
 import pytest
 
 from common_funcs import run_shell_cmd, get_file_size, get_img_wxh, \
-    get_name_decor, split_fstring_not_args
+    get_name_decor, split_fstring_not_args, run_shell_cmd_or_raise, \
+    pipeline_convert_cmds, get_psnr, get_file_sha256, get_imagemagick_version, \
+    split_redirects, get_imagemagick_formats
 
 
 def test_run_shell_cmd():
@@ -11,19 +13,98 @@ def test_run_shell_cmd():
     assert result_text.strip() == '694 white_100x100.png'
 
 
+def test_run_shell_cmd_or_raise():
+    result_text = run_shell_cmd_or_raise(['stat', '-c' '%s %n', "white_100x100.png"])
+    assert result_text.strip() == '694 white_100x100.png'
+    with pytest.raises(RuntimeError) as rterr:
+        run_shell_cmd_or_raise(['stat', "not_a_white_100x100.png"])
+    assert "not_a_white_100x100.png" in str(rterr)
+
+
+def test_split_redirects():
+    assert split_redirects(["tr", "a", "b", "<", "in", ">", "out"]) == \
+           (["tr", "a", "b"], "in", "out")
+    assert split_redirects(["cjpeg", ">", "out"]) == (["cjpeg"], None, "out")
+    assert split_redirects(["stat", "in"]) == (["stat", "in"], None, None)
+
+
+def test_run_shell_cmd_redirected(tmp_path):
+    in_name, out_name = str(tmp_path / "in"), str(tmp_path / "out")
+    with open(in_name, "w") as f_out:
+        f_out.write("abc")
+    assert run_shell_cmd(["tr", "a", "b", "<", in_name, ">", out_name]) == ""
+    with open(out_name) as f_in:
+        assert f_in.read() == "bbc"
+    with pytest.raises(RuntimeError):
+        run_shell_cmd_or_raise(["tr", "<", in_name, ">", out_name])
+
+
 def test_get_file_size():
     result_text = get_file_size("white_100x100.png")
     assert result_text == "694"
 
 
+def test_get_file_sha256(tmp_path):
+    (tmp_path / "abc").write_bytes(b"abc")
+    assert get_file_sha256(str(tmp_path / "abc")) == \
+           "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad"
+
+
+@patch("common_funcs.run_shell_cmd_or_raise", autospec=True,
+       return_value="Version: ImageMagick 6.9.11-60 Q16 x86_64\nCopyright: ...\n")
+def test_get_imagemagick_version(mock_run_shell):
+    assert get_imagemagick_version() == "Version: ImageMagick 6.9.11-60 Q16 x86_64"
+    mock_run_shell.assert_called_once_with(["convert", "-version"])
+
+
+@patch("common_funcs.run_shell_cmd_or_raise", autospec=True, return_value="""
+   Format  Module    Mode  Description
+-------------------------------------------------------------------------------
+      AVI* MPEG      r--   Microsoft Audio/Visual Interleaved
+     AVIF  HEIC      rw+   AV1 Image File Format (1.12.0)
+      JXL* JXL       r--   JPEG XL (ISO/IEC 18181)
+     WEBP* WEBP      rw-   WebP Image Format (libwebp 1.2.4)
+
+* native blob support
+""")
+def test_get_imagemagick_formats(mock_run_shell):
+    assert get_imagemagick_formats() == {
+        "avi": "r--", "avif": "rw+", "jxl": "r--", "webp": "rw-"}
+    mock_run_shell.assert_called_once_with(["convert", "-list", "format"])
+
+
 def test_get_img_wxh():
     wxh = get_img_wxh("white_100x100.png")
     assert wxh == [100, 100]
 
 
+@patch("common_funcs.run_shell_cmd", autospec=True, return_value='"640x480"')
+@patch("common_funcs.img_header.read_wxh", autospec=True, return_value=None)
+def test_get_img_wxh_by_identify(mock_read_wxh, mock_run_shell):
+    assert get_img_wxh("img.gif") == [640, 480]
+    mock_read_wxh.assert_called_once_with("img.gif")
+    mock_run_shell.assert_called_once_with(
+        ['identify', '-ping', '-format', '"%wx%h"', "img.gif"])
+
+
+@patch("common_funcs.subprocess.run", autospec=True)
+def test_get_psnr(mock_run):
+    mock_run.return_value = Mock(returncode=1, stderr=b"37.2411")
+    assert get_psnr("a.png", "b.png") == pytest.approx(37.2411)
+    mock_run.assert_called_once_with(
+        ['compare', '-metric', 'PSNR', "a.png", "b.png", 'null:'],
+        capture_output=True)
+    mock_run.return_value = Mock(returncode=0, stderr=b"inf")
+    assert get_psnr("a.png", "a.png") == float("inf")
+    mock_run.return_value = Mock(returncode=2, stderr=b"image widths differ")
+    with pytest.raises(RuntimeError):
+        get_psnr("a.png", "c.png")
+
+
 def test_get_name_decor():
     decor = get_name_decor(640, 480, "xzmp")
     assert decor == "-640x480.xzmp"
+    assert get_name_decor(300, 200, "jxl") == "-300x200.jxl"
 
 
 def test_split_fstring_not_args():
@@ -41,3 +122,35 @@ def test_split_fstring_not_args():
 
 
 
+
+
+def test_pipeline_convert_cmds():
+    results = pipeline_convert_cmds([
+        ["convert", "-strip", "-colors", "64", "src.png", "out.png"],
+        ["convert", "-resize", "4x3", "src.png", "tmp.png"],
+        ["convert", "-colors", "64", "tmp.png", "out-4x3.png"],
+    ])
+    assert results == [
+        "convert", "-respect-parentheses", "src.png", "-write", "mpr:src",
+        "+delete",
+        "(", "mpr:src", "-strip", "-colors", "64", "-write", "out.png",
+        "+delete", ")",
+        "(", "mpr:src", "-resize", "4x3", "-write", "mpr:tmp1", "+delete", ")",
+        "(", "mpr:tmp1", "-colors", "64", "-write", "out-4x3.png", ")",
+        "null:"]
+
+
+def test_pipeline_convert_cmds_reads_other_inputs():
+    results = pipeline_convert_cmds([
+        ["convert", "src.png", "out.png"], ["convert", "other.mpc", "o2.png"]])
+    assert results[-6:] == [
+        "(", "other.mpc", "-write", "o2.png", ")", "null:"]
+
+
+@pytest.mark.parametrize("split_cmds", [
+    [["cwebp", "src.png", "-o", "out.webp"]],
+    [["convert", "src.png", "out.png"], ["convert", "out.png"]],
+])
+def test_pipeline_convert_cmds_refuses(split_cmds):
+    with pytest.raises(ValueError):
+        pipeline_convert_cmds(split_cmds)
@@ -3,7 +3,17 @@ from unittest.mock import patch, sentinel, Mock, mock_open, call
 import pytest
 import requests
 
-from compressor import resize, process_args, process_outputs
+from compressor import resize, process_args, process_outputs, get_variants, \
+    share_resize, get_variant_families, get_suffixes, CompressorException, \
+    Uploader, get_encoder_variants, get_format_variants, get_unwritable, \
+    at_effort, effort_cmd, crop_to_fill
+
+
+@pytest.fixture(autouse=True)
+def no_next_gen_delegates():
+    """As if ImageMagick could write neither avif nor jxl, unless patched."""
+    with patch("common_funcs.get_imagemagick_formats", return_value={}):
+        yield
 
 
 @patch("compressor.resize", autospec=True)
@@ -16,7 +26,38 @@ def test_parse_args(mock_resize):
         False,
         False,
         False,
-        False
+        False,
+        jobs=1,
+        pipeline=False,
+        mpc_source=False,
+        share_resizes=False,
+        resize_cache_mb=512,
+        pyramid=False,
+        pyramid_min_psnr=None,
+        dedupe=False,
+        plan_only=False,
+        lazy=False,
+        search=False,
+        target_kb=None,
+        min_psnr=None,
+        score=False,
+        auto_select=None,
+        cache_dir=None,
+        cache_mb=1024,
+        resume=False,
+        one_trip=False,
+        transport="sftp",
+        sftp_channels=1,
+        sftp_window_kb=None,
+        sftp_packet_kb=None,
+        delta=False,
+        overlap=False,
+        prescaled=False,
+        engine="imagemagick",
+        encoders=False,
+        skip_avif=True,
+        skip_jxl=True,
+        effort=None
     )
 
 
@@ -30,7 +71,38 @@ def test_parse_args_noresize(mock_resize):
         False,
         False,
         False,
-        True
+        True,
+        jobs=1,
+        pipeline=False,
+        mpc_source=False,
+        share_resizes=False,
+        resize_cache_mb=512,
+        pyramid=False,
+        pyramid_min_psnr=None,
+        dedupe=False,
+        plan_only=False,
+        lazy=False,
+        search=False,
+        target_kb=None,
+        min_psnr=None,
+        score=False,
+        auto_select=None,
+        cache_dir=None,
+        cache_mb=1024,
+        resume=False,
+        one_trip=False,
+        transport="sftp",
+        sftp_channels=1,
+        sftp_window_kb=None,
+        sftp_packet_kb=None,
+        delta=False,
+        overlap=False,
+        prescaled=False,
+        engine="imagemagick",
+        encoders=False,
+        skip_avif=True,
+        skip_jxl=True,
+        effort=None
     )
 
 
@@ -44,10 +116,344 @@ def test_parse_args_config(mock_resize):
         False,
         False,
         False,
-        False
+        False,
+        jobs=1,
+        pipeline=False,
+        mpc_source=False,
+        share_resizes=False,
+        resize_cache_mb=512,
+        pyramid=False,
+        pyramid_min_psnr=None,
+        dedupe=False,
+        plan_only=False,
+        lazy=False,
+        search=False,
+        target_kb=None,
+        min_psnr=None,
+        score=False,
+        auto_select=None,
+        cache_dir=None,
+        cache_mb=1024,
+        resume=False,
+        one_trip=False,
+        transport="sftp",
+        sftp_channels=1,
+        sftp_window_kb=None,
+        sftp_packet_kb=None,
+        delta=False,
+        overlap=False,
+        prescaled=False,
+        engine="imagemagick",
+        encoders=False,
+        skip_avif=True,
+        skip_jxl=True,
+        effort=None
+    )
+
+
+@patch("compressor.resize", autospec=True)
+def test_parse_args_jobs(mock_resize):
+    MOCK_ARGS_LIST = ["sentinel.imgfile", "--jobs", "16"]
+    process_args(MOCK_ARGS_LIST)
+    mock_resize.assert_called_once_with(
+        MOCK_ARGS_LIST[0],
+        "config.json",
+        False,
+        False,
+        False,
+        False,
+        jobs=16,
+        pipeline=False,
+        mpc_source=False,
+        share_resizes=False,
+        resize_cache_mb=512,
+        pyramid=False,
+        pyramid_min_psnr=None,
+        dedupe=False,
+        plan_only=False,
+        lazy=False,
+        search=False,
+        target_kb=None,
+        min_psnr=None,
+        score=False,
+        auto_select=None,
+        cache_dir=None,
+        cache_mb=1024,
+        resume=False,
+        one_trip=False,
+        transport="sftp",
+        sftp_channels=1,
+        sftp_window_kb=None,
+        sftp_packet_kb=None,
+        delta=False,
+        overlap=False,
+        prescaled=False,
+        engine="imagemagick",
+        encoders=False,
+        skip_avif=True,
+        skip_jxl=True,
+        effort=None
+    )
+
+
+@patch("compressor.resize", autospec=True)
+def test_parse_args_pipeline(mock_resize):
+    MOCK_ARGS_LIST = ["sentinel.imgfile", "--pipeline"]
+    process_args(MOCK_ARGS_LIST)
+    mock_resize.assert_called_once_with(
+        MOCK_ARGS_LIST[0],
+        "config.json",
+        False,
+        False,
+        False,
+        False,
+        jobs=1,
+        pipeline=True,
+        mpc_source=False,
+        share_resizes=False,
+        resize_cache_mb=512,
+        pyramid=False,
+        pyramid_min_psnr=None,
+        dedupe=False,
+        plan_only=False,
+        lazy=False,
+        search=False,
+        target_kb=None,
+        min_psnr=None,
+        score=False,
+        auto_select=None,
+        cache_dir=None,
+        cache_mb=1024,
+        resume=False,
+        one_trip=False,
+        transport="sftp",
+        sftp_channels=1,
+        sftp_window_kb=None,
+        sftp_packet_kb=None,
+        delta=False,
+        overlap=False,
+        prescaled=False,
+        engine="imagemagick",
+        encoders=False,
+        skip_avif=True,
+        skip_jxl=True,
+        effort=None
+    )
+
+
+@patch("compressor.resize", autospec=True)
+def test_parse_args_mpc_source(mock_resize):
+    process_args(["sentinel.imgfile", "--mpc_source"])
+    assert mock_resize.call_args.kwargs["mpc_source"]
+
+
+@patch("compressor.resize", autospec=True)
+def test_parse_args_pyramid(mock_resize):
+    process_args(["sentinel.imgfile", "--pyramid", "--pyramid_min_psnr", "40"])
+    assert mock_resize.call_args.kwargs["pyramid"]
+    assert mock_resize.call_args.kwargs["pyramid_min_psnr"] == 40.0
+
+
+@patch("compressor.ImgConvertor", autospec=True)
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.process_outputs", autospec=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+@patch("compressor.ImgScaler", autospec=True)
+def test_resize_pyramid(mock_scaler, mock_get_1wh, mock_process_outputs,
+                        mock_isfile, mock_img_conv):
+    mock_scaler.return_value.get_widths_and_heights = Mock(return_value=(sentinel.widths_and_heights, sentinel.thumbnail))
+    mock_img_conv.return_value.resize_cache = Mock()
+    resize("this is a file path and name.jpg", pyramid=True,
+           pyramid_min_psnr=40.0)
+    mock_img_conv.return_value.use_resize_cache.assert_called_once_with(
+        512 * 1024 * 1024, True, 40.0)
+    mock_img_conv.return_value.transform_all.assert_called_once_with(
+        get_variants(True, False, False, False, True), 1, False, False)
+
+
+@patch("compressor.resize", autospec=True)
+def test_parse_args_plan(mock_resize):
+    process_args(["sentinel.imgfile", "--plan", "--dedupe"])
+    assert mock_resize.call_args.kwargs["plan_only"]
+    assert mock_resize.call_args.kwargs["dedupe"]
+
+
+@patch("compressor.resize", autospec=True)
+def test_parse_args_next_gen(mock_resize):
+    process_args(["sentinel.imgfile", "--avif_generation"])
+    assert not mock_resize.call_args.kwargs["skip_avif"]
+    assert mock_resize.call_args.kwargs["skip_jxl"]
+
+
+@patch("compressor.resize", autospec=True)
+def test_parse_args_effort(mock_resize):
+    process_args(["sentinel.imgfile", "--effort", "fast"])
+    assert mock_resize.call_args.kwargs["effort"] == "fast"
+
+
+@patch("compressor.ImgConvertor", autospec=True)
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.process_outputs", autospec=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+@patch("compressor.ImgScaler", autospec=True)
+def test_resize_plan_only(mock_scaler, mock_get_1wh, mock_process_outputs,
+                          mock_isfile, mock_img_conv, capsys):
+    mock_scaler.return_value.get_widths_and_heights = Mock(return_value=(sentinel.widths_and_heights, sentinel.thumbnail))
+    mock_plan = Mock()
+    mock_plan.describe.return_value = "sentinel.description"
+    mock_img_conv.return_value.plan_all.return_value = (mock_plan, [])
+    resize("this is a file path and name.jpg", plan_only=True)
+    mock_img_conv.return_value.plan_all.assert_called_once_with(
+        get_variants(True, False, False, False), False)
+    assert "sentinel.description" in capsys.readouterr().out
+    mock_img_conv.return_value.transform_all.assert_not_called()
+    mock_img_conv.return_value.decode_source.assert_not_called()
+    mock_process_outputs.assert_not_called()
+
+
+@patch("compressor.resize", autospec=True)
+def test_parse_args_lazy(mock_resize):
+    process_args(["sentinel.imgfile", "--lazy"])
+    assert mock_resize.call_args.kwargs["lazy"]
+
+
+@patch("compressor.ImgConvertor", autospec=True)
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.process_outputs", autospec=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+@patch("compressor.ImgScaler", autospec=True)
+def test_resize_lazy(mock_scaler, mock_get_1wh, mock_process_outputs,
+                     mock_isfile, mock_img_conv):
+    widths_and_heights = [(300, 225), (768, 576)]
+    mock_scaler.return_value.get_widths_and_heights = Mock(return_value=(widths_and_heights, sentinel.thumbnail))
+    resize("this is a file path and name.jpg", jobs=3, lazy=True)
+    assert mock_img_conv.return_value.widths_and_heights == [(300, 225)]
+    mock_process_outputs.assert_called_once_with(
+        640, 480, mock_img_conv.return_value, widths_and_heights, "config.json",
+        get_variants(True, False, False, False), 3, None, None
     )
 
 
+@patch("compressor.resize", autospec=True)
+def test_parse_args_search(mock_resize):
+    process_args(["sentinel.imgfile", "--search", "--target_kb", "40",
+                  "--min_psnr", "38.5"])
+    assert mock_resize.call_args.kwargs["search"]
+    assert mock_resize.call_args.kwargs["target_kb"] == 40
+    assert mock_resize.call_args.kwargs["min_psnr"] == 38.5
+
+
+def test_get_suffixes():
+    assert get_suffixes() == ["png", "webp"]
+    assert get_suffixes(False, True, False) == ["jpg", "webp"]
+    assert get_suffixes(True, True, True, False, False) == ["avif", "jxl"]
+
+
+def test_get_format_variants_next_gen():
+    variants = get_format_variants(60, "avif")
+    assert [v[:3] for v in variants] == [
+        (60, "avif", "inc_resize_speed6"), (60, "avif", "inc_resize_speed3")]
+    assert variants[1].unscaled_cmd == \
+        "convert -strip -define heic:speed=3 -quality {q} {src_img} {dest_img}"
+    assert variants[1].scaling_cmds == [
+        "convert -strip -resize {w}x{h} -define heic:speed=3 -quality {q} "
+        "{src_img} {resized_img}"]
+    variants = get_format_variants(80, "jxl", fullsize_only=True)
+    assert [v[:3] for v in variants] == [
+        (80, "jxl", "no_resize_effort7"), (80, "jxl", "no_resize_effort9")]
+    assert variants[0].scaling_cmds == []
+    assert "-define jxl:effort=7 -quality {q}" in variants[0].unscaled_cmd
+
+
+def test_get_variants_next_gen():
+    variants = get_variants(True, True, True, skip_avif=False, skip_jxl=False)
+    assert len(variants) == 4 * 2 + 4 * 2
+    assert [(v.q, v.suffix) for v in variants[::2]] == [
+        (70, "avif"), (60, "avif"), (50, "avif"), (40, "avif"),
+        (90, "jxl"), (80, "jxl"), (70, "jxl"), (60, "jxl")]
+    assert len(get_variants(False, False, False)) == \
+        len(get_variants(False, False, False, skip_avif=True, skip_jxl=True))
+    families = get_variant_families(["avif"])
+    assert [(f.q_lo, f.q_hi) for f in families] == [(1, 100), (1, 100)]
+    assert [f.make_variant(42)[:3] for f in families] == [
+        (42, "avif", "inc_resize_speed6"), (42, "avif", "inc_resize_speed3")]
+
+
+@patch("compressor.cmn.get_imagemagick_formats",
+       return_value={"avif": "rw+", "jxl": "r--", "png": "rw-"})
+def test_get_unwritable(mock_formats, capsys):
+    assert get_unwritable(["avif", "jxl"]) == ["jxl"]
+    assert capsys.readouterr().out == \
+        "ImageMagick can't write jxl here, skipping its variants.\n"
+    mock_formats.reset_mock()
+    assert get_unwritable([]) == []
+    mock_formats.assert_not_called()
+    mock_formats.side_effect = FileNotFoundError("convert")
+    assert get_unwritable(["avif"]) == ["avif"]
+
+
+def test_get_variant_families():
+    families = get_variant_families(["png", "webp"], share_resizes=True)
+    assert [(f.q_lo, f.q_hi) for f in families] == [(2, 256), (2, 256), (1, 100)]
+    assert [f.make_variant(42)[:3] for f in families] == [
+        (42, "png", "inc_resize"), (42, "png", "aft_resize"),
+        (42, "webp", "inc_resize")]
+    assert "{resized_src}" in families[2].make_variant(42).scaling_cmds[0]
+    families = get_variant_families(["jpg"], fullsize_only=True)
+    assert [f.make_variant(42)[:3] for f in families] == [(42, "jpg", "no_resize")]
+
+
+@patch("compressor.ImgConvertor", autospec=True)
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.process_outputs", autospec=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+@patch("compressor.ImgScaler", autospec=True)
+def test_resize_search(mock_scaler, mock_get_1wh, mock_process_outputs,
+                       mock_isfile, mock_img_conv):
+    mock_scaler.return_value.get_widths_and_heights = Mock(return_value=([[64, 48], [32, 24]], sentinel.thumbnail))
+    resize("this is a file path and name.jpg", skip_png=True, jobs=2,
+           lazy=True, search=True, min_psnr=40)
+    mock_img_conv.return_value.transform_all.assert_not_called()
+    families, max_bytes, min_psnr, jobs, pipeline, dedupe = \
+        mock_img_conv.return_value.search_qualities.call_args.args
+    assert len(families) == 1
+    assert (max_bytes, min_psnr, jobs, pipeline, dedupe) == (None, 40, 2, False, False)
+    assert mock_process_outputs.call_args.args[5] == \
+           mock_img_conv.return_value.search_qualities.return_value
+    resize("this is a file path and name.jpg", search=True, min_psnr=40,
+           score=True)
+    mock_img_conv.return_value.use_scorer.assert_not_called()
+    mock_img_conv.return_value.score_all.assert_called_once_with(1)
+
+
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+def test_resize_search_without_target(mock_get_1wh, mock_isfile):
+    with pytest.raises(CompressorException):
+        resize("this is a file path and name.jpg", search=True)
+
+
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+def test_resize_search_lazy_target(mock_get_1wh, mock_isfile):
+    with pytest.raises(CompressorException) as cerr:
+        resize("this is a file path and name.jpg", search=True, lazy=True,
+               target_kb=40)
+    assert "target_kb" in str(cerr)
+
+
+def test_get_variants():
+    variants = get_variants(False, False, False, False)
+    assert len(variants) == 18
+    assert [v.suffix for v in variants[:10]] == ["png"] * 10
+    assert [(v.q, v.suffix) for v in variants[10:12]] == [(80, "jpg"), (80, "webp")]
+    assert all(v.scaling_cmds for v in variants)
+    variants = get_variants(True, False, True, True)
+    assert [(v.q, v.descriptive) for v in variants] == [
+        (q, "no_resize") for q in [255, 128, 64, 32, 16]]
+    assert not any(v.scaling_cmds for v in variants)
+
+
 @patch("compressor.ImgConvertor", autospec=True)
 @patch("compressor.os.path.isfile", autospec=True, return_value=True)
 @patch("compressor.process_outputs", autospec=True)
@@ -59,13 +465,317 @@ def test_resize(mock_scaler, mock_get_1wh, mock_process_outputs,
     img_name = "this is a file path and name.jpg"
     resize(img_name, "config.json", False, False, False)
     mock_process_outputs.assert_called_once_with(
-        640, 480, mock_img_conv.return_value, sentinel.widths_and_heights, "config.json"
+        640, 480, mock_img_conv.return_value, sentinel.widths_and_heights, "config.json",
+        None, 1, None, None
     )
     mock_get_1wh.assert_called_once_with(img_name)
     mock_scaler.assert_called_once_with(640, 480)
     mock_scaler.return_value.get_widths_and_heights.assert_called_once_with()
     mock_isfile.assert_called_once_with(img_name)
     mock_img_conv.assert_called_once_with(img_name, sentinel.widths_and_heights, "tmp/")
+    mock_img_conv.return_value.transform_all.assert_called_once_with(
+        get_variants(False, False, False, False), 1, False, False)
+    mock_img_conv.return_value.decode_source.assert_not_called()
+    mock_img_conv.return_value.score_all.assert_not_called()
+    mock_img_conv.return_value.use_scorer.assert_not_called()
+    mock_img_conv.return_value.remove_decoded_source.assert_called_once_with()
+
+
+@patch("compressor.ImgConvertor", autospec=True)
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.process_outputs", autospec=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+@patch("compressor.ImgScaler", autospec=True)
+def test_resize_score(mock_scaler, mock_get_1wh, mock_process_outputs,
+                      mock_isfile, mock_img_conv):
+    mock_scaler.return_value.get_widths_and_heights = Mock(return_value=(sentinel.widths_and_heights, sentinel.thumbnail))
+    resize("this is a file path and name.jpg", jobs=3, score=True)
+    mock_img_conv.return_value.use_scorer.assert_called_once_with()
+    mock_img_conv.return_value.score_all.assert_called_once_with(3)
+    mock_img_conv.return_value.use_output_cache.assert_not_called()
+    mock_process_outputs.assert_called_once()
+
+
+@patch("compressor.ImgConvertor", autospec=True)
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.process_outputs", autospec=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+@patch("compressor.ImgScaler", autospec=True)
+def test_resize_cache_dir(mock_scaler, mock_get_1wh, mock_process_outputs,
+                          mock_isfile, mock_img_conv):
+    mock_scaler.return_value.get_widths_and_heights = Mock(return_value=(sentinel.widths_and_heights, sentinel.thumbnail))
+    resize("this is a file path and name.jpg", cache_dir="~/.cache/x", cache_mb=3)
+    mock_img_conv.return_value.use_output_cache.assert_called_once_with(
+        "~/.cache/x", 3 * 1024 * 1024)
+
+
+@pytest.mark.parametrize("scaling_cmd,shared", [
+    ("convert -strip -resize {w}x{h} -colors {q} {src_img} {resized_img}",
+     "convert -strip -colors {q} {resized_src} {resized_img}"),
+    ("convert -strip -resize {w}x{h} {src_img} {tmp_img}",
+     "convert -strip {resized_src} {tmp_img}"),
+    ("convert -strip -colors {q} {tmp_img} {resized_img}",
+     "convert -strip -colors {q} {tmp_img} {resized_img}"),
+])
+def test_share_resize(scaling_cmd, shared):
+    assert share_resize(scaling_cmd) == shared
+
+
+@pytest.mark.parametrize("scaling_cmd,cropped", [
+    ("convert -strip -resize {w}x{h} -colors {q} {src_img} {resized_img}",
+     "convert -strip -resize {w}x{h}^ -gravity center -extent {w}x{h} "
+     "-colors {q} {src_img} {resized_img}"),
+    ("convert -strip -colors {q} {resized_src} {resized_img}",
+     "convert -resize {w}x{h}^ -gravity center -extent {w}x{h} "
+     "-strip -colors {q} {src_img} {resized_img}"),
+    ("cwebp -q {q} {tmp_img} -o {resized_img}",
+     "cwebp -q {q} {tmp_img} -o {resized_img}"),
+])
+def test_crop_to_fill(scaling_cmd, cropped):
+    assert crop_to_fill(scaling_cmd) == cropped
+
+
+def test_get_variants_share_resizes():
+    variants = get_variants(False, False, False, False, True)
+    assert [v[:4] for v in variants] == [
+        v[:4] for v in get_variants(False, False, False, False)]
+    for variant in variants:
+        assert "{resized_src}" in variant.scaling_cmds[0]
+        assert "-resize" not in " ".join(variant.scaling_cmds)
+
+
+@patch("compressor.ImgConvertor", autospec=True)
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.process_outputs", autospec=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+@patch("compressor.ImgScaler", autospec=True)
+def test_resize_share_resizes(mock_scaler, mock_get_1wh, mock_process_outputs,
+                              mock_isfile, mock_img_conv):
+    mock_scaler.return_value.get_widths_and_heights = Mock(return_value=(sentinel.widths_and_heights, sentinel.thumbnail))
+    mock_img_conv.return_value.resize_cache = Mock()
+    resize("this is a file path and name.jpg", share_resizes=True,
+           resize_cache_mb=2)
+    mock_img_conv.return_value.use_resize_cache.assert_called_once_with(
+        2 * 1024 * 1024, False, None)
+    mock_img_conv.return_value.transform_all.assert_called_once_with(
+        get_variants(True, False, False, False, True), 1, False, False)
+    mock_img_conv.return_value.resize_cache.clear.assert_called_once_with()
+
+
+def test_get_encoder_variants():
+    variants = get_encoder_variants(64, "png", ["pngquant", "oxipng"])
+    assert [v[:3] for v in variants] == [(64, "png", "pngquant_oxipng")]
+    assert variants[0].unscaled_cmd.splitlines() == [
+        "convert -strip {src_img} {tmp_img}",
+        "pngquant --strip {q} - < {tmp_img} > {tmp_img2}",
+        "oxipng --quiet --opt 4 --strip safe {tmp_img2} --out {dest_img}"]
+    assert variants[0].scaling_cmds == [
+        "convert -strip -resize {w}x{h} {src_img} {tmp_img}",
+        "pngquant --strip {q} - < {tmp_img} > {tmp_img2}",
+        "oxipng --quiet --opt 4 --strip safe {tmp_img2} --out {resized_img}"]
+    variants = get_encoder_variants(70, "webp", ["cwebp"], fullsize_only=True)
+    assert variants[0].descriptive == "cwebp"
+    assert variants[0].scaling_cmds == []
+    assert get_encoder_variants(70, "jpg", ["cwebp"]) == []
+
+
+def test_get_variants_encoders():
+    variants = get_variants(False, False, False, False, True,
+                            ["pngquant", "cwebp", "cjpeg"])
+    assert len(variants) == 18 + 5 + 4 + 4
+    assert [v[:3] for v in variants[:3]] == [
+        (255, "png", "inc_resize"), (255, "png", "aft_resize"),
+        (255, "png", "pngquant")]
+    assert [v[:3] for v in variants[15:19]] == [
+        (80, "jpg", "inc_resize"), (80, "jpg", "mozjpeg"),
+        (80, "webp", "inc_resize"), (80, "webp", "cwebp")]
+    # Encoders read the shared resize as they would the source.
+    assert variants[2].scaling_cmds[0] == \
+           "convert -strip {resized_src} {tmp_img}"
+    families = get_variant_families(["webp"], encoders=["cwebp"])
+    assert [f.make_variant(42)[:3] for f in families] == [
+        (42, "webp", "inc_resize"), (42, "webp", "cwebp")]
+
+
+def test_effort_cmd():
+    webp_cmd = "convert -strip -resize {w}x{h} -define webp:method=6 " \
+               "-quality {q} {src_img} {resized_img}"
+    assert effort_cmd(webp_cmd, "webp", "fast") == \
+        "convert -strip -resize {w}x{h} -quality {q} -define webp:method=2 " \
+        "{src_img} {resized_img}"
+    assert effort_cmd(effort_cmd(webp_cmd, "webp", "fast"), "webp", "max") == \
+        "convert -strip -resize {w}x{h} -quality {q} -define webp:method=6 " \
+        "{src_img} {resized_img}"
+    png_cmd = "convert -strip -colors {q} {src_img} {dest_img}"
+    assert effort_cmd(png_cmd, "png", "balanced") == png_cmd
+    assert effort_cmd(png_cmd, "png", "max") == \
+        "convert -strip -colors {q} -define png:compression-level=9 " \
+        "{src_img} {dest_img}"
+    # Intermediates aren't what's kept.
+    tmp_cmd = "convert -strip -resize {w}x{h} {src_img} {tmp_img}"
+    assert effort_cmd(tmp_cmd, "png", "fast") == tmp_cmd
+    assert effort_cmd("convert -strip {src_img} {dest_img}", "avif", "fast") \
+        == "convert -strip {src_img} {dest_img}"
+
+
+def test_at_effort_encoders():
+    variant = get_encoder_variants(64, "png", ["pngquant", "oxipng"])[0]
+    fast = at_effort(variant, "fast")
+    assert fast[:3] == variant[:3]
+    assert fast.unscaled_cmd.splitlines() == [
+        "convert -strip {src_img} {tmp_img}",
+        "pngquant --strip {q} - < {tmp_img} > {tmp_img2}",
+        "oxipng --quiet --opt 1 --strip safe {tmp_img2} --out {dest_img}"]
+    assert fast.scaling_cmds[-1] == \
+        "oxipng --quiet --opt 1 --strip safe {tmp_img2} --out {resized_img}"
+    variant = get_encoder_variants(70, "webp", ["cwebp"])[0]
+    assert " -m 4 " in at_effort(variant, "balanced").unscaled_cmd
+    assert at_effort(variant, None) == variant
+
+
+def test_get_variants_effort():
+    variants = get_variants(False, False, False)
+    assert get_variants(False, False, False, effort=None) == variants
+    fast = get_variants(False, False, False, effort="fast")
+    assert [v[:3] for v in fast] == [v[:3] for v in variants]
+    assert all("webp:method=2" in v.unscaled_cmd
+               for v in fast if v.suffix == "webp")
+    assert all("png:compression-level=1" in v.scaling_cmds[-1]
+               for v in fast if v.suffix == "png")
+    assert [v for v in fast if v.suffix == "jpg"] == \
+        [v for v in variants if v.suffix == "jpg"]
+    families = get_variant_families(["webp"], effort="balanced")
+    assert "-define webp:method=4" in families[0].make_variant(42).unscaled_cmd
+
+
+@patch("compressor.ImgConvertor", autospec=True)
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.process_outputs", autospec=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+@patch("compressor.ImgScaler", autospec=True)
+def test_resize_effort(mock_scaler, mock_get_1wh, mock_process_outputs,
+                       mock_isfile, mock_img_conv):
+    mock_scaler.return_value.get_widths_and_heights = Mock(return_value=(sentinel.widths_and_heights, sentinel.thumbnail))
+    resize("this is a file path and name.jpg", effort="fast")
+    variants = get_variants(True, False, False, effort="fast")
+    mock_img_conv.return_value.transform_all.assert_called_once_with(
+        variants, 1, False, False)
+    final_variants = get_variants(True, False, False, effort="max")
+    mock_process_outputs.assert_called_once_with(
+        640, 480, mock_img_conv.return_value, sentinel.widths_and_heights,
+        "config.json", None, 1, None, final_variants)
+    mock_process_outputs.reset_mock()
+    # Rendered at max already.
+    resize("this is a file path and name.jpg", effort="max")
+    assert mock_process_outputs.call_args.args[-1] is None
+
+
+@patch("compressor.find_encoders", autospec=True, return_value=["cwebp"])
+@patch("compressor.ImgConvertor", autospec=True)
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.process_outputs", autospec=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+@patch("compressor.ImgScaler", autospec=True)
+def test_resize_encoders(mock_scaler, mock_get_1wh, mock_process_outputs,
+                         mock_isfile, mock_img_conv, mock_find_encoders,
+                         capsys):
+    mock_scaler.return_value.get_widths_and_heights = Mock(return_value=(sentinel.widths_and_heights, sentinel.thumbnail))
+    resize("this is a file path and name.jpg", encoders=True)
+    mock_img_conv.return_value.transform_all.assert_called_once_with(
+        get_variants(True, False, False, False, False, ["cwebp"]), 1, False,
+        False)
+    assert capsys.readouterr().out.startswith(
+        "pngquant, oxipng, cjpeg not found")
+
+
+@patch("compressor.cmn.get_imagemagick_formats",
+       return_value={"avif": "rw+", "png": "rw-"})
+@patch("compressor.ImgConvertor", autospec=True)
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.process_outputs", autospec=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+@patch("compressor.ImgScaler", autospec=True)
+def test_resize_next_gen(mock_scaler, mock_get_1wh, mock_process_outputs,
+                         mock_isfile, mock_img_conv, mock_formats):
+    mock_scaler.return_value.get_widths_and_heights = Mock(return_value=(sentinel.widths_and_heights, sentinel.thumbnail))
+    resize("this is a file path and name.jpg", skip_avif=False,
+           skip_jxl=False, prescaled=True)
+    # No jxl delegate here, so just avif's.
+    mock_img_conv.return_value.transform_all.assert_called_once_with(
+        get_variants(True, False, False, skip_avif=False), 1, False, False)
+
+
+@patch("compressor.cmn.get_imagemagick_formats",
+       return_value={"jxl": "rw-"})
+@patch("compressor.ImgConvertor", autospec=True)
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.process_outputs", autospec=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+@patch("compressor.ImgScaler", autospec=True)
+def test_resize_jxl_only_prescaled(mock_scaler, mock_get_1wh,
+                                   mock_process_outputs, mock_isfile,
+                                   mock_img_conv, mock_formats, capsys):
+    mock_scaler.return_value.get_widths_and_heights = Mock(return_value=(sentinel.widths_and_heights, sentinel.thumbnail))
+    resize("this is a file path and name.jpg")
+    mock_formats.assert_not_called()
+    resize("this is a file path and name.jpg", skip_jxl=False)
+    mock_img_conv.return_value.transform_all.assert_called_with(
+        get_variants(True, False, False), 1, False, False)
+    assert "WordPress won't take jxl uploaded, only --prescaled" in \
+           capsys.readouterr().out
+    resize("this is a file path and name.jpg", skip_jxl=False, prescaled=True)
+    mock_img_conv.return_value.transform_all.assert_called_with(
+        get_variants(True, False, False, skip_jxl=False), 1, False, False)
+    resize("this is a file path and name.jpg", skip_jxl=False, plan_only=True)
+    assert "WordPress" not in capsys.readouterr().out
+
+
+@patch("compressor.ImgConvertor", autospec=True)
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.process_outputs", autospec=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+@patch("compressor.ImgScaler", autospec=True)
+def test_resize_engine(mock_scaler, mock_get_1wh, mock_process_outputs,
+                       mock_isfile, mock_img_conv):
+    mock_scaler.return_value.get_widths_and_heights = Mock(return_value=(sentinel.widths_and_heights, sentinel.thumbnail))
+    resize("this is a file path and name.jpg", engine="pillow")
+    mock_img_conv.return_value.use_engine.assert_called_once_with("pillow")
+    mock_img_conv.return_value.remove_decoded_source.assert_called_once_with()
+    mock_process_outputs.assert_called_once()
+    for ims_only in ({"pipeline": True}, {"mpc_source": True}):
+        with pytest.raises(CompressorException):
+            resize("this is a file path and name.jpg", engine="pillow",
+                   **ims_only)
+
+
+@patch("scoring.np", None)
+@patch("compressor.ImgConvertor", autospec=True)
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+@patch("compressor.ImgScaler", autospec=True)
+def test_resize_score_needs_numpy(mock_scaler, mock_get_1wh, mock_isfile,
+                                  mock_img_conv):
+    mock_scaler.return_value.get_widths_and_heights = Mock(return_value=(sentinel.widths_and_heights, sentinel.thumbnail))
+    with pytest.raises(CompressorException) as cerr:
+        resize("this is a file path and name.jpg", auto_select="min_ssim=0.9")
+    assert "pip install numpy" in str(cerr)
+    mock_img_conv.return_value.transform_all.assert_not_called()
+
+
+@patch("compressor.ImgConvertor", autospec=True)
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.process_outputs", autospec=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+@patch("compressor.ImgScaler", autospec=True)
+def test_resize_mpc_source(mock_scaler, mock_get_1wh, mock_process_outputs,
+                           mock_isfile, mock_img_conv):
+    mock_scaler.return_value.get_widths_and_heights = Mock(return_value=(sentinel.widths_and_heights, sentinel.thumbnail))
+    mock_img_conv.return_value.transform_all.side_effect = RuntimeError
+    with pytest.raises(RuntimeError):
+        resize("this is a file path and name.jpg", mpc_source=True)
+    mock_img_conv.return_value.decode_source.assert_called_once_with()
+    mock_img_conv.return_value.remove_decoded_source.assert_called_once_with()
+    mock_process_outputs.assert_not_called()
 
 
 @patch("compressor.ImgConvertor", autospec=True)
@@ -80,7 +790,8 @@ def test_resize_fullsize_only(
     img_name = "this is a file path and name.jpg"
     resize(img_name, "config.json", False, False, False, True)
     mock_process_outputs.assert_called_once_with(
-        640, 480, mock_img_conv.return_value, sentinel.widths_and_heights, "config.json"
+        640, 480, mock_img_conv.return_value, sentinel.widths_and_heights, "config.json",
+        None, 1, None, None
     )
     mock_get_1wh.assert_called_once_with(img_name)
     mock_scaler.assert_called_once_with(640, 480)
@@ -96,13 +807,105 @@ def test_process_outputs(mock_img_conv, mock_rmtree):
     mock_img_conv.return_value.all_dirs = sentinel.all_dirs
     process_outputs(20, 42, mock_img_conv.return_value, sentinel.widths_and_heights, sentinel.file_name)
     mock_img_conv.return_value.present_gallery.assert_called_once_with(20, 42, sentinel.widths_and_heights)
+    assert mock_img_conv.return_value.write_manifest.mock_calls == [call(), call()]
     mock_img_conv.return_value.select_one.assert_called_once_with()
+    mock_img_conv.return_value.auto_select.assert_not_called()
     mock_img_conv.return_value.upload.assert_called_once_with(
         mock_img_conv.return_value.select_one.return_value,
         sentinel.file_name
     )
     mock_rmtree.assert_called_once_with(sentinel.subdir_root)
     mock_img_conv.return_value.delete_other_dirs.assert_not_called()
+    mock_img_conv.return_value.complete_variant.assert_not_called()
+
+
+@patch("compressor.ImgConvertor", autospec=True)
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.process_outputs", autospec=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+@patch("compressor.ImgScaler", autospec=True)
+def test_resize_resume(mock_scaler, mock_get_1wh, mock_process_outputs,
+                       mock_isfile, mock_img_conv):
+    mock_scaler.return_value.get_widths_and_heights = Mock(return_value=(sentinel.widths_and_heights, sentinel.thumbnail))
+    mock_img_conv.return_value.all_dirs = [(123, "tmp/png_q5_a")]
+    mock_img_conv.return_value.restore_choice.return_value = True
+    resize("this is a file path and name.jpg", resume=True)
+    mock_img_conv.return_value.use_checkpoint.assert_called_once_with(
+        get_variants(), True)
+    mock_img_conv.return_value.transform_all.assert_not_called()
+    mock_process_outputs.assert_called_once()
+    mock_img_conv.return_value.restore_choice.return_value = False
+    resize("this is a file path and name.jpg", resume=True)
+    mock_img_conv.return_value.transform_all.assert_called_once()
+
+
+@patch("compressor.shutil.rmtree", autospec=True)
+@patch("compressor.ImgConvertor", autospec=True)
+def test_process_outputs_auto_select(mock_img_conv, mock_rmtree):
+    mock_img_conv.return_value.subdir_root = sentinel.subdir_root
+    process_outputs(20, 42, mock_img_conv.return_value, sentinel.widths_and_heights,
+                    sentinel.file_name, None, 1, sentinel.policy)
+    mock_img_conv.return_value.select_one.assert_not_called()
+    mock_img_conv.return_value.auto_select.assert_called_once_with(sentinel.policy)
+    mock_img_conv.return_value.upload.assert_called_once_with(
+        mock_img_conv.return_value.auto_select.return_value,
+        sentinel.file_name
+    )
+
+
+@patch("compressor.resize", autospec=True)
+def test_parse_args_auto_select(mock_resize):
+    process_args(["sentinel.imgfile", "--auto_select", "max_kb=40,prefer=webp"])
+    assert mock_resize.call_args.kwargs["auto_select"] == "max_kb=40,prefer=webp"
+
+
+@patch("compressor.ImgConvertor", autospec=True)
+@patch("compressor.os.path.isfile", autospec=True, return_value=True)
+@patch("compressor.process_outputs", autospec=True)
+@patch("compressor.cmn.get_img_wxh", return_value=[640, 480])
+@patch("compressor.ImgScaler", autospec=True)
+def test_resize_auto_select(mock_scaler, mock_get_1wh, mock_process_outputs,
+                            mock_isfile, mock_img_conv):
+    mock_scaler.return_value.get_widths_and_heights = Mock(return_value=(sentinel.widths_and_heights, sentinel.thumbnail))
+    resize("this is a file path and name.jpg", auto_select="max_kb=40")
+    mock_img_conv.return_value.score_all.assert_not_called()
+    assert mock_process_outputs.call_args.args[7].max_kb == 40
+    resize("this is a file path and name.jpg", auto_select="min_ssim=0.98")
+    mock_img_conv.return_value.score_all.assert_called_once_with(1)
+    assert mock_process_outputs.call_args.args[7].min_ssim == 0.98
+    with pytest.raises(CompressorException):
+        resize("this is a file path and name.jpg", auto_select="most_ssim=1")
+
+
+@patch("compressor.shutil.rmtree", autospec=True)
+@patch("compressor.ImgConvertor", autospec=True)
+def test_process_outputs_lazy(mock_img_conv, mock_rmtree):
+    mock_img_conv.return_value.subdir_root = sentinel.subdir_root
+    process_outputs(20, 42, mock_img_conv.return_value, sentinel.widths_and_heights,
+                    sentinel.file_name, sentinel.variants, 4)
+    mock_img_conv.return_value.complete_variant.assert_called_once_with(
+        mock_img_conv.return_value.select_one.return_value, sentinel.variants,
+        sentinel.widths_and_heights, 4)
+    mock_img_conv.return_value.upload.assert_called_once_with(
+        mock_img_conv.return_value.select_one.return_value,
+        sentinel.file_name
+    )
+
+
+@patch("compressor.shutil.rmtree", autospec=True)
+@patch("compressor.ImgConvertor", autospec=True)
+def test_process_outputs_effort(mock_img_conv, mock_rmtree):
+    processor = mock_img_conv.return_value
+    processor.subdir_root = sentinel.subdir_root
+    process_outputs(20, 42, processor, sentinel.widths_and_heights,
+                    sentinel.file_name, sentinel.final_variants, 4,
+                    final_variants=sentinel.final_variants)
+    chosen = processor.select_one.return_value
+    assert processor.mock_calls[-3:] == [
+        call.reencode_variant(chosen, sentinel.final_variants, 4),
+        call.complete_variant(chosen, sentinel.final_variants,
+                              sentinel.widths_and_heights, 4),
+        call.upload(chosen, sentinel.file_name)]
 
 
 @patch("compressor.shutil.rmtree", autospec=True)
@@ -164,3 +967,18 @@ def test_parse_args_for_help():
         process_args(["-h"])
 
 
+
+
+@patch("compressor.WP_API", autospec=True)
+@patch("compressor.get_client", autospec=True)
+def test_uploader(mock_get_client, mock_wp_api):
+    uploader = Uploader("conf.json")
+    conf = '{"ssh": {"host": "10.0.0.1:2222", "username": "u", "wp_uploads": "/up"}}'
+    with patch("builtins.open", mock_open(read_data=conf)):
+        assert uploader.get_client() is uploader.get_client()
+    assert uploader.get_wp_api() is uploader.get_wp_api()
+    mock_wp_api.assert_called_once_with("conf.json")
+    mock_get_client.assert_called_once_with("10.0.0.1", 2222, {"username": "u"})
+    uploader.close()
+    mock_get_client.return_value.close.assert_called_once_with()
+    assert uploader.client is None
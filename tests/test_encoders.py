@@ -0,0 +1,66 @@
+from unittest.mock import patch, Mock
+
+import pytest
+
+import encoders
+from encoders import find_encoders, get_encode_cmds, get_encoded_by, \
+    get_encoder_version
+
+
+@pytest.fixture(autouse=True)
+def clear_versions():
+    get_encoder_version.cache_clear()
+    yield
+    get_encoder_version.cache_clear()
+
+
+@patch("encoders.subprocess.run", autospec=True)
+def test_get_encoder_version(mock_run):
+    mock_run.return_value = Mock(
+        stdout=b"", stderr=b"mozjpeg version 4.1.1 (build 20230101)\nmore\n")
+    assert get_encoder_version("cjpeg") == \
+           "cjpeg mozjpeg version 4.1.1 (build 20230101)"
+    assert get_encoder_version("cjpeg") == \
+           "cjpeg mozjpeg version 4.1.1 (build 20230101)"
+    mock_run.assert_called_once_with(["cjpeg", "-version"], capture_output=True)
+
+
+@patch("encoders.get_encoder_version", autospec=True)
+@patch("encoders.shutil.which", autospec=True)
+def test_find_encoders(mock_which, mock_version):
+    mock_which.side_effect = \
+        lambda name: None if name == "oxipng" else "/usr/bin/" + name
+    mock_version.return_value = "cjpeg mozjpeg version 4.1.1"
+    assert find_encoders() == ["pngquant", "cwebp", "cjpeg"]
+    # libjpeg-turbo's cjpeg isn't mozjpeg's.
+    mock_version.return_value = "cjpeg libjpeg-turbo version 2.1.5"
+    assert find_encoders() == ["pngquant", "cwebp"]
+    mock_version.assert_called_with("cjpeg")
+
+
+def test_get_encode_cmds():
+    assert get_encode_cmds("png", ["pngquant", "oxipng"]) == [
+        ("pngquant_oxipng", [
+            "pngquant --strip {q} - < {tmp_img} > {tmp_img2}",
+            "oxipng --quiet --opt 4 --strip safe {tmp_img2} --out {out}"])]
+    assert get_encode_cmds("png", ["pngquant"]) == [
+        ("pngquant", [encoders.PNGQUANT_CMD])]
+    assert get_encode_cmds("png", ["oxipng", "cwebp"])[0][1][0] == \
+           "convert -strip -colors {q} {tmp_img} {tmp_img2}"
+    assert get_encode_cmds("webp", ["cwebp"]) == [
+        ("cwebp", [encoders.CWEBP_CMD])]
+    assert get_encode_cmds("jpg", ["cjpeg"]) == [
+        ("mozjpeg", [encoders.CJPEG_CMD])]
+    assert get_encode_cmds("jpg", ["pngquant", "oxipng", "cwebp"]) == []
+    # Each ends by writing {out}, its output last.
+    for suffix in ("png", "webp", "jpg"):
+        for _, cmds in get_encode_cmds(suffix, list(encoders.ENCODERS)):
+            assert cmds[-1].endswith(" {out}")
+
+
+def test_get_encoded_by():
+    assert get_encoded_by([
+        "convert -strip {src_img} {tmp_img}",
+        encoders.PNGQUANT_CMD, "pngquant {q} {tmp_img}",
+        "oxipng {tmp_img2} --out {out}"]) == ["pngquant", "oxipng"]
+    assert get_encoded_by(["convert {src_img} {dest_img}"]) == []
@@ -0,0 +1,167 @@
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from compressor import ImgConvertor, crop_to_fill, get_variants
+from engines import ConvertCmd, PillowEngine, fit, get_blur, get_engine, \
+    get_radius_and_sigma, parse_convert
+from img_header import read_wxh
+
+
+@pytest.fixture
+def src_img(tmp_path) -> str:
+    img_name = str(tmp_path / "src.png")
+    img = Image.linear_gradient("L").resize((400, 300)).convert("RGB")
+    img.save(img_name, icc_profile=b"not really a profile")
+    return img_name
+
+
+def test_parse_convert():
+    assert parse_convert(
+        "convert -strip -resize 30x20 -quality 5 a.png b.jpg".split()) == \
+        ConvertCmd([("-strip", None), ("-resize", "30x20"),
+                    ("-quality", "5")], "a.png", "b.jpg")
+    for unsupported in ("convert -sharpen 2 a.png b.jpg",
+                        "convert -resize a.png b.jpg",
+                        "identify a.png", "convert a.png"):
+        with pytest.raises(ValueError):
+            parse_convert(unsupported.split())
+
+
+def test_fit():
+    assert fit(6000, 4000, 300, 300) == (300, 200)
+    assert fit(6000, 4000, 150, 150, fill=True) == (225, 150)
+    # Half up, as ImageMagick, rather than to even.
+    assert fit(10, 5, 5, 4) == (5, 3)
+
+
+def test_get_radius_and_sigma():
+    # As ImageMagick reads them: no sigma is 1.0, not the radius.
+    assert get_radius_and_sigma("0.05") == (0.05, 1.0)
+    assert get_radius_and_sigma("0x1.5") == (0.0, 1.5)
+
+
+def test_get_blur():
+    # ImageMagick's -gaussian-blur 0.05: 3x3, sigma 1.0, the corners
+    # weighted e^-1 and the edges e^-0.5 of the centre.
+    kernel = get_blur("0.05")
+    assert kernel.filterargs[0] == (3, 3)
+    weights = kernel.filterargs[3]
+    assert weights[4] == 1.0
+    assert weights[0] == pytest.approx(0.3679, abs=1e-4)
+    assert weights[1] == pytest.approx(0.6065, abs=1e-4)
+    assert kernel.filterargs[1] == pytest.approx(sum(weights))
+    # Left to Pillow's own beyond the widths it convolves.
+    assert get_blur("0x1.5").radius == 1.5
+    assert get_blur("3x2").radius == 2.0
+
+
+def test_get_engine(src_img):
+    assert get_engine("imagemagick", src_img) is None
+    assert get_engine("pillow", src_img).src_img == src_img
+    with pytest.raises(ValueError):
+        get_engine("wand", src_img)
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_transform_all(src_img, tmp_path, jobs):
+    img_processor = ImgConvertor(src_img, [(200, 150), (100, 75)],
+                                 str(tmp_path / "tmp"))
+    engine = img_processor.use_engine("pillow")
+    variants = get_variants(False, False, False, False)
+    with patch.object(PillowEngine, "decode", wraps=PillowEngine.decode) \
+            as mock_decode:
+        img_processor.transform_all(variants, jobs)
+    assert [c.args[0] for c in mock_decode.call_args_list].count(src_img) == 1
+    assert len(img_processor.all_dirs) == len(variants)
+    for variant in variants:
+        subdir_name = img_processor.get_subdir_name(
+            variant.q, variant.suffix, variant.descriptive)
+        assert read_wxh(img_processor.path_to_new_img(
+            variant.suffix, subdir_name)) == (400, 300)
+        for w, h in img_processor.widths_and_heights:
+            resized_img = img_processor.path_to_resized_img(
+                w, h, variant.suffix, subdir_name)
+            assert read_wxh(resized_img) == (w, h)
+            with Image.open(resized_img) as img:
+                assert img.format == {"png": "PNG", "jpg": "JPEG",
+                                      "webp": "WEBP"}[variant.suffix]
+                assert "icc_profile" not in img.info
+                if variant.suffix == "png":
+                    assert len(img.getcolors(256)) <= variant.q
+                if variant.suffix == "jpg":
+                    assert img.info.get("progressive")
+    engine.release()
+    assert engine.decoded is None
+
+
+def test_run_crop_to_fill(src_img, tmp_path):
+    engine = PillowEngine(src_img)
+    dest_img = str(tmp_path / "thumb.png")
+    scaling_cmd = crop_to_fill("convert -strip -resize {w}x{h} {src_img} {dest_img}")
+    engine.run(scaling_cmd.format(w=150, h=150, src_img=src_img,
+                                  dest_img=dest_img).split())
+    assert read_wxh(dest_img) == (150, 150)
+
+
+def test_run_keeps_profile_unless_stripped(src_img, tmp_path):
+    engine = PillowEngine(src_img)
+    for strip in ([], ["-strip"]):
+        dest_img = str(tmp_path / "out{}.webp".format(len(strip)))
+        engine.run(["convert", *strip, src_img, dest_img])
+        with Image.open(dest_img) as img:
+            assert ("icc_profile" in img.info) == (not strip)
+
+
+def test_run_compression_levels(src_img, tmp_path):
+    engine = PillowEngine(src_img)
+    sizes = {}
+    for level in (1, 9):
+        dest_img = str(tmp_path / "out{}.png".format(level))
+        engine.run(["convert", "-strip", "-define",
+                    "png:compression-level={}".format(level), src_img,
+                    dest_img])
+        sizes[level] = Path(dest_img).stat().st_size
+    assert sizes[9] < sizes[1]
+
+
+@patch("engines.cmn.run_shell_cmd_or_raise", autospec=True, return_value="")
+def test_run_other_than_convert(mock_run_shell, src_img):
+    engine = PillowEngine(src_img)
+    assert engine.run(["cwebp", "in.png", "-o", "out.webp"]) == ""
+    mock_run_shell.assert_called_once_with(["cwebp", "in.png", "-o", "out.webp"])
+    assert engine.decoded is None
+
+
+def test_run_unsupported(src_img, tmp_path):
+    engine = PillowEngine(src_img)
+    for options in (["-define", "webp:lossless=true"],
+                    ["-gravity", "north"]):
+        with pytest.raises(ValueError):
+            engine.run(["convert", *options, src_img,
+                        str(tmp_path / "out.webp")])
+
+
+@patch("engines.cmn.run_shell_cmd_or_raise", autospec=True, return_value="")
+def test_run_shared_resize_by_convert(mock_run_shell, src_img, tmp_path):
+    engine = PillowEngine(src_img)
+    # A {resized_src} from the resize cache, which Pillow can't read.
+    split_cmd = ["convert", "-strip", "-define", "webp:method=6", "-quality",
+                 "60", str(tmp_path / "src-200x150.mpc"),
+                 str(tmp_path / "out.webp")]
+    assert engine.run(split_cmd) == ""
+    mock_run_shell.assert_called_once_with(split_cmd)
+
+
+@patch("engines.cmn.run_shell_cmd_or_raise", autospec=True, return_value="")
+def test_run_unwritten_by_convert(mock_run_shell, src_img):
+    engine = PillowEngine(src_img)
+    # Options the engine wouldn't run, left to convert with the rest.
+    split_cmd = ["convert", "-strip", "-define", "heic:speed=6", "-quality",
+                 "60", src_img, "out.avif"]
+    assert engine.run(split_cmd) == ""
+    mock_run_shell.assert_called_once_with(split_cmd)
+    assert engine.decoded is None
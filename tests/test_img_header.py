@@ -0,0 +1,75 @@
+import struct
+
+import pytest
+
+from img_header import read_wxh
+
+
+def jpeg_segment(marker: int, body: bytes) -> bytes:
+    return struct.pack(">BBH", 0xff, marker, len(body) + 2) + body
+
+
+def jpeg_sof(marker: int, w: int, h: int) -> bytes:
+    return jpeg_segment(marker, struct.pack(">BHHB", 8, h, w, 3) + bytes(9))
+
+
+def riff_webp(chunk: bytes, body: bytes) -> bytes:
+    return b"RIFF" + struct.pack("<I", len(body) + 12) + b"WEBP" + chunk + \
+           struct.pack("<I", len(body)) + body
+
+
+def write(tmp_path, content: bytes) -> str:
+    img_name = str(tmp_path / "img")
+    with open(img_name, "wb") as f_out:
+        f_out.write(content)
+    return img_name
+
+
+def test_read_wxh_png():
+    assert read_wxh("white_100x100.png") == (100, 100)
+
+
+@pytest.mark.parametrize("sof", [0xc0, 0xc1, 0xc2])
+def test_read_wxh_jpeg(tmp_path, sof):
+    content = b"\xff\xd8" + jpeg_segment(0xe0, b"JFIF\x00" + bytes(9)) + \
+              jpeg_segment(0xe1, b"Exif\x00\x00" + bytes(60000)) + \
+              jpeg_segment(0xdb, bytes(65)) + b"\xff" + \
+              jpeg_sof(sof, 4000, 3000) + jpeg_segment(0xda, bytes(10))
+    assert read_wxh(write(tmp_path, content)) == (4000, 3000)
+
+
+@pytest.mark.parametrize("content", [
+    # Arithmetic coded.
+    b"\xff\xd8" + jpeg_sof(0xc9, 4000, 3000),
+    # Height left to a DNL marker.
+    b"\xff\xd8" + jpeg_sof(0xc0, 4000, 0),
+    # No frame header before the scan.
+    b"\xff\xd8" + jpeg_segment(0xda, bytes(10)),
+    # Truncated.
+    b"\xff\xd8" + jpeg_segment(0xe0, bytes(20))[:10],
+    b"\x89PNG\r\n\x1a\n" + bytes(8),
+    b"GIF89a" + bytes(20),
+    b"",
+])
+def test_read_wxh_unread(tmp_path, content):
+    assert read_wxh(write(tmp_path, content)) is None
+
+
+def test_read_wxh_webp_lossy(tmp_path):
+    # A keyframe tag, the start code, then 14 bit dimensions, here with
+    # upscaling bits set.
+    body = b"\x9d\x01\x00" + b"\x9d\x01\x2a" + \
+           struct.pack("<HH", 1920 | 0x4000, 1080 | 0x8000) + bytes(10)
+    assert read_wxh(write(tmp_path, riff_webp(b"VP8 ", body))) == (1920, 1080)
+
+
+def test_read_wxh_webp_lossless(tmp_path):
+    bits = (1920 - 1) | (1080 - 1) << 14
+    body = b"\x2f" + struct.pack("<I", bits) + bytes(10)
+    assert read_wxh(write(tmp_path, riff_webp(b"VP8L", body))) == (1920, 1080)
+
+
+def test_read_wxh_webp_extended(tmp_path):
+    body = bytes(4) + (6000 - 1).to_bytes(3, "little") + \
+           (4000 - 1).to_bytes(3, "little")
+    assert read_wxh(write(tmp_path, riff_webp(b"VP8X", body))) == (6000, 4000)
@@ -1,10 +1,15 @@
 import os
+import threading
 from pathlib import Path
-from unittest.mock import patch, sentinel, Mock, mock_open, call
+from unittest.mock import patch, sentinel, Mock, MagicMock, mock_open, call
 
 import pytest
 
-from compressor import ImgConvertor, CompressorException
+import common_funcs as cmn
+import compressor
+from checkpoint import Checkpoint
+from compressor import ImgConvertor, CompressorException, Variant, CmdChain, \
+    PlanNode, UploadOptions
 
 __TEST_ALLDIRS = [(43023, "NotAnOption1"), (3841, "NotAnOption2"), (21841, "NotAnOption3")]
 
@@ -23,6 +28,37 @@ def test_ImgConvertor():
     assert img_processor.all_dirs == []
 
 
+@patch("compressor.Path", autospec=True)
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True)
+def test_decode_source(mock_run_shell, mock_path):
+    img_processor = ImgConvertor("../par1/tests/foobar.samp", [(42, 65)], "/x/y/z/")
+    img_processor.stem_name = "foobar"
+    assert img_processor.decode_source() == "/x/y/z/foobar.mpc"
+    mock_run_shell.assert_called_once_with(
+        ["convert", "../par1/tests/foobar.samp", "/x/y/z/foobar.mpc"])
+    assert img_processor.src_img == "/x/y/z/foobar.mpc"
+    img_processor.widths_and_heights = [(42, 65)]
+    chains = img_processor.get_cmd_chains(
+        Variant(5, "tif", "desc", "do {src_img}", ["do {src_img}"]),
+        "/x/y/z/tif_q5_desc")
+    assert [chain.cmds[0][1] for chain in chains] == ["/x/y/z/foobar.mpc"] * 2
+    mock_path.reset_mock()
+    img_processor.remove_decoded_source()
+    mock_path.assert_has_calls([
+        call("/x/y/z/foobar.mpc"), call().unlink(missing_ok=True),
+        call("/x/y/z/foobar.mpc"), call().with_suffix(".cache"),
+        call().with_suffix().unlink(missing_ok=True)])
+    assert img_processor.src_img == img_processor.img_name
+
+
+@patch("compressor.Path", autospec=True)
+def test_remove_decoded_source_undecoded(mock_path):
+    img_processor, subdir_root = get_foobar_processor()
+    mock_path.reset_mock()
+    img_processor.remove_decoded_source()
+    mock_path.assert_not_called()
+
+
 def test_extract_final_dir_and_suffix():
     img_processor, subdir_root = get_foobar_processor()
     sequestering_subdir = "img_magickhappens/"
@@ -31,6 +67,10 @@ def test_extract_final_dir_and_suffix():
         fqdir_name)
     assert final_dir == sequestering_subdir
     assert final_suffix == "img"
+    for suffix in ("avif", "jxl"):
+        assert img_processor.extract_final_dir_and_suffix(os.path.join(
+            subdir_root, suffix + "_q60_inc_resize_effort9")) == \
+            (suffix + "_q60_inc_resize_effort9", suffix)
 
 
 def test_print_summary():
@@ -40,6 +80,66 @@ def test_print_summary():
     assert size_list == sorted(__TEST_ALLDIRS)
 
 
+def test_print_summary_scores(capsys):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.all_dirs = [(2048, "/x/y/z/webp_q5_a"), (1024, "/x/y/z/png_q5_a")]
+    img_processor.scores = {"/x/y/z/webp_q5_a": {
+        "full": compressor.Score(0.99, 40.0),
+        "42x65": compressor.Score(0.97, 45.0)}}
+    img_processor.print_summary()
+    assert capsys.readouterr().out == (
+        " 0: 1KB, png_q5_a\n"
+        " 1: 2KB, webp_q5_a, SSIM 0.9700, 40.0dB\n")
+    img_processor.scores["/x/y/z/png_q5_a"] = {"full": compressor.Score(1.0, None)}
+    assert img_processor.describe_score("/x/y/z/png_q5_a") == ", SSIM 1.0000, lossless"
+
+
+def test_score_all():
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.widths_and_heights = [(42, 65)]
+    img_processor.all_dirs = [(2048, "/x/y/z/webp_q5_a"), (1024, "/x/y/z/png_q5_a")]
+    img_processor.scores = {"/x/y/z/png_q5_a": {"full": sentinel.scored}}
+    img_processor.scorer = Mock()
+    img_processor.scorer.score.side_effect = lambda img: img
+    img_processor.score_all(jobs=2)
+    assert img_processor.scores == {
+        "/x/y/z/png_q5_a": {
+            "full": sentinel.scored,
+            "42x65": "/x/y/z/png_q5_a/foobar-42x65.png"},
+        "/x/y/z/webp_q5_a": {
+            "full": "/x/y/z/webp_q5_a/foobar.webp",
+            "42x65": "/x/y/z/webp_q5_a/foobar-42x65.webp"}}
+
+
+@patch("compressor.Scorer", autospec=True)
+def test_use_scorer(mock_scorer):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.src_img = "/x/y/z/foobar.mpc"
+    img_processor.use_scorer()
+    mock_scorer.assert_called_once_with("../par1/tests/foobar.samp")
+    assert img_processor.scorer == mock_scorer.return_value
+
+
+def test_write_manifest():
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.all_dirs = [(2048, "/x/y/z/webp_q5_a"), (1024, "/x/y/z/png_q5_a")]
+    img_processor.scores = {"/x/y/z/webp_q5_a": {"full": compressor.Score(0.99, None)}}
+    img_processor.encoded_by = {"/x/y/z/webp_q5_a": "cwebp"}
+    img_processor.encode_s = {"/x/y/z/webp_q5_a": 1.5}
+    with patch("builtins.open", mock_open()) as mocked_open:
+        with patch("compressor.json.dump", autospec=True) as mock_dump:
+            img_processor.write_manifest("foo.json")
+    mocked_open.assert_called_once_with("foo.json", "w")
+    assert mock_dump.call_args.args[0] == {
+        "source": "../par1/tests/foobar.samp",
+        "variants": [
+            {"dir": "/x/y/z/png_q5_a", "bytes": 1024, "encoder": None,
+             "encode_s": None, "scores": {}},
+            {"dir": "/x/y/z/webp_q5_a", "bytes": 2048, "encoder": "cwebp",
+             "encode_s": 1.5, "scores": {"full": {"ssim": 0.99, "psnr": None}}}],
+        "selection": None}
+
+
 def test_select_one():
     img_processor, subdir_root = get_foobar_processor()
     img_processor.all_dirs = __TEST_ALLDIRS
@@ -48,6 +148,26 @@ def test_select_one():
     with patch("builtins.input", side_effect = ['42', '1']) as mocked_open:
         chosen_dir = img_processor.select_one()
     assert chosen_dir == sorted_all_dirs[1][1]
+    assert img_processor.selection == {
+        "dir": chosen_dir, "reason": "chosen interactively"}
+
+
+def test_auto_select():
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.all_dirs = [(2048, "/x/y/z/webp_q5_a"), (1024, "/x/y/z/png_q5_a"),
+                              (512, "/x/y/z/png_q2_a")]
+    img_processor.scores = {
+        "/x/y/z/webp_q5_a": {"full": compressor.Score(0.99, 40.0)},
+        "/x/y/z/png_q5_a": {"full": compressor.Score(0.98, 38.0)},
+        "/x/y/z/png_q2_a": {"full": compressor.Score(0.90, 30.0)}}
+    policy = compressor.SelectionPolicy(min_ssim=0.95)
+    assert img_processor.auto_select(policy) == "/x/y/z/png_q5_a"
+    assert img_processor.selection == {
+        "dir": "/x/y/z/png_q5_a",
+        "reason": "2 of 3 candidates met SSIM >= 0.95; smallest chosen"}
+    policy = compressor.SelectionPolicy(min_ssim=0.999)
+    with pytest.raises(CompressorException):
+        img_processor.auto_select(policy)
 
 
 def test_select_one_fails_uninitialised():
@@ -90,6 +210,777 @@ def test_transform_to_dir(mock_split_cmd, mock_run_shell, mock_path):
             img_processor.subdir_root, "{}_q{}_{}".format(suffix, q, descriptive))
 
 
+@patch("compressor.ImgConvertor.transform_to_dir", autospec=True)
+def test_transform_all_serial(mock_transform):
+    img_processor, subdir_root = get_foobar_processor()
+    variants = [Variant(5, "tif", "one", "do foo", []),
+                Variant(6, "tif", "two", "do bar", ["do nada"])]
+    img_processor.transform_all(variants)
+    mock_transform.assert_has_calls([
+        call(img_processor, *variants[0]),
+        call(img_processor, *variants[1])
+    ])
+
+
+def test_get_cmd_chains():
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.widths_and_heights = [(42, 65), (84, 130)]
+    variant = Variant(5, "tif", "desc", "do {src_img} {dest_img}",
+                      ["shrink {w}x{h} {src_img} {tmp_img}",
+                       "do {tmp_img} {resized_img}"])
+    subdir_name = img_processor.get_subdir_name(5, "tif", "desc")
+    chains = img_processor.get_cmd_chains(variant, subdir_name)
+    assert chains[0] == CmdChain(
+        [["do", "../par1/tests/foobar.samp", "/x/y/z/tif_q5_desc/foobar.tif"]], [])
+    tmp_img = "/x/y/z/tif_q5_desc/tmp-42x65.png"
+    assert chains[1] == CmdChain([
+        ["shrink", "42x65", "../par1/tests/foobar.samp", tmp_img],
+        ["do", tmp_img, "/x/y/z/tif_q5_desc/foobar-42x65.tif"]
+    ], [tmp_img, "/x/y/z/tif_q5_desc/tmp2-42x65.png"])
+    assert chains[2].cmds[1] == [
+        "do", "/x/y/z/tif_q5_desc/tmp-84x130.png",
+        "/x/y/z/tif_q5_desc/foobar-84x130.tif"]
+
+
+@patch("compressor.shutil.rmtree", autospec=True)
+@patch("compressor.Path", autospec=True)
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True)
+def test_transform_all_pooled(mock_run_shell, mock_path, mock_rmtree):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.widths_and_heights = [(42, 65), (84, 130)]
+    img_processor.count_bytes_in_subdir = Mock(side_effect=[30, 20, 10])
+    variants = [Variant(q, "tif", "desc", "do {q} {dest_img}",
+                        ["do {w}x{h} {q} {resized_img}"]) for q in (1, 2, 3)]
+    img_processor.transform_all(variants, 4)
+    assert len(mock_run_shell.mock_calls) == 9
+    assert img_processor.all_dirs == [
+        (30, "/x/y/z/tif_q1_desc"), (20, "/x/y/z/tif_q2_desc"),
+        (10, "/x/y/z/tif_q3_desc")]
+    assert img_processor.failed_dirs == []
+    mock_rmtree.assert_not_called()
+
+
+@patch("compressor.shutil.rmtree", autospec=True)
+@patch("compressor.Path", autospec=True)
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True)
+def test_transform_all_pooled_reports_failed_variant(
+        mock_run_shell, mock_path, mock_rmtree, capsys):
+    def fail_q2(split_cmd):
+        if split_cmd[1] == "2":
+            raise RuntimeError("no q2")
+    mock_run_shell.side_effect = fail_q2
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.count_bytes_in_subdir = Mock(side_effect=[30, 10])
+    variants = [Variant(q, "tif", "desc", "do {q} {dest_img}", [])
+                for q in (1, 2, 3)]
+    img_processor.transform_all(variants, 2)
+    assert img_processor.all_dirs == [
+        (30, "/x/y/z/tif_q1_desc"), (10, "/x/y/z/tif_q3_desc")]
+    assert [d for d, _ in img_processor.failed_dirs] == ["/x/y/z/tif_q2_desc"]
+    mock_rmtree.assert_called_once_with("/x/y/z/tif_q2_desc", ignore_errors=True)
+    assert "/x/y/z/tif_q2_desc failed: no q2" in capsys.readouterr().err
+
+
+@patch("compressor.Path", autospec=True)
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True)
+def test_transform_all_pipelined(mock_run_shell, mock_path):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.widths_and_heights = [(42, 65), (84, 130)]
+    img_processor.count_bytes_in_subdir = Mock(side_effect=[30, 20])
+    variants = [Variant(q, "tif", "desc", "convert -q {q} {src_img} {dest_img}",
+                        ["convert -resize {w}x{h} {src_img} {resized_img}"])
+                for q in (1, 2)]
+    img_processor.transform_all(variants, pipeline=True)
+    assert len(mock_run_shell.mock_calls) == 2
+    pipelined = sorted(c.args[0] for c in mock_run_shell.mock_calls)
+    assert pipelined[0].count("-write") == 4
+    assert pipelined[0][-3].startswith("/x/y/z/tif_q1_desc/")
+    assert pipelined[0][-3].endswith("-84x130.tif")
+    assert img_processor.all_dirs == [
+        (30, "/x/y/z/tif_q1_desc"), (20, "/x/y/z/tif_q2_desc")]
+
+
+def test_get_cmd_chains_encoder():
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.widths_and_heights = [(42, 65)]
+    variant = compressor.get_encoder_variants(80, "webp", ["cwebp"])[0]
+    chains = img_processor.get_cmd_chains(variant, "/x/y/z/webp_q80_cwebp")
+    assert chains[0] == CmdChain([
+        ["convert", "-strip", "../par1/tests/foobar.samp",
+         "/x/y/z/webp_q80_cwebp/tmp.png"],
+        ["cwebp", "-quiet", "-m", "6", "-q", "80", "-metadata", "none",
+         "/x/y/z/webp_q80_cwebp/tmp.png", "-o",
+         "/x/y/z/webp_q80_cwebp/foobar.webp"]],
+        ["/x/y/z/webp_q80_cwebp/tmp.png"])
+    assert chains[1].cmds[1][-1] == "/x/y/z/webp_q80_cwebp/foobar-42x65.webp"
+
+
+@patch("compressor.Path", autospec=True)
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True)
+def test_transform_all_pipelined_encoder(mock_run_shell, mock_path, capsys):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.widths_and_heights = [(42, 65)]
+    img_processor.count_bytes_in_subdir = Mock(side_effect=[30, 20])
+    variants = [compressor.get_format_variants(80, "webp")[0],
+                *compressor.get_encoder_variants(80, "webp", ["cwebp"])]
+    img_processor.transform_all(variants, pipeline=True)
+    # One convert pipelined, the encoder's four commands apart.
+    assert len(mock_run_shell.mock_calls) == 5
+    assert sorted(c.args[0][0] for c in mock_run_shell.mock_calls) == [
+        "convert", "convert", "convert", "cwebp", "cwebp"]
+    assert img_processor.encoded_by == {
+        "/x/y/z/webp_q80_inc_resize": "imagemagick",
+        "/x/y/z/webp_q80_cwebp": "cwebp"}
+    assert set(img_processor.encode_s) == set(img_processor.encoded_by)
+    img_processor.encode_s = {"/x/y/z/webp_q80_inc_resize": 1.25,
+                              "/x/y/z/webp_q80_cwebp": 0.5}
+    img_processor.print_summary()
+    assert capsys.readouterr().out == (
+        " 0: 0KB, webp_q80_cwebp, by cwebp in 0.5s\n"
+        " 1: 0KB, webp_q80_inc_resize, by imagemagick in 1.2s\n")
+    assert img_processor.get_gallery_list([], 640, 480)[0][0] == \
+           "0KB webp_q80_cwebp: 640x480, by cwebp in 0.5s"
+
+
+@patch("compressor.get_encoder_version", autospec=True, return_value="cwebp 1.2")
+@patch("compressor.cmn.get_file_sha256", autospec=True, return_value="srchash")
+@patch("compressor.cmn.get_imagemagick_version", autospec=True, return_value="IM")
+def test_get_output_key_by_encoder(mock_version, mock_sha256, mock_encoder_version,
+                                   tmp_path):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.use_output_cache(str(tmp_path / "cache"), 1000)
+    split_cmd = ["cwebp", "-q", "5", "tmp.png", "-o", "out.webp"]
+    by_cwebp = img_processor.get_output_key(split_cmd)
+    mock_encoder_version.assert_called_once_with("cwebp")
+    mock_encoder_version.return_value = "cwebp 1.3"
+    assert img_processor.get_output_key(split_cmd) != by_cwebp
+
+
+def test_transform_all_pipelined_matches_separate(tmp_path):
+    """Needs ImageMagick, like test_common_funcs.test_get_img_wxh."""
+    img_name = str(Path(__file__).parent / "si_tests" / "white_400x300.png")
+    separate = ImgConvertor(img_name, [(300, 225)], str(tmp_path / "separate"))
+    pipelined = ImgConvertor(img_name, [(300, 225)], str(tmp_path / "pipelined"))
+    variants = compressor.get_variants(False, False, False, False)
+    separate.transform_all(variants)
+    pipelined.transform_all(variants, pipeline=True)
+    # Any failure would leave nothing to compare.
+    assert pipelined.failed_dirs == []
+    assert len(pipelined.all_dirs) == len(separate.all_dirs) == len(variants)
+    for (_, sep_dir), (_, pipe_dir) in zip(separate.all_dirs, pipelined.all_dirs):
+        for entry in os.scandir(sep_dir):
+            assert Path(entry.path).read_bytes() == \
+                   (Path(pipe_dir) / entry.name).read_bytes(), entry.path
+
+
+def test_get_cmd_chains_shared_resizes():
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.widths_and_heights = [(42, 65)]
+    cache = img_processor.use_resize_cache(1024)
+    assert cache.cache_dir == "/x/y/z/resize_cache"
+    variant = compressor.get_variants(True, False, True, False, True)[1]
+    assert variant.descriptive == "aft_resize"
+    chains = img_processor.get_cmd_chains(variant, "/x/y/z/png_q255_aft_resize")
+    assert chains[0].resizes == []
+    assert chains[1].resizes == [(42, 65)]
+    assert chains[1].cmds[0] == [
+        "convert", "-strip", "/x/y/z/resize_cache/foobar-42x65.mpc",
+        "/x/y/z/png_q255_aft_resize/tmp-42x65.png"]
+
+
+@patch("compressor.cmn.get_psnr", autospec=True, return_value=41.0)
+@patch("compressor.ImgConvertor.transform_all", autospec=True)
+def test_measure_variant(mock_transform_all, mock_psnr):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.all_dirs = [(123, "/x/y/z/tif_q5_desc")]
+    variant = Variant(5, "tif", "desc", "", [])
+    assert img_processor.measure_variant(variant, 3) == (123, None)
+    mock_transform_all.assert_called_once_with(img_processor, [variant], 3, False, False)
+    assert img_processor.measure_variant(variant, score=True) == (123, 41.0)
+    mock_psnr.assert_called_once_with(
+        "../par1/tests/foobar.samp", "/x/y/z/tif_q5_desc/foobar.tif")
+    img_processor.all_dirs = []
+    with pytest.raises(CompressorException):
+        img_processor.measure_variant(variant)
+
+
+@patch("compressor.shutil.rmtree", autospec=True)
+def test_search_qualities(mock_rmtree):
+    img_processor, subdir_root = get_foobar_processor()
+
+    def measure_variant(variant, *args):
+        n_bytes = 10 * variant.q
+        img_processor.all_dirs.append((n_bytes, img_processor.get_subdir_name(
+            variant.q, variant.suffix, variant.descriptive)))
+        return compressor.Measurement(n_bytes, None)
+    img_processor.measure_variant = measure_variant
+    families = [
+        compressor.VariantFamily(lambda q: Variant(q, "tif", "a", "", []), 1, 100),
+        compressor.VariantFamily(lambda q: Variant(q, "bmp", "b", "", []), 90, 100)]
+    found = img_processor.search_qualities(families, max_bytes=550)
+    assert found == [Variant(55, "tif", "a", "", [])]
+    assert img_processor.all_dirs == [(550, "/x/y/z/tif_q55_a")]
+    assert call("/x/y/z/bmp_q90_b") in mock_rmtree.mock_calls
+    assert call("/x/y/z/tif_q100_a") in mock_rmtree.mock_calls
+
+
+@patch("compressor.Path", autospec=True)
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True)
+def test_complete_variant(mock_run_shell, mock_path):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.widths_and_heights = [(42, 65)]
+    img_processor.all_dirs = [(10, "/x/y/z/tif_q1_desc"), (20, "/x/y/z/tif_q2_desc")]
+    img_processor.count_bytes_in_subdir = Mock(return_value=50)
+    variants = [Variant(q, "tif", "desc", "do {q} {dest_img}",
+                        ["do {w}x{h} {q} {resized_img}"]) for q in (1, 2)]
+    img_processor.complete_variant(
+        "/x/y/z/tif_q2_desc", variants, [(42, 65), (84, 130), (168, 260)], 2)
+    assert sorted(c.args[0][:3] for c in mock_run_shell.mock_calls) == [
+        ["do", "168x260", "2"], ["do", "84x130", "2"]]
+    assert img_processor.widths_and_heights == [(42, 65), (84, 130), (168, 260)]
+    assert img_processor.all_dirs == [(10, "/x/y/z/tif_q1_desc"), (50, "/x/y/z/tif_q2_desc")]
+    img_processor.count_bytes_in_subdir.assert_called_once_with("/x/y/z/tif_q2_desc")
+
+
+@patch("compressor.Path", autospec=True)
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True)
+def test_reencode_variant(mock_run_shell, mock_path, capsys):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.widths_and_heights = [(42, 65), (84, 130)]
+    img_processor.all_dirs = [(10240, "/x/y/z/tif_q1_desc"), (20480, "/x/y/z/tif_q2_desc")]
+    img_processor.count_bytes_in_subdir = Mock(side_effect=[20480, 15360])
+    variants = [Variant(q, "tif", "desc", "do max {q} {dest_img}",
+                        ["do max {w}x{h} {q} {resized_img}"]) for q in (1, 2)]
+    img_processor.reencode_variant("/x/y/z/tif_q2_desc", variants, 2)
+    assert sorted(c.args[0][:3] for c in mock_run_shell.mock_calls) == [
+        ["do", "max", "2"], ["do", "max", "42x65"], ["do", "max", "84x130"]]
+    assert img_processor.all_dirs == [(10240, "/x/y/z/tif_q1_desc"), (15360, "/x/y/z/tif_q2_desc")]
+    assert capsys.readouterr().out.startswith(
+        "Encoded tif_q2_desc again, at max effort, 20KB to 15KB in ")
+
+
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True)
+def test_reencode_variant_resumed(mock_run_shell, tmp_path):
+    img_processor = ImgConvertor("foobar.png", [(42, 65)], str(tmp_path) + "/")
+    img_processor.checkpoint = Checkpoint(
+        str(tmp_path / "checkpoint.json"), "src", "plan")
+    chosen_dir = str(tmp_path / "tif_q1_desc")
+    Path(chosen_dir).mkdir()
+    img_processor.all_dirs = [(0, chosen_dir)]
+    variants = [Variant(1, "tif", "desc", "do {q} {dest_img}",
+                        ["do {w}x{h} {q} {resized_img}"])]
+    img_processor.reencode_variant(chosen_dir, variants)
+    assert mock_run_shell.call_count == 2
+    assert img_processor.checkpoint.state["reencoded"] == chosen_dir
+    # Encoded again already, by the run being resumed.
+    img_processor.reencode_variant(chosen_dir, variants)
+    assert mock_run_shell.call_count == 2
+
+
+@patch("compressor.Path", autospec=True)
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True,
+       side_effect=RuntimeError("no space"))
+def test_complete_variant_fails(mock_run_shell, mock_path):
+    img_processor, subdir_root = get_foobar_processor()
+    variants = [Variant(1, "tif", "desc", "do {q} {dest_img}",
+                        ["do {w}x{h} {q} {resized_img}"])]
+    with pytest.raises(CompressorException) as cerr:
+        img_processor.complete_variant("/x/y/z/tif_q1_desc", variants, [(42, 65)])
+    assert "no space" in str(cerr)
+
+
+@patch("compressor.shutil.copyfile", autospec=True)
+@patch("compressor.Path", autospec=True)
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True)
+def test_transform_all_deduped(mock_run_shell, mock_path, mock_copyfile):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.widths_and_heights = [(42, 65)]
+    img_processor.count_bytes_in_subdir = Mock(side_effect=[30, 20])
+    variants = [
+        Variant(1, "tif", "inc", "do {q} {dest_img}",
+                ["do {w}x{h} {q} {resized_img}"]),
+        Variant(1, "tif", "aft", "do {q} {dest_img}",
+                ["do {w}x{h} {tmp_img}", "do {q} {tmp_img} {resized_img}"])]
+    plan, subdir_names = img_processor.plan_all(variants)
+    assert plan.describe() == "5 commands planned, 4 after deduplication."
+    mock_run_shell.assert_not_called()
+    img_processor.transform_all(variants, dedupe=True)
+    assert len(mock_run_shell.mock_calls) == 4
+    mock_copyfile.assert_called_once()
+    assert mock_copyfile.call_args.args[1].startswith("/x/y/z/tif_q1_aft/")
+    assert img_processor.all_dirs == [
+        (30, "/x/y/z/tif_q1_inc"), (20, "/x/y/z/tif_q1_aft")]
+    mock_path.assert_has_calls([
+        call("/x/y/z/tif_q1_aft/tmp-42x65.png"), call().unlink(missing_ok=True)])
+
+
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True)
+def test_run_plan_node_pins_resizes(mock_run_shell):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.resize_cache = MagicMock()
+    img_processor.resize_cache.path_to.return_value = "resized.mpc"
+    node = PlanNode(0, ["first", "resized.mpc", "out"], "out", [(42, 65)])
+    img_processor.run_plan_node(node)
+    img_processor.resize_cache.resized.assert_called_once_with(
+        img_processor.src_img, 42, 65)
+    img_processor.resize_cache.resized.return_value.__enter__.assert_called_once()
+    mock_run_shell.assert_called_once_with(["first", "resized.mpc", "out"])
+
+
+@patch("compressor.cmn.get_file_sha256", autospec=True, return_value="srchash")
+@patch("compressor.cmn.get_imagemagick_version", autospec=True, return_value="IM")
+def test_run_cached(mock_version, mock_sha256, tmp_path):
+    img_processor, subdir_root = get_foobar_processor()
+    output_cache = img_processor.use_output_cache(str(tmp_path / "cache"), 1000)
+    assert output_cache.im_version == "IM"
+    assert output_cache.max_bytes == 1000
+    mock_sha256.assert_called_once_with("../par1/tests/foobar.samp")
+    tmp_img, out_img = str(tmp_path / "tmp.png"), str(tmp_path / "out.webp")
+    chain = [["convert", "-resize", "4x3", img_processor.img_name, tmp_img],
+             ["convert", "-quality", "5", tmp_img, out_img]]
+
+    def run_cmd(split_cmd):
+        Path(split_cmd[-1]).write_text(" ".join(split_cmd[1:-1]))
+        return "ok"
+    mock_run = Mock(side_effect=run_cmd)
+    for split_cmd in chain:
+        assert img_processor.run_cached(split_cmd, mock_run) == "ok"
+    keys = dict(img_processor.output_keys)
+    assert keys[out_img] == output_cache.key_of(
+        ["convert", "-quality", "5", "made " + keys[tmp_img], "to .webp"])
+    # The tmp image isn't cached, only what's made from it.
+    assert os.listdir(output_cache.cache_dir) == [keys[out_img] + ".webp"]
+    # Elsewhere, from another name of the same source, the output is reused.
+    img_processor.output_keys = {}
+    img_processor.src_img = "elsewhere/foobar.samp"
+    os.remove(out_img)
+    for split_cmd, result in zip(chain, ["ok", ""]):
+        split_cmd[-2:] = [img_processor.src_img if split_cmd[-2] == img_processor.img_name
+                          else split_cmd[-2], split_cmd[-1]]
+        assert img_processor.run_cached(split_cmd, mock_run) == result
+    assert mock_run.call_count == 3
+    assert Path(out_img).read_text() == "-quality 5 " + tmp_img
+    assert img_processor.output_keys == keys
+    # A pipelined command isn't cached.
+    assert img_processor.run_cached(["convert", "x", "-write", out_img, "null:"],
+                                    Mock(return_value="ok")) == "ok"
+    assert "null:" not in img_processor.output_keys
+
+
+@patch("engines.PIL", None)
+def test_use_engine_needs_pillow():
+    img_processor, subdir_root = get_foobar_processor()
+    with pytest.raises(CompressorException) as cerr:
+        img_processor.use_engine("pillow")
+    assert "pip install pillow" in str(cerr)
+
+
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True)
+def test_run_plan_node_by_engine(mock_run_shell):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.engine = Mock()
+    img_processor.run_plan_node(PlanNode(0, ["convert", "in", "out"], "out", []))
+    img_processor.engine.run.assert_called_once_with(["convert", "in", "out"])
+    mock_run_shell.assert_not_called()
+    img_processor.remove_decoded_source()
+    img_processor.engine.release.assert_called_once_with()
+
+
+@patch("compressor.shutil.copyfile", autospec=True)
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True)
+def test_run_plan_node_scores(mock_run_shell, mock_copyfile):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.widths_and_heights = [(42, 65)]
+    img_processor.scorer = Mock()
+    img_processor.scorer.score.side_effect = lambda img: "score of " + img
+    for subdir_name in ["/x/y/z/webp_q5_a", "/x/y/z/webp_q5_b"]:
+        for size, img in img_processor.get_images(subdir_name).items():
+            img_processor.scored_as[img] = (subdir_name, size)
+    resized = "/x/y/z/webp_q5_a/foobar-42x65.webp"
+    full = "/x/y/z/webp_q5_a/foobar.webp"
+    pipelined = PlanNode(0, ["convert", "src", "(", "mpr:src", "-resize",
+                             "42x65", "-write", resized, "+delete", ")",
+                             "-write", "tmp.png", "+delete", full], full, [])
+    img_processor.run_plan_node(pipelined)
+    assert img_processor.scores == {"/x/y/z/webp_q5_a": {
+        "full": "score of " + full, "42x65": "score of " + resized}}
+    # Merged, the copy takes the same score, and a tmp image none.
+    merged = PlanNode(1, ["convert", "src", resized], resized, [])
+    merged.outputs.append("/x/y/z/webp_q5_b/foobar-42x65.webp")
+    img_processor.run_plan_node(merged)
+    assert img_processor.scores["/x/y/z/webp_q5_b"] == {
+        "42x65": "score of " + resized}
+    img_processor.run_plan_node(PlanNode(2, ["convert", "src", "tmp.png"],
+                                         "tmp.png", []))
+    assert img_processor.scorer.score.call_count == 3
+
+
+@patch("compressor.cmn.get_file_sha256", autospec=True, return_value="srchash")
+@patch("compressor.cmn.get_imagemagick_version", autospec=True, return_value="IM")
+def test_get_output_key_by_engine(mock_version, mock_sha256, tmp_path):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.use_output_cache(str(tmp_path / "cache"), 1000)
+    split_cmd = ["convert", "-quality", "5", img_processor.img_name, "out.webp"]
+    by_imagemagick = img_processor.get_output_key(split_cmd)
+    img_processor.engine = Mock(version="Pillow 1")
+    by_pillow = img_processor.get_output_key(split_cmd)
+    img_processor.engine = Mock(version="Pillow 2")
+    assert len({by_imagemagick, by_pillow,
+                img_processor.get_output_key(split_cmd)}) == 3
+
+
+@patch("compressor.cmn.get_file_sha256", autospec=True, return_value="srchash")
+def test_resume_checkpoint(mock_sha256, tmp_path):
+    subdir_root = str(tmp_path) + "/"
+    variants = [Variant(5, "tif", "a", "", []), Variant(6, "tif", "a", "", [])]
+    first = ImgConvertor("foobar.samp", [(42, 65)], subdir_root)
+    first.use_checkpoint(variants)
+    Path(subdir_root, "tif_q5_a").mkdir()
+    first.list_variant(123, subdir_root + "tif_q5_a")
+    assert first.all_dirs == [(123, subdir_root + "tif_q5_a")]
+
+    resumed = ImgConvertor("foobar.samp", [(42, 65)], subdir_root)
+    resumed.use_checkpoint(variants, resume=True)
+    assert resumed.restore_variants(variants) == variants[1:]
+    assert resumed.all_dirs == [(123, subdir_root + "tif_q5_a")]
+    assert not resumed.restore_choice()
+    resumed.record_choice(subdir_root + "tif_q5_a", "because")
+
+    resumed = ImgConvertor("foobar.samp", [(42, 65)], subdir_root)
+    resumed.use_checkpoint(variants, resume=True)
+    assert resumed.restore_choice()
+    assert resumed.all_dirs == [(123, subdir_root + "tif_q5_a")]
+    with patch("builtins.input") as mock_input:
+        assert resumed.select_one() == subdir_root + "tif_q5_a"
+    mock_input.assert_not_called()
+
+    # Not resuming, or with other variants, starts over.
+    for resume, other_variants in [(False, variants), (True, variants[:1])]:
+        other = ImgConvertor("foobar.samp", [(42, 65)], subdir_root)
+        other.use_checkpoint(other_variants, resume)
+        assert other.restore_variants(other_variants) == other_variants
+
+
+@patch("compressor.Path", autospec=True)
+@patch("compressor.get_client", autospec=True)
+@patch("compressor.execute_remotely", autospec=True, return_value=(sentinel.out, []))
+def test_replace_generated_sizes_resumed(mock_execute_remotely, mock_get_client, mock_path):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.widths_and_heights = [(42, 65), (84, 130)]
+    img_processor.path_to_resized_img = Mock(return_value=sentinel.src_name)
+    img_processor.checkpoint = Mock()
+    mock_path.return_value.parent.resolve.return_value = "/up/2022/07"
+    mock_path.return_value.stem = "the-uploaded"
+    img_processor.checkpoint.state = {"replaced": ["/up/2022/07/the-uploaded-42x65.bmp"]}
+    img_processor.replace_generated_sizes(
+        sentinel.host, 666, sentinel.credentials, "bmp", "/up/2022/07/the-uploaded.bmp")
+    mock_get_client.return_value.open_sftp.return_value.put.assert_called_once_with(
+        str(mock_path.return_value.resolve.return_value),
+        "/tmp/stagingtmp/the-uploaded-84x130.bmp")
+    img_processor.checkpoint.replaced.assert_called_once_with(
+        "/up/2022/07/the-uploaded-84x130.bmp")
+
+
+@patch("compressor.Path", autospec=True)
+@patch("compressor.get_client", autospec=True)
+@patch("compressor.install_files", autospec=True, return_value=(
+    ["/up/2022/07/the-uploaded-42x65.bmp"], ["failed to install /up/2022/07/the-uploaded-84x130.bmp"]))
+@patch("compressor.execute_remotely", autospec=True, return_value=(sentinel.out, []))
+def test_replace_generated_sizes_one_trip(
+        mock_execute_remotely, mock_install_files, mock_get_client, mock_path):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.upload_options = UploadOptions(one_trip=True)
+    img_processor.widths_and_heights = [(42, 65), (84, 130)]
+    img_processor.path_to_resized_img = Mock(return_value=sentinel.src_name)
+    img_processor.checkpoint = Mock()
+    img_processor.checkpoint.state = {"replaced": []}
+    mock_path.return_value.parent.resolve.return_value = "/up/2022/07"
+    mock_path.return_value.stem = "the-uploaded"
+    with pytest.raises(RuntimeError) as rterr:
+        img_processor.replace_generated_sizes(
+            sentinel.host, 666, sentinel.credentials, "bmp", "/up/2022/07/the-uploaded.bmp")
+    assert "failed to install /up/2022/07/the-uploaded-84x130.bmp" in str(rterr)
+    # Only the mkdir, the installs are all in the one install_files.
+    mock_execute_remotely.assert_called_once()
+    assert mock_get_client.return_value.open_sftp.return_value.put.call_count == 2
+    mock_install_files.assert_called_once_with(mock_get_client.return_value, [
+        ("/tmp/stagingtmp/the-uploaded-42x65.bmp", "/up/2022/07/the-uploaded-42x65.bmp"),
+        ("/tmp/stagingtmp/the-uploaded-84x130.bmp", "/up/2022/07/the-uploaded-84x130.bmp")])
+    img_processor.checkpoint.replaced.assert_called_once_with(
+        "/up/2022/07/the-uploaded-42x65.bmp")
+    mock_get_client.return_value.close.assert_called_once_with()
+
+
+@patch("compressor.get_client", autospec=True)
+@patch("compressor.put_tar", autospec=True)
+@patch("compressor.execute_remotely", autospec=True, return_value=(sentinel.out, []))
+def test_replace_generated_sizes_tar(mock_execute_remotely, mock_put_tar, mock_get_client):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.upload_options = UploadOptions(transport="tar")
+    img_processor.widths_and_heights = [(42, 65), (84, 130)]
+    img_processor.path_to_resized_img = Mock(return_value="/x/y/z/a.bmp")
+    img_processor.replace_generated_sizes(
+        sentinel.host, 666, sentinel.credentials, "bmp", "/up/2022/07/the-uploaded.bmp")
+    mock_get_client.return_value.open_sftp.assert_not_called()
+    mock_put_tar.assert_called_once_with(
+        mock_get_client.return_value, "/tmp/stagingtmp", [
+            ("/x/y/z/a.bmp", "the-uploaded-42x65.bmp"),
+            ("/x/y/z/a.bmp", "the-uploaded-84x130.bmp")])
+    # No mkdir, only a move apiece.
+    assert mock_execute_remotely.call_count == 2
+    assert "sudo mv /tmp/stagingtmp/the-uploaded-84x130.bmp " \
+           "/up/2022/07/the-uploaded-84x130.bmp" in mock_execute_remotely.call_args.args[1]
+    mock_get_client.return_value.close.assert_called_once_with()
+
+
+@patch("compressor.get_client", autospec=True)
+@patch("compressor.put_concurrently", autospec=True)
+@patch("compressor.execute_remotely", autospec=True, return_value=(sentinel.out, []))
+def test_replace_generated_sizes_concurrently(
+        mock_execute_remotely, mock_put_concurrently, mock_get_client):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.upload_options = UploadOptions(
+        sftp_channels=4, sftp_window_kb=8192)
+    img_processor.widths_and_heights = [(42, 65), (84, 130)]
+    img_processor.path_to_resized_img = Mock(return_value="/x/y/z/a.bmp")
+    img_processor.replace_generated_sizes(
+        sentinel.host, 666, sentinel.credentials, "bmp", "/up/2022/07/the-uploaded.bmp")
+    mock_get_client.return_value.open_sftp.assert_not_called()
+    mock_put_concurrently.assert_called_once_with(
+        mock_get_client.return_value, [
+            ("/x/y/z/a.bmp", "/tmp/stagingtmp/the-uploaded-42x65.bmp"),
+            ("/x/y/z/a.bmp", "/tmp/stagingtmp/the-uploaded-84x130.bmp")],
+        4, 8192 * 1024, None)
+    # The mkdir, then a move apiece.
+    assert mock_execute_remotely.call_count == 3
+
+
+@patch("compressor.get_client", autospec=True)
+@patch("compressor.get_remote_sha256s", autospec=True)
+@patch("compressor.ImgConvertor.stage_and_install", autospec=True)
+def test_replace_generated_sizes_delta(
+        mock_stage_and_install, mock_get_remote_sha256s, mock_get_client, tmp_path):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.upload_options = UploadOptions(delta=True)
+    img_processor.checkpoint = Mock()
+    img_processor.checkpoint.state = {"replaced": []}
+    img_processor.widths_and_heights = [(42, 65), (84, 130)]
+    sizes = {42: tmp_path / "a-42.bmp", 84: tmp_path / "a-84.bmp"}
+    sizes[42].write_bytes(b"same" * 256)
+    sizes[84].write_bytes(b"changed")
+    img_processor.path_to_resized_img = lambda w, h, suffix: str(sizes[w])
+    mock_get_remote_sha256s.return_value = {
+        "/up/2022/07/the-uploaded-42x65.bmp": cmn.get_file_sha256(str(sizes[42])),
+        "/up/2022/07/the-uploaded-84x130.bmp": "0123"}
+    img_processor.replace_generated_sizes(
+        sentinel.host, 666, sentinel.credentials, "bmp", "/up/2022/07/the-uploaded.bmp")
+    mock_get_remote_sha256s.assert_called_once_with(
+        mock_get_client.return_value,
+        ["/up/2022/07/the-uploaded-42x65.bmp", "/up/2022/07/the-uploaded-84x130.bmp"])
+    mock_stage_and_install.assert_called_once_with(
+        img_processor, mock_get_client.return_value, [
+            (str(sizes[84]), "/tmp/stagingtmp/the-uploaded-84x130.bmp",
+             "/up/2022/07/the-uploaded-84x130.bmp")])
+    img_processor.checkpoint.replaced.assert_called_once_with(
+        "/up/2022/07/the-uploaded-42x65.bmp")
+
+    # All unchanged, nothing to stage.
+    mock_stage_and_install.reset_mock()
+    mock_get_remote_sha256s.return_value[
+        "/up/2022/07/the-uploaded-84x130.bmp"] = cmn.get_file_sha256(str(sizes[84]))
+    img_processor.replace_generated_sizes(
+        sentinel.host, 666, sentinel.credentials, "bmp", "/up/2022/07/the-uploaded.bmp")
+    mock_stage_and_install.assert_not_called()
+    mock_get_client.return_value.close.assert_called_with()
+
+
+@patch("compressor.ImgConvertor.replace_generated_sizes", autospec=True)
+def test_upload_resumed(mock_replace):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.checkpoint = Mock()
+    img_processor.checkpoint.state = {"media": {
+        "id": 7, "media_details": {"file": "2022/07/foobar.png"}}}
+    uploader = Mock()
+    uploader.get_ssh_conf.return_value = {"wp_uploads": "/up", "username": "u"}
+    uploader.get_host_and_port.return_value = ("host", 22)
+    img_processor.upload("/x/y/z/png_q5_a", sentinel.conf_file, uploader)
+    uploader.get_wp_api.assert_not_called()
+    mock_replace.assert_called_once_with(
+        img_processor, "host", 22, {"username": "u"}, "png",
+        "/up/2022/07/foobar.png", uploader.get_client.return_value, False)
+    img_processor.checkpoint.state = {"media": None}
+    uploader.get_wp_api.return_value.upload_media.return_value.json.return_value = {
+        "id": 8, "media_details": {"file": "2022/07/foobar.png"}, "other": 1}
+    img_processor.upload("/x/y/z/png_q5_a", sentinel.conf_file, uploader)
+    uploader.get_wp_api.return_value.upload_media.assert_called_once_with(
+        "/x/y/z/png_q5_a/foobar.png")
+    img_processor.checkpoint.media_uploaded.assert_called_once_with(
+        {"id": 8, "media_details": {"file": "2022/07/foobar.png"}})
+
+
+def test_get_variant_of():
+    img_processor, subdir_root = get_foobar_processor()
+    variant = img_processor.get_variant_of(subdir_root + "png_q64_aft_resize")
+    assert (variant.q, variant.suffix, variant.descriptive) == (64, "png", "aft_resize")
+    # A full size only variant makes no sizes, so its format's first which does.
+    variant = img_processor.get_variant_of(subdir_root + "webp_q70_no_resize")
+    assert (variant.q, variant.suffix, variant.descriptive) == (70, "webp", "inc_resize")
+    variant = img_processor.get_variant_of(subdir_root + "avif_q50_inc_resize_speed3")
+    assert (variant.q, variant.suffix, variant.descriptive) == (50, "avif", "inc_resize_speed3")
+
+
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True)
+def test_get_variant_of_recorded(mock_run, tmp_path):
+    subdir_root = str(tmp_path) + "/"
+    img_processor = ImgConvertor("foobar.png", [], subdir_root)
+    variant = Variant(70, "webp", "inc_resize", "cwebp {src_img} {dest_img}",
+                      ["convert -strip -resize {w}x{h} {src_img} {tmp_img}",
+                       "cwebp -q {q} {tmp_img} -o {resized_img}"])
+    assert img_processor.restore_variants([variant]) == [variant]
+    assert img_processor.get_variant_of(subdir_root + "webp_q70_inc_resize") \
+        == variant
+    # As encoded again, at another effort.
+    final = variant._replace(scaling_cmds=[
+        *variant.scaling_cmds[:-1], "cwebp -m 6 -q {q} {tmp_img} -o {resized_img}"])
+    (tmp_path / "webp_q70_inc_resize").mkdir()
+    img_processor.reencode_variant(subdir_root + "webp_q70_inc_resize", [final])
+    assert img_processor.get_variant_of(subdir_root + "webp_q70_inc_resize") \
+        == final
+
+
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True)
+def test_make_thumbnail(mock_run, tmp_path):
+    img_processor = ImgConvertor("foobar.png", [(300, 200)], str(tmp_path))
+    subdir_name = str(tmp_path / "webp_q70_inc_resize")
+    assert img_processor.make_thumbnail(subdir_name, 150, 150) == \
+           subdir_name + "/foobar-150x150.webp"
+    mock_run.assert_called_once_with([
+        "convert", "-strip", "-resize", "150x150^", "-gravity", "center",
+        "-extent", "150x150", "-define", "webp:method=6", "-quality", "70",
+        "foobar.png", subdir_name + "/foobar-150x150.webp"])
+
+
+@patch("compressor.cmn.run_shell_cmd_or_raise", autospec=True)
+def test_make_thumbnail_as_chosen(mock_run, tmp_path):
+    img_processor = ImgConvertor("foobar.png", [(300, 200)], str(tmp_path))
+    img_processor.engine = Mock()
+    img_processor.restore_variants([Variant(
+        70, "webp", "x", "", ["convert -strip {resized_src} {tmp_img}",
+                              "cwebp -q {q} {tmp_img} -o {resized_img}"])])
+    subdir_name = str(tmp_path / "webp_q70_x")
+    img_processor.make_thumbnail(subdir_name, 150, 150)
+    mock_run.assert_not_called()
+    tmp_img = img_processor.engine.run.call_args_list[0].args[0][-1]
+    assert img_processor.engine.run.call_args_list == [
+        call(["convert", "-resize", "150x150^", "-gravity", "center",
+              "-extent", "150x150", "-strip", "foobar.png", tmp_img]),
+        call(["cwebp", "-q", "70", tmp_img, "-o",
+              subdir_name + "/foobar-150x150.webp"])]
+
+
+@patch("compressor.execute_remotely", autospec=True, return_value=([], []))
+@patch("compressor.cmn.get_img_wxh", autospec=True, return_value=(1000, 800))
+@patch("compressor.insert_attachment", autospec=True, return_value=(42, "2022/07/foobar-1.png"))
+@patch("compressor.ImgConvertor.stage", autospec=True)
+@patch("compressor.ImgConvertor.make_thumbnail", autospec=True)
+def test_upload_prescaled(mock_make_thumbnail, mock_stage, mock_insert_attachment,
+                          mock_get_img_wxh, mock_execute, tmp_path):
+    img_processor = ImgConvertor("foobar.png", [(300, 240), (768, 614)], str(tmp_path))
+    img_processor.upload_options = UploadOptions(prescaled=True)
+    img_processor.named_sizes = {
+        "medium": (300, 240), "medium_large": (768, 614), "thumbnail": (150, 150)}
+    img_processor.checkpoint = Mock()
+    img_processor.checkpoint.state = {"media": None, "replaced": []}
+    chosen_dir = str(tmp_path / "png_q64_inc_resize")
+    Path(chosen_dir).mkdir()
+    for name, n_bytes in [("foobar.png", 1000), ("foobar-300x240.png", 300),
+                          ("foobar-768x614.png", 768), ("foobar-150x150.png", 150)]:
+        (Path(chosen_dir) / name).write_bytes(b"x" * n_bytes)
+    uploader = Mock()
+    uploader.get_ssh_conf.return_value = {
+        "wp_uploads": "/var/www/html/wp-content/uploads/", "username": "u"}
+    img_processor.upload(chosen_dir, sentinel.conf_file, uploader)
+    uploader.get_wp_api.assert_not_called()
+    mock_make_thumbnail.assert_called_once_with(img_processor, chosen_dir, 150, 150)
+    mock_stage.assert_called_once_with(
+        img_processor, uploader.get_client.return_value, [
+            (chosen_dir + "/foobar.png", "/tmp/stagingtmp/foobar.png"),
+            (chosen_dir + "/foobar-150x150.png", "/tmp/stagingtmp/foobar-150x150.png"),
+            (chosen_dir + "/foobar-300x240.png", "/tmp/stagingtmp/foobar-300x240.png"),
+            (chosen_dir + "/foobar-768x614.png", "/tmp/stagingtmp/foobar-768x614.png")],
+        eager=True)
+    args = mock_insert_attachment.call_args.args
+    assert args[:5] == (
+        uploader.get_client.return_value, "/var/www/html", "foobar.png", "png", [
+            ("/tmp/stagingtmp/foobar.png", ".png"),
+            ("/tmp/stagingtmp/foobar-150x150.png", "-150x150.png"),
+            ("/tmp/stagingtmp/foobar-300x240.png", "-300x240.png"),
+            ("/tmp/stagingtmp/foobar-768x614.png", "-768x614.png")])
+    assert (args[5]["width"], args[5]["height"], args[5]["filesize"]) == (1000, 800, 1000)
+    assert {name: size["filesize"] for name, size in args[5]["sizes"].items()} == {
+        "medium": 300, "medium_large": 768, "thumbnail": 150}
+    # Removed by the SSH user, who staged them.
+    mock_execute.assert_called_once_with(
+        uploader.get_client.return_value,
+        "rm -f /tmp/stagingtmp/foobar.png /tmp/stagingtmp/foobar-150x150.png "
+        "/tmp/stagingtmp/foobar-300x240.png /tmp/stagingtmp/foobar-768x614.png")
+    img_processor.checkpoint.media_uploaded.assert_called_once_with(
+        {"id": 42, "media_details": {"file": "2022/07/foobar-1.png"}})
+    assert img_processor.checkpoint.replaced.call_args_list == [
+        call("/var/www/html/wp-content/uploads/2022/07/foobar-1-300x240.png"),
+        call("/var/www/html/wp-content/uploads/2022/07/foobar-1-768x614.png")]
+
+
+@patch("compressor.execute_remotely", autospec=True, return_value=(sentinel.out, []))
+def test_stage_eager(mock_execute_remotely):
+    img_processor, subdir_root = get_foobar_processor()
+    client = Mock()
+    stagings = [("/x/a.png", "/tmp/stagingtmp/a.png"), ("/x/b.png", "/tmp/stagingtmp/b.png")]
+    assert img_processor.stage(client, stagings) is client.open_sftp.return_value
+    client.open_sftp.return_value.put.assert_not_called()
+    assert img_processor.stage(client, stagings, eager=True) is None
+    assert client.open_sftp.return_value.put.call_args_list == [
+        call(*staging) for staging in stagings]
+    client.open_sftp.return_value.close.assert_called_once_with()
+
+
+@patch("compressor.ImgConvertor.install", autospec=True)
+@patch("compressor.ImgConvertor.stage", autospec=True)
+def test_upload_overlapped(mock_stage, mock_install):
+    img_processor, subdir_root = get_foobar_processor()
+    img_processor.upload_options = UploadOptions(overlap=True)
+    img_processor.widths_and_heights = [(42, 65), (84, 130)]
+    img_processor.path_to_resized_img = \
+        lambda w, h, suffix: "/x/y/z/png_q5_a/foobar-{}x{}.png".format(w, h)
+    staging = threading.Event()
+    mock_stage.side_effect = lambda *args, **kwargs: staging.set()
+
+    def upload_media(singular_source):
+        # Only answers once staging has begun, so would deadlock, but for
+        # the timeout, were they not at the same time.
+        assert staging.wait(10)
+        return Mock(json=Mock(return_value={
+            "id": 8, "media_details": {"file": "2022/07/foobar-1.png"}}))
+
+    uploader = Mock()
+    uploader.get_wp_api.return_value.upload_media.side_effect = upload_media
+    uploader.get_ssh_conf.return_value = {"wp_uploads": "/up", "username": "u"}
+    uploader.get_host_and_port.return_value = ("host", 22)
+    img_processor.upload("/x/y/z/png_q5_a", sentinel.conf_file, uploader)
+    mock_stage.assert_called_once_with(
+        img_processor, uploader.get_client.return_value, [
+            ("/x/y/z/png_q5_a/foobar-42x65.png", "/tmp/stagingtmp/foobar-42x65.png"),
+            ("/x/y/z/png_q5_a/foobar-84x130.png", "/tmp/stagingtmp/foobar-84x130.png")],
+        eager=True)
+    # Installed under the name WordPress gave the upload.
+    mock_install.assert_called_once_with(
+        img_processor, uploader.get_client.return_value, [
+            ("/x/y/z/png_q5_a/foobar-42x65.png", "/tmp/stagingtmp/foobar-42x65.png",
+             "/up/2022/07/foobar-1-42x65.png"),
+            ("/x/y/z/png_q5_a/foobar-84x130.png", "/tmp/stagingtmp/foobar-84x130.png",
+             "/up/2022/07/foobar-1-84x130.png")])
+
+
 @patch("compressor.Path", autospec=True)
 @patch("compressor.get_client", autospec=True)
 @patch("compressor.execute_remotely", autospec=True, return_value=(sentinel.out, []))
@@ -0,0 +1,60 @@
+import os
+
+from output_cache import OutputCache
+
+
+def test_key_of():
+    cache = OutputCache("cache", "ImageMagick 6.9")
+    assert cache.key_of(["a", "b"]) == cache.key_of(["a", "b"])
+    assert cache.key_of(["a", "b"]) != cache.key_of(["ab"])
+    assert cache.key_of(["a"]) != OutputCache("cache", "ImageMagick 7.1").key_of(["a"])
+    assert cache.path_to("abc", "x/y.webp") == os.path.join("cache", "abc.webp")
+
+
+def test_fetch_and_store(tmp_path):
+    cache = OutputCache(str(tmp_path / "cache"), "IM")
+    output = tmp_path / "out.png"
+    assert not cache.fetch("k1", str(output))
+    output.write_bytes(b"pixels")
+    cache.store("k1", str(output))
+    output.unlink()
+    assert cache.fetch("k1", str(output))
+    assert output.read_bytes() == b"pixels"
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.describe() == "1 of 2 commands reused from {}.".format(cache.cache_dir)
+    assert os.listdir(cache.cache_dir) == ["k1.png"]
+
+
+def test_evict(tmp_path):
+    cache = OutputCache(str(tmp_path / "cache"), "IM", max_bytes=25)
+    output = tmp_path / "out.png"
+    output.write_bytes(b"x" * 10)
+    for i, key in enumerate(["k1", "k2"]):
+        cache.store(key, str(output))
+        os.utime(cache.path_to(key, str(output)), (1000 + i, 1000 + i))
+    # Using k1 makes k2 the least recently used.
+    assert cache.fetch("k1", str(output))
+    cache.store("k3", str(output))
+    assert sorted(os.listdir(cache.cache_dir)) == ["k1.png", "k3.png"]
+    assert cache.total_b == 20
+
+
+def test_evict_from_earlier_run(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    for i, key in enumerate(["k2", "k1"]):
+        (cache_dir / (key + ".png")).write_bytes(b"x" * 10)
+        os.utime(cache_dir / (key + ".png"), (1000 + i, 1000 + i))
+    (cache_dir / "k0.png.1.part").write_bytes(b"x")
+    cache = OutputCache(str(cache_dir), "IM", max_bytes=25)
+    assert (list(cache.entries), cache.total_b) == (
+        [str(cache_dir / "k2.png"), str(cache_dir / "k1.png")], 20)
+    output = tmp_path / "out.png"
+    output.write_bytes(b"x" * 10)
+    # Stored by another run since this one opened the cache.
+    (cache_dir / "k4.png").write_bytes(b"x" * 10)
+    assert cache.fetch("k4", str(output))
+    assert cache.total_b == 30
+    cache.store("k3", str(output))
+    assert sorted(os.listdir(cache_dir)) == ["k0.png.1.part", "k3.png", "k4.png"]
+    assert cache.total_b == 20
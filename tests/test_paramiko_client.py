@@ -1,10 +1,14 @@
+import io
+import shlex
+import tarfile
 from unittest.mock import patch, Mock, sentinel
 
 import pytest
 from paramiko.ssh_exception import AuthenticationException
 from paramiko.channel import ChannelFile
 
-from paramiko_client import get_client, filter_dict_for_creds, execute_remotely
+from paramiko_client import get_client, filter_dict_for_creds, execute_remotely, \
+    install_files, put_tar, put_concurrently, Transfer, get_remote_sha256s
 
 MOCK_CONFIG = {
     "host": "272.170.10.22",
@@ -88,3 +92,117 @@ Or perhaps I made this bit up?""".split("\n")
     mock_channel_out.readlines.assert_called_once_with()
     mock_channel_err.readlines.assert_called_once_with()
 
+
+
+@patch("paramiko_client.execute_remotely", autospec=True, return_value=(
+    ["/up/a-300x200.png\n"], ["mv: cannot stat '/tmp/b': No such file\n",
+                              "failed to install '/up/my b.png'\n"]))
+def test_install_files(mock_execute_remotely):
+    installed, errors = install_files(
+        sentinel.client, [("/tmp/a", "/up/a-300x200.png"), ("/tmp/b", "/up/my b.png")])
+    assert installed == ["/up/a-300x200.png"]
+    assert errors == ["mv: cannot stat '/tmp/b': No such file",
+                      "failed to install '/up/my b.png'"]
+    command = mock_execute_remotely.call_args.args[1]
+    assert command.startswith("sudo sh -c '")
+    script = shlex.split(command)[3].split("\n")
+    assert script == [
+        "if mv -f /tmp/a /up/a-300x200.png.part && "
+        "chown www-data:www-data /up/a-300x200.png.part && "
+        "mv -f /up/a-300x200.png.part /up/a-300x200.png; "
+        "then echo /up/a-300x200.png; "
+        "else echo failed to install /up/a-300x200.png >&2; fi",
+        "if mv -f /tmp/b '/up/my b.png.part' && "
+        "chown www-data:www-data '/up/my b.png.part' && "
+        "mv -f '/up/my b.png.part' '/up/my b.png'; "
+        "then echo '/up/my b.png'; "
+        "else echo failed to install '/up/my b.png' >&2; fi"]
+
+
+def get_tar_client(exit_status: int, errors: list):
+    stdin = io.BytesIO()
+    stdin.channel = Mock()
+    stdout, stderr = Mock(), Mock()
+    stdout.channel.recv_exit_status.return_value = exit_status
+    stderr.readlines.return_value = errors
+    client = Mock()
+    client.exec_command.return_value = stdin, stdout, stderr
+    return client, stdin
+
+
+def test_put_tar(tmp_path):
+    (tmp_path / "a.png").write_bytes(b"a" * 1000)
+    (tmp_path / "b.png").write_bytes(b"bb")
+    client, stdin = get_tar_client(0, [])
+    put_tar(client, "/tmp/staging dir", [
+        (str(tmp_path / "a.png"), "x-300x200.png"),
+        (str(tmp_path / "b.png"), "x-150x100.png")])
+    client.exec_command.assert_called_once_with(
+        "mkdir -p '/tmp/staging dir' && tar -x -C '/tmp/staging dir' -f -")
+    stdin.channel.shutdown_write.assert_called_once_with()
+    with tarfile.open(fileobj=io.BytesIO(stdin.getvalue())) as tar:
+        members = tar.getmembers()
+        assert [(m.name, m.size, m.mode) for m in members] == [
+            ("x-300x200.png", 1000, 0o644), ("x-150x100.png", 2, 0o644)]
+        assert tar.extractfile(members[1]).read() == b"bb"
+
+
+def test_put_tar_fails(tmp_path):
+    (tmp_path / "a.png").write_bytes(b"a")
+    client, stdin = get_tar_client(2, ["tar: x-300x200.png: Cannot open\n"])
+    with pytest.raises(RuntimeError) as rterr:
+        put_tar(client, "/tmp/stagingtmp",
+                [(str(tmp_path / "a.png"), "x-300x200.png")])
+    assert "tar -x exited 2: tar: x-300x200.png: Cannot open" in str(rterr)
+
+
+@patch("paramiko_client.SFTPClient.from_transport", autospec=True)
+def test_put_concurrently(mock_from_transport):
+    sftps = [Mock(), Mock()]
+    for sftp in sftps:
+        sftp.put.side_effect = lambda local_name, rmt_name: Mock(
+            st_size=len(rmt_name))
+    mock_from_transport.side_effect = sftps
+    client = Mock()
+    files = [("a", "/r/a"), ("bb", "/r/bb"), ("ccc", "/r/ccc")]
+    transfers = put_concurrently(client, files, channels=2, window_size=4096,
+                                 max_packet_size=1024)
+    assert [(t.rmt_name, t.n_bytes) for t in transfers] == [
+        ("/r/a", 4), ("/r/bb", 5), ("/r/ccc", 6)]
+    assert mock_from_transport.call_count == 2
+    mock_from_transport.assert_called_with(
+        client.get_transport.return_value, window_size=4096,
+        max_packet_size=1024)
+    assert sorted(c.args for sftp in sftps for c in sftp.put.call_args_list) \
+           == sorted(files)
+    for sftp in sftps:
+        sftp.close.assert_called_once_with()
+
+
+@patch("paramiko_client.SFTPClient.from_transport", autospec=True)
+def test_put_concurrently_fails(mock_from_transport):
+    mock_from_transport.return_value.put.side_effect = IOError("disk full")
+    with pytest.raises(IOError):
+        put_concurrently(Mock(), [("a", "/r/a")], channels=4)
+    # No more channels than files.
+    mock_from_transport.assert_called_once()
+    mock_from_transport.return_value.close.assert_called_once_with()
+
+
+def test_transfer_describe():
+    assert Transfer("/r/a.png", 2048 * 1024, 2.0).describe() == \
+           "/r/a.png: 2048KB in 2.00s, 1024KB/s"
+
+
+@patch("paramiko_client.execute_remotely", autospec=True, return_value=(
+    ["aa11  /up/a-300x200.png\n", "bb22  /up/my b.png\n",
+     "\\cc33  /up/odd\\nname.png\n"], []))
+def test_get_remote_sha256s(mock_execute_remotely):
+    assert get_remote_sha256s(sentinel.client, [
+        "/up/a-300x200.png", "/up/my b.png", "/up/missing.png"]) == {
+        "/up/a-300x200.png": "aa11", "/up/my b.png": "bb22"}
+    mock_execute_remotely.assert_called_once_with(
+        sentinel.client, "sha256sum -- /up/a-300x200.png '/up/my b.png' "
+                         "/up/missing.png 2>/dev/null")
+    assert get_remote_sha256s(sentinel.client, []) == {}
+    mock_execute_remotely.assert_called_once()
@@ -0,0 +1,66 @@
+import threading
+from planner import CmdChain, CommandPlan
+
+
+def get_png_plan():
+    """Two variants whose unscaled commands, and first steps, match."""
+    plan = CommandPlan()
+    plan.add_chain("inc", CmdChain([["convert", "-colors", "8", "src", "inc/out"]], []))
+    plan.add_chain("inc", CmdChain([["convert", "-resize", "4x3", "-colors", "8", "src", "inc/out-4x3"]], []))
+    plan.add_chain("aft", CmdChain([["convert", "-colors", "8", "src", "aft/out"]], []))
+    plan.add_chain("aft", CmdChain([
+        ["convert", "-resize", "4x3", "src", "aft/tmp"],
+        ["convert", "-colors", "8", "aft/tmp", "aft/out-4x3"]], ["aft/tmp"]))
+    plan.add_chain("aft2", CmdChain([
+        ["convert", "-resize", "4x3", "src", "aft2/tmp"],
+        ["convert", "-colors", "8", "aft2/tmp", "aft2/out-4x3"]], ["aft2/tmp"]))
+    return plan
+
+
+def test_add_chain_deduplicates():
+    plan = get_png_plan()
+    assert plan.naive_count == 7
+    assert plan.describe() == "7 commands planned, 4 after deduplication."
+    assert plan.nodes[0].outputs == ["inc/out", "aft/out"]
+    assert plan.nodes[0].owners == {"inc", "aft"}
+    assert plan.nodes[2].outputs == ["aft/tmp", "aft2/tmp"]
+    assert plan.nodes[3].outputs == ["aft/out-4x3", "aft2/out-4x3"]
+    assert plan.nodes[3].deps == {2}
+    assert plan.tmp_imgs == ["aft/tmp", "aft2/tmp"]
+
+
+def test_add_chain_keeps_formats_apart():
+    plan = CommandPlan()
+    plan.add_chain("png", CmdChain([["convert", "-quality", "60", "src", "png/out.png"]], []))
+    plan.add_chain("webp", CmdChain([["convert", "-quality", "60", "src", "webp/out.webp"]], []))
+    plan.add_chain("WEBP", CmdChain([["convert", "-quality", "60", "src", "WEBP/out.WEBP"]], []))
+    assert plan.describe() == "3 commands planned, 2 after deduplication."
+    assert plan.nodes[0].outputs == ["png/out.png"]
+    assert plan.nodes[1].outputs == ["webp/out.webp", "WEBP/out.WEBP"]
+
+
+def test_run_respects_deps():
+    plan = get_png_plan()
+    ran = []
+    lock = threading.Lock()
+
+    def run_node(node):
+        with lock:
+            assert node.deps <= {n.node_id for n in ran}
+            ran.append(node)
+    assert plan.run(run_node, jobs=4) == {}
+    assert sorted(n.node_id for n in ran) == [0, 1, 2, 3]
+
+
+def test_run_skips_dependents_of_failures():
+    plan = get_png_plan()
+    error = RuntimeError("no resize")
+
+    def run_node(node):
+        if node.node_id == 2:
+            raise error
+    errors = plan.run(run_node, jobs=1)
+    assert errors == {2: error, 3: error}
+    assert plan.first_error_of("aft", errors) is error
+    assert plan.first_error_of("aft2", errors) is error
+    assert plan.first_error_of("inc", errors) is None
@@ -0,0 +1,59 @@
+import pytest
+
+from quality_search import VariantFamily, Measurement, QualitySearch
+
+
+def family_measured(n_bytes_of, score_of=lambda q: None, q_lo=1, q_hi=100):
+    measured = []
+
+    def measure(q):
+        measured.append(q)
+        return Measurement(n_bytes_of(q), score_of(q))
+    return VariantFamily(lambda q: q, q_lo, q_hi), measure, measured
+
+
+def test_needs_a_target():
+    family, measure, _ = family_measured(lambda q: q)
+    with pytest.raises(ValueError):
+        QualitySearch(family, measure)
+
+
+@pytest.mark.parametrize("max_bytes,expected_q", [
+    (1000, 100), (550, 55), (100, 10), (10, 1), (9, None)])
+def test_search_highest_fitting(max_bytes, expected_q):
+    family, measure, measured = family_measured(lambda q: 10 * q)
+    searcher = QualitySearch(family, measure, max_bytes=max_bytes)
+    assert searcher.search() == expected_q
+    assert len(measured) == len(set(measured)) <= 9
+
+
+def test_search_highest_fitting_stops_when_not_shrinking():
+    family, measure, measured = family_measured(lambda q: max(500, 10 * q))
+    searcher = QualitySearch(family, measure, max_bytes=400)
+    assert searcher.search() is None
+    assert measured == [100, 50, 25]
+
+
+@pytest.mark.parametrize("min_score,expected_q", [
+    (30.0, 25), (40.0, 50), (55.5, 89), (60.0, 100), (61.0, None)])
+def test_search_lowest_scoring(min_score, expected_q):
+    family, measure, measured = family_measured(
+        lambda q: 10 * q, lambda q: 20 + 0.4 * q)
+    searcher = QualitySearch(family, measure, min_score=min_score)
+    assert searcher.search() == expected_q
+    assert len(measured) <= 9
+
+
+def test_search_lowest_scoring_must_fit():
+    family, measure, measured = family_measured(
+        lambda q: 10 * q, lambda q: 20 + 0.4 * q)
+    assert QualitySearch(family, measure, 500, 40.0).search() == 50
+    assert QualitySearch(family, measure, 400, 40.0).search() is None
+
+
+def test_search_lowest_scoring_stops_when_not_shrinking():
+    family, measure, measured = family_measured(
+        lambda q: max(700, 10 * q), lambda q: 20 + 0.4 * q)
+    searcher = QualitySearch(family, measure, min_score=30.0)
+    assert searcher.search() == 50
+    assert measured == [100, 50, 25]
@@ -0,0 +1,111 @@
+from pathlib import Path
+from unittest.mock import patch, call
+
+import pytest
+
+from resize_cache import ResizeCache
+
+
+def fake_convert(split_cmd):
+    """Writes a 100 byte .mpc and .cache, as if resizing."""
+    resized_src = Path(split_cmd[-1])
+    resized_src.write_bytes(b"m" * 10)
+    resized_src.with_suffix(".cache").write_bytes(b"c" * 90)
+
+
+@pytest.fixture
+def mock_convert():
+    with patch("resize_cache.cmn.run_shell_cmd_or_raise", autospec=True,
+               side_effect=fake_convert) as mock_run_shell:
+        yield mock_run_shell
+
+
+def test_path_to(tmp_path):
+    cache = ResizeCache(str(tmp_path))
+    assert cache.path_to("a/b/src.mpc", 42, 65) == str(tmp_path / "src-42x65.mpc")
+
+
+def test_resized_made_once(tmp_path, mock_convert):
+    cache = ResizeCache(str(tmp_path / "cache"))
+    with cache.resized("src.png", 42, 65) as resized_src:
+        assert Path(resized_src).is_file()
+    with cache.resized("src.png", 42, 65) as again:
+        assert again == resized_src
+    mock_convert.assert_called_once_with(
+        ["convert", "src.png", "-resize", "42x65", resized_src])
+    assert cache.entries == {("src.png", 42, 65): 100}
+
+
+def test_resized_evicts_least_recently_used(tmp_path, mock_convert):
+    cache = ResizeCache(str(tmp_path), max_bytes=200)
+    for w in (1, 2, 3):
+        with cache.resized("src.png", w, w):
+            pass
+    assert list(cache.entries) == [("src.png", 2, 2), ("src.png", 3, 3)]
+    assert not Path(cache.path_to("src.png", 1, 1)).exists()
+    assert not (tmp_path / "src-1x1.cache").exists()
+    with cache.resized("src.png", 2, 2):
+        pass
+    with cache.resized("src.png", 4, 4):
+        pass
+    assert list(cache.entries) == [("src.png", 2, 2), ("src.png", 4, 4)]
+    assert len(mock_convert.mock_calls) == 4
+
+
+def test_resized_wont_evict_pinned(tmp_path, mock_convert):
+    cache = ResizeCache(str(tmp_path), max_bytes=100)
+    with cache.resized("src.png", 1, 1) as pinned:
+        with cache.resized("src.png", 2, 2):
+            assert Path(pinned).is_file()
+            assert len(cache.entries) == 2
+    with cache.resized("src.png", 3, 3):
+        pass
+    assert list(cache.entries) == [("src.png", 3, 3)]
+
+
+def test_clear(tmp_path, mock_convert):
+    cache = ResizeCache(str(tmp_path / "cache"))
+    with cache.resized("src.png", 1, 1):
+        pass
+    cache.clear()
+    assert cache.entries == {}
+    assert not (tmp_path / "cache").exists()
+
+
+def test_parent_of():
+    cache = ResizeCache("", pyramid=[(768, 576), (300, 225), (2048, 1536), (1024, 768)])
+    assert cache.parent_of(2048, 1536) is None
+    assert cache.parent_of(1024, 768) == (2048, 1536)
+    assert cache.parent_of(300, 225) == (768, 576)
+    assert ResizeCache("").parent_of(300, 225) is None
+
+
+def test_resized_pyramid(tmp_path, mock_convert):
+    cache = ResizeCache(str(tmp_path), pyramid=[(300, 225), (768, 576)])
+    with cache.resized("src.png", 300, 225):
+        pass
+    mock_convert.assert_has_calls([
+        call(["convert", "src.png", "-resize", "768x576",
+              str(tmp_path / "src-768x576.mpc")]),
+        call(["convert", str(tmp_path / "src-768x576.mpc"), "-resize",
+              "300x225!", str(tmp_path / "src-300x225.mpc")]),
+    ])
+    assert cache.psnrs == {}
+
+
+@pytest.mark.parametrize("psnr,replaced", [(45.0, False), (35.0, True)])
+def test_resized_pyramid_fidelity(tmp_path, mock_convert, psnr, replaced):
+    cache = ResizeCache(str(tmp_path), pyramid=[(300, 225), (768, 576)],
+                        min_psnr=40.0)
+    with patch("resize_cache.cmn.get_psnr", autospec=True,
+               return_value=psnr) as mock_psnr:
+        with cache.resized("src.png", 300, 225):
+            pass
+    direct_img = str(tmp_path / "src-300x225-direct.mpc")
+    mock_convert.assert_called_with(
+        ["convert", "src.png", "-resize", "300x225", direct_img])
+    mock_psnr.assert_called_once_with(
+        direct_img, str(tmp_path / "src-300x225.mpc"))
+    assert cache.psnrs == {(300, 225): psnr}
+    assert not Path(direct_img).exists()
+    assert (tmp_path / "src-300x225.mpc").exists()
@@ -110,3 +110,20 @@ def test_ResolutionsList_round_halves_up(decimal,integer):
 def test_ResolutionsList_round(decimal,integer):
     assert ResolutionsList.round(decimal) == integer
 
+
+
+@pytest.mark.parametrize("source_size", [
+    (728, 450), (1020, 741), (300, 1200), (900, 1080), (4000, 3000), (100, 100)])
+def test_get_named_sizes(source_size):
+    scaler = ImgScaler(*source_size)
+    named = scaler.get_named_sizes()
+    widths_and_heights, thmb = scaler.get_widths_and_heights()
+    assert named.pop("thumbnail", None) == thmb
+    assert sorted(named.values()) == widths_and_heights
+
+
+def test_get_named_sizes_names():
+    assert ImgScaler(4000, 3000).get_named_sizes() == {
+        "medium_large": (768, 576), "medium": (300, 225), "large": (1024, 768),
+        "1536x1536": (1536, 1152), "2048x2048": (2048, 1536),
+        "thumbnail": (150, 150)}
@@ -0,0 +1,103 @@
+from unittest.mock import patch, Mock, call
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from scoring import Score, Scorer, decode, decode_by_pillow, psnr, ssim, \
+    box_means
+
+
+def gradient(w, h):
+    x = np.arange(w * h * 3, dtype=np.float64).reshape(h, w, 3)
+    return (x * 255 / x.max()).astype(np.uint8)
+
+
+def ppm_of(rgb):
+    h, w = rgb.shape[:2]
+    return "P6\n{} {}\n255\n".format(w, h).encode() + rgb.tobytes()
+
+
+@patch("scoring.Image", None)
+@patch("scoring.subprocess.run", autospec=True)
+def test_decode(mock_run):
+    # Pixels starting with bytes which look like whitespace.
+    rgb = np.full((3, 2, 3), 32, dtype=np.uint8)
+    rgb[0, 0] = [10, 13, 9]
+    mock_run.return_value = Mock(returncode=0, stdout=ppm_of(rgb))
+    assert (decode("foo.png", (2, 3)) == rgb).all()
+    mock_run.assert_called_once_with(
+        ["convert", "foo.png", "-resize", "2x3!", "-background", "white",
+         "-alpha", "remove", "-depth", "8", "ppm:-"], capture_output=True)
+    mock_run.return_value = Mock(returncode=1, stderr=b"no such file")
+    with pytest.raises(RuntimeError) as rterr:
+        decode("foo.png")
+    assert "no such file" in str(rterr)
+
+
+def test_decode_by_pillow(tmp_path):
+    image = pytest.importorskip("PIL.Image")
+    rgba = np.zeros((4, 6, 4), dtype=np.uint8)
+    rgba[:, :3] = [255, 0, 0, 255]
+    img_name = str(tmp_path / "half.png")
+    image.fromarray(rgba).save(img_name)
+    rgb = decode_by_pillow(img_name)
+    assert rgb.shape == (4, 6, 3)
+    # Transparent is flattened onto white.
+    assert rgb[0, 0].tolist() == [255, 0, 0]
+    assert rgb[0, 5].tolist() == [255, 255, 255]
+    assert decode_by_pillow(img_name, (3, 2)).shape == (2, 3, 3)
+    image.fromarray(np.zeros((4, 6), dtype=np.uint16)).save(
+        str(tmp_path / "deep.png"))
+    assert decode_by_pillow(str(tmp_path / "deep.png")) is None
+    (tmp_path / "src.mpc").write_text("id=ImageMagick")
+    assert decode_by_pillow(str(tmp_path / "src.mpc")) is None
+
+
+@patch("scoring.decode_by_convert", autospec=True)
+@patch("scoring.decode_by_pillow", autospec=True, return_value=None)
+def test_decode_falls_back(mock_by_pillow, mock_by_convert):
+    assert decode("src.mpc", (2, 3)) == mock_by_convert.return_value
+    mock_by_pillow.assert_called_once_with("src.mpc", (2, 3))
+    mock_by_convert.assert_called_once_with("src.mpc", (2, 3))
+
+
+def test_psnr():
+    a = gradient(20, 10)
+    assert psnr(a, a) is None
+    b = a.astype(np.int16)
+    b[0, 0, 0] += 5 if b[0, 0, 0] < 250 else -5
+    assert psnr(a, b) == pytest.approx(10 * np.log10(255 ** 2 / (25 / 600)))
+
+
+def test_box_means():
+    x = np.arange(12, dtype=np.float64).reshape(3, 4)
+    assert box_means(x, 2).tolist() == [[2.5, 3.5, 4.5], [6.5, 7.5, 8.5]]
+
+
+def test_ssim():
+    a = gradient(64, 48)
+    assert ssim(a, a) == pytest.approx(1.0)
+    noisy = np.clip(a + np.random.default_rng(1).normal(0, 20, a.shape), 0, 255)
+    assert 0 < ssim(a, noisy.astype(np.uint8)) < 0.9
+    # Smaller than a window, and large enough to be averaged down first.
+    assert ssim(a[:4, :5], a[:4, :5]) == pytest.approx(1.0)
+    big = gradient(1200, 800)
+    assert ssim(big, big) == pytest.approx(1.0)
+
+
+@patch("scoring.decode", autospec=True)
+def test_scorer(mock_decode):
+    candidate = gradient(20, 10)
+    mock_decode.side_effect = lambda img, size=None: candidate
+    scorer = Scorer("src.png")
+    assert scorer.score("a.webp") == Score(pytest.approx(1.0), None)
+    scorer.score("b.webp")
+    assert mock_decode.mock_calls == [
+        call("a.webp"), call("src.png", (20, 10)), call("b.webp")]
+
+
+@patch("scoring.np", None)
+def test_scorer_needs_numpy():
+    with pytest.raises(ImportError):
+        Scorer("src.png")
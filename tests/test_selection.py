@@ -0,0 +1,52 @@
+import pytest
+
+from scoring import Score
+from selection import Candidate, SelectionPolicy
+
+CANDIDATES = [
+    Candidate(30 * 1024, "tmp/webp_q80_inc_resize", "webp", Score(0.99, 41.0)),
+    Candidate(20 * 1024, "tmp/webp_q50_inc_resize", "webp", Score(0.96, 36.0)),
+    Candidate(25 * 1024, "tmp/png_q64_aft_resize", "png", Score(0.97, 38.0)),
+    Candidate(50 * 1024, "tmp/png_q255_aft_resize", "png", Score(1.0, None)),
+]
+
+
+def test_parse():
+    policy = SelectionPolicy.parse("min_ssim=0.98, max_kb=40,prefer=webp/png")
+    assert (policy.min_ssim, policy.min_psnr, policy.max_kb, policy.prefer) == \
+           (0.98, None, 40, ["webp", "png"])
+    assert policy.needs_scores()
+    assert not SelectionPolicy.parse("max_kb=40").needs_scores()
+
+
+@pytest.mark.parametrize("spec", ["max_ssim=0.98", "min_ssim", "min_ssim=x"])
+def test_parse_bad(spec):
+    with pytest.raises(ValueError):
+        SelectionPolicy.parse(spec)
+
+
+@pytest.mark.parametrize("spec,expected", [
+    ("", "tmp/webp_q50_inc_resize"),
+    ("min_ssim=0.97", "tmp/png_q64_aft_resize"),
+    ("min_psnr=40", "tmp/webp_q80_inc_resize"),
+    ("min_psnr=42", "tmp/png_q255_aft_resize"),
+    ("max_kb=29,prefer=png", "tmp/png_q64_aft_resize"),
+    ("max_kb=24,prefer=png/webp", "tmp/webp_q50_inc_resize"),
+    ("max_kb=19", None),
+])
+def test_choose(spec, expected):
+    chosen, reason = SelectionPolicy.parse(spec).choose(CANDIDATES)
+    assert (chosen.subdir_name if chosen else None) == expected
+
+
+def test_choose_reason():
+    policy = SelectionPolicy.parse("min_ssim=0.97,max_kb=40,prefer=webp")
+    assert policy.choose(CANDIDATES) == (
+        CANDIDATES[0],
+        "2 of 4 candidates met SSIM >= 0.97 and <= 40KB; smallest webp chosen")
+
+
+def test_choose_unscored():
+    unscored = [c._replace(score=None) for c in CANDIDATES]
+    assert SelectionPolicy.parse("min_ssim=0.5").choose(unscored)[0] is None
+    assert SelectionPolicy.parse("max_kb=40").choose(unscored)[0] == unscored[1]
@@ -0,0 +1,126 @@
+"""
+The upload path against the stand-in WordPress host of conftest.py, over
+real SSH and HTTP, rather than mocked.
+"""
+import os
+import shutil
+import time
+
+import pytest
+import requests
+
+from compressor import ImgConvertor, Uploader, UploadOptions
+from stand_in import Link
+from paramiko_client import filter_dict_for_creds
+
+WIDTHS_AND_HEIGHTS = [(300, 200), (768, 512), (1024, 683)]
+
+
+def get_chosen(tmp_path) -> ImgConvertor:
+    """A processor whose chosen variant's images are made up, not made."""
+    img_processor = ImgConvertor("foobar.png", WIDTHS_AND_HEIGHTS,
+                                 str(tmp_path / "tmp"))
+    img_processor.subdir_name = str(tmp_path / "tmp" / "png_q64_inc_resize")
+    os.makedirs(img_processor.subdir_name)
+    for w, h in WIDTHS_AND_HEIGHTS:
+        with open(img_processor.path_to_resized_img(w, h, "png"), "wb") as f_out:
+            f_out.write("ours at {}x{}".format(w, h).encode() * w)
+    return img_processor
+
+
+def replace_sizes(img_processor: ImgConvertor, conf_file: str, rmt_file: str):
+    uploader = Uploader(conf_file)
+    try:
+        conf = uploader.get_ssh_conf()
+        img_processor.replace_generated_sizes(
+            *uploader.get_host_and_port(), filter_dict_for_creds(conf), "png",
+            os.path.join(conf["wp_uploads"], rmt_file), uploader.get_client())
+    finally:
+        uploader.close()
+
+
+@pytest.mark.parametrize("upload_options", [
+    UploadOptions(),
+    UploadOptions(one_trip=True),
+    UploadOptions(transport="tar"),
+    UploadOptions(transport="tar", one_trip=True),
+    UploadOptions(sftp_channels=3, sftp_window_kb=64, sftp_packet_kb=8),
+])
+def test_replace_generated_sizes(stand_in_wordpress, tmp_path, upload_options):
+    wordpress = stand_in_wordpress()
+    media = wordpress.rest.add_media("foobar.png", b"full size")
+    rmt_file = media["media_details"]["file"]
+    rmt_dir = os.path.join(wordpress.uploads_dir, os.path.dirname(rmt_file))
+    for w, h in WIDTHS_AND_HEIGHTS:
+        with open(os.path.join(rmt_dir, "foobar-{}x{}.png".format(w, h)), "w") as f_out:
+            f_out.write("WordPress' own")
+    img_processor = get_chosen(tmp_path)
+    img_processor.upload_options = upload_options
+    replace_sizes(img_processor, wordpress.conf_file, rmt_file)
+    for w, h in WIDTHS_AND_HEIGHTS:
+        with open(img_processor.path_to_resized_img(w, h, "png"), "rb") as f_in:
+            ours = f_in.read()
+        with open(os.path.join(rmt_dir, "foobar-{}x{}.png".format(w, h)), "rb") as f_in:
+            assert f_in.read() == ours
+    assert not [name for name in os.listdir(rmt_dir) if name.endswith(".part")]
+
+
+def test_replace_generated_sizes_delta(stand_in_wordpress, tmp_path, capsys):
+    wordpress = stand_in_wordpress()
+    rmt_file = wordpress.rest.add_media("foobar.png", b"full size")[
+        "media_details"]["file"]
+    img_processor = get_chosen(tmp_path)
+    img_processor.upload_options = UploadOptions(delta=True)
+    replace_sizes(img_processor, wordpress.conf_file, rmt_file)
+    assert "0 of 3 sizes already on the server" in capsys.readouterr().out
+    replace_sizes(img_processor, wordpress.conf_file, rmt_file)
+    assert "3 of 3 sizes already on the server" in capsys.readouterr().out
+
+
+def test_upload_prescaled(stand_in_wordpress, tmp_path):
+    wordpress = stand_in_wordpress()
+    img_processor = get_chosen(tmp_path)
+    shutil.copyfile("white_100x100.png", img_processor.path_to_new_img("png"))
+    img_processor.named_sizes = {"medium": (300, 200), "large": (1024, 683)}
+    img_processor.staging_dir = str(tmp_path / "staging")
+    uploader = Uploader(wordpress.conf_file)
+    try:
+        media = img_processor.upload_prescaled(
+            img_processor.subdir_name, "png", uploader)
+    finally:
+        uploader.close()
+    installed = ["foobar-1024x683.png", "foobar-300x200.png", "foobar.png"]
+    rmt_dir = os.path.join(wordpress.uploads_dir,
+                           os.path.dirname(media["media_details"]["file"]))
+    assert sorted(os.listdir(rmt_dir)) == installed
+    # Nothing left staged.
+    assert os.listdir(img_processor.staging_dir) == []
+
+
+def test_fake_media_endpoint(stand_in_wordpress):
+    wordpress = stand_in_wordpress(Link(latency_ms=100), regenerate_ms=50)
+    url = wordpress.rest.get_url() + "/wp-json/wp/v2/media"
+    start = time.monotonic()
+    response = requests.post(
+        url, data=b"raw", headers={
+            "Content-Disposition": "attachment; filename=foobar.png"})
+    assert time.monotonic() - start >= 0.15
+    assert response.status_code == 201
+    first = response.json()
+    second = requests.post(url, files={"file": ("foobar.png", b"multipart")}).json()
+    assert second["id"] == first["id"] + 1
+    # Made unique, as WordPress would.
+    assert second["media_details"]["file"] == \
+           first["media_details"]["file"].replace("foobar", "foobar-1")
+    with open(os.path.join(wordpress.uploads_dir, second["media_details"]["file"]), "rb") as f_in:
+        assert f_in.read() == b"multipart"
+    assert requests.post(wordpress.rest.get_url() + "/wp-json/wp/v2/posts").status_code == 404
+
+
+def test_link_bandwidth(stand_in_wordpress):
+    wordpress = stand_in_wordpress(Link(bandwidth_kbps=800))
+    start = time.monotonic()
+    requests.post(wordpress.rest.get_url() + "/wp-json/wp/v2/media", data=b"x" * 20000,
+                  headers={"Content-Disposition": "attachment; filename=a.png"})
+    # 160 kbit at 800 kbit/s.
+    assert time.monotonic() - start >= 0.2
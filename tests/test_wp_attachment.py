@@ -0,0 +1,69 @@
+import json
+import shlex
+from unittest.mock import patch, sentinel
+
+import pytest
+
+from wp_attachment import get_attachment_metadata, insert_attachment, php_string
+
+
+def test_get_attachment_metadata():
+    metadata = get_attachment_metadata(
+        1000, 800, "webp", 54321,
+        {"medium": (300, 240, 2000), "thumbnail": (150, 150, 900)})
+    assert metadata["width"] == 1000
+    assert metadata["height"] == 800
+    assert metadata["filesize"] == 54321
+    assert metadata["sizes"] == {
+        "medium": {"file": "-300x240.webp", "width": 300, "height": 240,
+                   "mime-type": "image/webp", "filesize": 2000},
+        "thumbnail": {"file": "-150x150.webp", "width": 150, "height": 150,
+                      "mime-type": "image/webp", "filesize": 900}}
+    assert metadata["image_meta"]["keywords"] == []
+
+
+def test_get_attachment_metadata_jxl():
+    metadata = get_attachment_metadata(
+        1000, 800, "jxl", 54321, {"medium": (300, 240, 2000)})
+    assert metadata["sizes"]["medium"]["file"] == "-300x240.jxl"
+    assert metadata["sizes"]["medium"]["mime-type"] == "image/jxl"
+
+
+def test_php_string():
+    assert php_string("it's a\\b") == "'it\\'s a\\\\b'"
+
+
+@patch("wp_attachment.execute_remotely", autospec=True, return_value=(
+    ["Notice: something\n", '{"id":42,"file":"2022\\/07\\/foo-1.png"}\n'], []))
+def test_insert_attachment(mock_execute_remotely):
+    metadata = get_attachment_metadata(1000, 800, "png", 1, {})
+    assert insert_attachment(
+        sentinel.client, "/var/www/html", "foo.png", "png",
+        [("/tmp/stagingtmp/foo.png", ".png"),
+         ("/tmp/stagingtmp/foo-300x240.png", "-300x240.png")],
+        metadata) == (42, "2022/07/foo-1.png")
+    command = shlex.split(mock_execute_remotely.call_args.args[1])
+    assert command[:5] == ["sudo", "-u", "www-data", "wp", "--path=/var/www/html"]
+    assert command[5] == "eval"
+    php = command[6]
+    first_line = php.split("\n")[0]
+    assert first_line.startswith("$args = json_decode('")
+    args = json.loads(first_line[len("$args = json_decode('"):-len("', true);")])
+    assert args == {
+        "name": "foo.png", "mime_type": "image/png",
+        "files": [["/tmp/stagingtmp/foo.png", ".png"],
+                  ["/tmp/stagingtmp/foo-300x240.png", "-300x240.png"]],
+        "metadata": metadata}
+    assert "wp_insert_attachment(" in php
+    # WP-CLI's user can't remove what the SSH user staged.
+    assert "unlink(" not in php
+    assert "wp_update_attachment_metadata($id, $meta);" in php
+
+
+@patch("wp_attachment.execute_remotely", autospec=True, return_value=(
+    [], ["failed to install foo-300x240.png\n"]))
+def test_insert_attachment_fails(mock_execute_remotely):
+    with pytest.raises(RuntimeError) as rterr:
+        insert_attachment(sentinel.client, "/var/www/html", "foo.png", "png",
+                          [], get_attachment_metadata(1, 1, "png", 1, {}))
+    assert "failed to install foo-300x240.png" in str(rterr)